@@ -0,0 +1,317 @@
+import argparse
+import sys
+import time
+
+from .model.board import Board
+from .model.player import Player
+from .preprocess import state_map_from_pgn
+from .repertoire.analytics import analyze, format_stats
+from .repertoire.deviations import find_deviations, forgotten_positions, format_deviations, write_priorities
+from .repertoire.diff import CommentReader, LineNames, diff_state_maps, format_diff, merge_repertoires
+from .repertoire.eco import load_eco_index
+from .repertoire.frequency import build_frequency_table
+from .repertoire.gaps import find_gaps, format_gaps
+from .repertoire.polyglot import write_polyglot
+from .repertoire.query import PositionIndex
+from .repertoire.search import load_comment_index
+from .repertoire.store import RepertoireStore
+from .repertoire.structures import STRUCTURES, PawnStructureIndex
+from .repertoire.synthetic import generate_repertoire
+from .repertoire.tensors import export_tensors as write_tensors
+from .repertoire.validate import validate_pgns
+from .repertoire.writer import write_pgn
+
+
+def export_polyglot(args: argparse.Namespace) -> int:
+    state_map = state_map_from_pgn(args.pgn)
+    write_polyglot(state_map, args.output)
+    return 0
+
+
+def export_pgn(args: argparse.Namespace) -> int:
+    state_map = None
+    for pgn in args.pgns:
+        state_map = state_map_from_pgn(pgn, state_map=state_map)
+    write_pgn(state_map, args.output)
+    return 0
+
+
+def export_tensors(args: argparse.Namespace) -> int:
+    state_map = None
+    for pgn in args.pgns:
+        state_map = state_map_from_pgn(pgn, state_map=state_map)
+    num_positions = write_tensors(state_map, args.output, batch_size=args.batch_size)
+    print("{} positions written to {}".format(num_positions, args.output), file=sys.stderr)
+    return 0
+
+
+def diff(args: argparse.Namespace) -> int:
+    old = state_map_from_pgn(args.old)
+    new = state_map_from_pgn(args.new)
+    for line in format_diff(diff_state_maps(old, new), old, new):
+        print(line)
+    if args.merged is not None:
+        write_pgn(merge_repertoires(old, new), args.merged)
+    return 0
+
+
+def deviations(args: argparse.Namespace) -> int:
+    state_map = None
+    for pgn in args.pgns:
+        state_map = state_map_from_pgn(pgn, state_map=state_map)
+    counts = find_deviations(state_map, args.database, args.player, max_ply=args.max_ply, workers=args.workers)
+    for line in format_deviations(counts, state_map, limit=args.limit):
+        print(line)
+    if args.priorities is not None:
+        write_priorities(forgotten_positions(counts), args.priorities)
+    return 0
+
+
+def frequencies(args: argparse.Namespace) -> int:
+    num_entries = build_frequency_table(
+        args.database,
+        args.output,
+        max_ply=args.max_ply,
+        min_count=args.min_count,
+        workers=args.workers,
+        max_entries=args.max_entries)
+    print("{} moves written to {}".format(num_entries, args.output), file=sys.stderr)
+    return 0
+
+
+def generate(args: argparse.Namespace) -> int:
+    num_lines = generate_repertoire(
+        args.output,
+        lines=args.lines,
+        depth=args.depth,
+        branching=args.branching,
+        comment_density=args.comments,
+        transposition_rate=args.transpositions,
+        chapters=args.chapters,
+        seed=args.seed)
+    print("{} lines written to {}".format(num_lines, args.output), file=sys.stderr)
+    return 0
+
+
+def gaps(args: argparse.Namespace) -> int:
+    state_map = None
+    for pgn in args.pgns:
+        state_map = state_map_from_pgn(pgn, state_map=state_map)
+    player = Player.WHITE if args.color == "white" else Player.BLACK
+    found = find_gaps(
+        state_map,
+        args.database,
+        player,
+        max_ply=args.max_ply,
+        min_count=args.min_count,
+        workers=args.workers)
+    for line in format_gaps(found, state_map):
+        print(line)
+    return 0
+
+
+def board_from_args(args: argparse.Namespace) -> Board:
+    """
+    The board described by the --fen option or by the moves played from the starting position.
+    """
+    board = Board.from_fen(args.fen) if args.fen is not None else Board()
+    for move in args.moves:
+        board = board.update(move)
+    return board
+
+
+def query(args: argparse.Namespace) -> int:
+    state_map = state_map_from_pgn(args.pgn)
+    index = PositionIndex(state_map)
+    start = time.perf_counter()
+    try:
+        positions = index.query(args.conditions)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    elapsed = time.perf_counter() - start
+    names = LineNames(state_map)
+    for state in sorted(positions, key=lambda state: len(names.line(state)))[:args.limit]:
+        print(names.line(state) or "the starting position")
+    print("{} of {} positions in {:.1f} ms".format(len(positions), len(index.states), elapsed * 1000), file=sys.stderr)
+    return 0
+
+
+def search(args: argparse.Namespace) -> int:
+    state_map = state_map_from_pgn(args.pgn)
+    results = load_comment_index(args.pgn, state_map).search(" ".join(args.terms))
+    names = LineNames(state_map)
+    comments = CommentReader()
+    nodes = {(state, node.move): node for state, continuations in state_map.items() for node in continuations}
+    for result in results[:args.limit]:
+        print("{:>3}  {}".format(result.score, names.line(result.state, result.move)))
+        print("     " + comments.comment(nodes[(result.state, result.move)]))
+    print("{} move{} found".format(len(results), "" if len(results) == 1 else "s"), file=sys.stderr)
+    return 0
+
+
+def stats(args: argparse.Namespace) -> int:
+    state_map = None
+    for pgn in args.pgns:
+        state_map = state_map_from_pgn(pgn, state_map=state_map)
+    index = load_eco_index(args.eco) if args.eco else None
+    start = time.perf_counter()
+    for line in format_stats(analyze(state_map, index=index)):
+        print(line)
+    print("Analyzed in {:.1f} ms".format((time.perf_counter() - start) * 1000), file=sys.stderr)
+    return 0
+
+
+def store_import(args: argparse.Namespace) -> int:
+    store = RepertoireStore(args.database)
+    for pgn in args.pgns:
+        store.import_pgn(args.name, pgn)
+    store.close()
+    return 0
+
+
+def store_query(args: argparse.Namespace) -> int:
+    store = RepertoireStore(args.database)
+    continuations = store.continuations(args.name, str(board_from_args(args)))
+    for node in sorted(continuations, key=lambda node: -node.depth):
+        print("{}\t{}\t{}".format(node.move, node.depth, node.comment))
+    store.close()
+    return 0
+
+
+def structures(args: argparse.Namespace) -> int:
+    state_map = state_map_from_pgn(args.pgn)
+    index = PawnStructureIndex(state_map)
+    names = LineNames(state_map)
+    for name, structure in STRUCTURES.items():
+        positions = index.named[name]
+        print("{}: {} positions".format(name, len(positions)))
+        print("    " + structure.description)
+        if positions:
+            print("    " + min((names.line(state) for state in positions), key=len))
+    print("{} distinct pawn structures".format(len(index.groups)), file=sys.stderr)
+    return 0
+
+
+def validate(args: argparse.Namespace) -> int:
+    num_issues = 0
+    for issue in validate_pgns(args.pgns, workers=args.workers):
+        print(issue)
+        num_issues += 1
+    print("{} issue{} found".format(num_issues, "" if num_issues == 1 else "s"), file=sys.stderr)
+    return 1 if num_issues else 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description="Headless repertoire tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    polyglot_parser = subparsers.add_parser("export-polyglot", help="Export a repertoire as a Polyglot book")
+    polyglot_parser.add_argument("pgn", help="The repertoire pgn")
+    polyglot_parser.add_argument("output", help="The .bin book to write")
+    polyglot_parser.set_defaults(handler=export_polyglot)
+
+    pgn_parser = subparsers.add_parser("export-pgn", help="Merge pgns into a single canonical pgn")
+    pgn_parser.add_argument("output", help="The pgn to write")
+    pgn_parser.add_argument("pgns", nargs="+", help="The pgns to merge")
+    pgn_parser.set_defaults(handler=export_pgn)
+
+    tensors_parser = subparsers.add_parser("export-tensors", help="Export every position as piece planes to a .npy file")
+    tensors_parser.add_argument("output", help="The .npy file to write")
+    tensors_parser.add_argument("pgns", nargs="+", help="The pgns of the repertoire")
+    tensors_parser.add_argument("--batch-size", type=int, default=65536, help="The number of positions encoded at once")
+    tensors_parser.set_defaults(handler=export_tensors)
+
+    diff_parser = subparsers.add_parser("diff", help="List the continuations added, removed or commented differently")
+    diff_parser.add_argument("old", help="The old or master pgn")
+    diff_parser.add_argument("new", help="The new pgn")
+    diff_parser.add_argument("--merged", help="Write both merged to this pgn, keeping the comments of the old pgn")
+    diff_parser.set_defaults(handler=diff)
+
+    deviations_parser = subparsers.add_parser("deviations", help="Find where the games of a player left the repertoire")
+    deviations_parser.add_argument("player", help="The name of the player in the White and Black tags")
+    deviations_parser.add_argument("database", help="The pgn export of the player's games")
+    deviations_parser.add_argument("pgns", nargs="+", help="The pgns of the repertoire")
+    deviations_parser.add_argument("--max-ply", type=int, default=40, help="The number of plies of every game to replay")
+    deviations_parser.add_argument("--limit", type=int, default=20, help="The number of positions to list")
+    deviations_parser.add_argument("--priorities", help="Write the forgotten positions to this file to drill them")
+    deviations_parser.add_argument("--workers", type=int, help="The number of processes, defaults to the number of processors")
+    deviations_parser.set_defaults(handler=deviations)
+
+    frequency_parser = subparsers.add_parser("frequencies", help="Count the moves played in a game database")
+    frequency_parser.add_argument("database", help="The pgn game database")
+    frequency_parser.add_argument("output", help="The frequency table to write")
+    frequency_parser.add_argument("--max-ply", type=int, default=20, help="The number of plies of every game to count")
+    frequency_parser.add_argument("--min-count", type=int, default=1, help="Leave out moves played fewer times")
+    frequency_parser.add_argument("--workers", type=int, help="The number of processes, defaults to the number of processors")
+    frequency_parser.add_argument("--max-entries", type=int, default=1000000, 
+                                  help="The number of moves a process counts in memory before spilling them to disk")
+    frequency_parser.set_defaults(handler=frequencies)
+
+    generate_parser = subparsers.add_parser("generate", help="Write a random repertoire of legal moves for benchmarks")
+    generate_parser.add_argument("output", help="The pgn to write")
+    generate_parser.add_argument("--lines", type=int, default=100, help="The number of lines")
+    generate_parser.add_argument("--depth", type=int, default=20, help="The number of moves of every line")
+    generate_parser.add_argument("--branching", type=int, default=3, help="The greatest number of continuations of a position")
+    generate_parser.add_argument("--comments", type=float, default=0.1, help="The share of moves with a comment")
+    generate_parser.add_argument("--transpositions", type=float, default=0.05, help="The share of lines transposing into another line")
+    generate_parser.add_argument("--chapters", type=int, default=1, help="The number of chapters")
+    generate_parser.add_argument("--seed", type=int, default=0, help="The same seed always writes the same pgn")
+    generate_parser.set_defaults(handler=generate)
+
+    gaps_parser = subparsers.add_parser("gaps", help="List the opponent replies played in a game database the repertoire misses")
+    gaps_parser.add_argument("color", choices=["white", "black"], help="The side the repertoire is played as")
+    gaps_parser.add_argument("database", help="The pgn game database")
+    gaps_parser.add_argument("pgns", nargs="+", help="The pgns of the repertoire")
+    gaps_parser.add_argument("--max-ply", type=int, default=20, help="The number of plies of every game to replay")
+    gaps_parser.add_argument("--min-count", type=int, default=1, help="Leave out replies played in fewer games")
+    gaps_parser.add_argument("--workers", type=int, help="The number of processes, defaults to the number of processors")
+    gaps_parser.set_defaults(handler=gaps)
+
+    query_positions_parser = subparsers.add_parser("query", help="List the positions of a repertoire meeting conditions")
+    query_positions_parser.add_argument("pgn", help="The pgn of the repertoire")
+    query_positions_parser.add_argument("conditions", nargs="+", 
+                                        help='Conditions like "Pe5" for a white pawn on e5, "q" for a black queen, "white" or '
+                                             '"black" to move, "check" or "material=KRPkr", negated by a leading "-"')
+    query_positions_parser.add_argument("--limit", type=int, default=50, help="The number of positions to list")
+    query_positions_parser.set_defaults(handler=query)
+
+    search_parser = subparsers.add_parser("search", help="Find the moves whose comments mention every term")
+    search_parser.add_argument("pgn", help="The pgn of the repertoire, its index is kept next to it")
+    search_parser.add_argument("terms", nargs="+", help='The terms to search for, i.e. "c5 break"')
+    search_parser.add_argument("--limit", type=int, default=20, help="The number of moves to list")
+    search_parser.set_defaults(handler=search)
+
+    stats_parser = subparsers.add_parser("stats", help="Count the positions, lines and memory of a repertoire")
+    stats_parser.add_argument("pgns", nargs="+", help="The pgns of the repertoire")
+    stats_parser.add_argument("--eco", default="eco/openings.tsv", help="The opening table to count the lines of every opening with, \"\" to skip")
+    stats_parser.set_defaults(handler=stats)
+
+    import_parser = subparsers.add_parser("store-import", help="Add pgns to a repertoire in a store")
+    import_parser.add_argument("database", help="The SQLite store, created if it does not exist")
+    import_parser.add_argument("name", help="The name of the repertoire")
+    import_parser.add_argument("pgns", nargs="+", help="The pgns to add")
+    import_parser.set_defaults(handler=store_import)
+
+    query_parser = subparsers.add_parser("store-query", help="List the continuations of a position")
+    query_parser.add_argument("database", help="The SQLite store")
+    query_parser.add_argument("name", help="The name of the repertoire")
+    query_parser.add_argument("moves", nargs="*", help="The moves leading to the position, i.e. e4 e6")
+    query_parser.add_argument("--fen", help="The position to start from instead of the starting position")
+    query_parser.set_defaults(handler=store_query)
+
+    structures_parser = subparsers.add_parser("structures", help="Count the positions of a repertoire in every named pawn structure")
+    structures_parser.add_argument("pgn", help="The pgn of the repertoire")
+    structures_parser.set_defaults(handler=structures)
+
+    validate_parser = subparsers.add_parser("validate", help="Report every move of pgns that can't be replayed")
+    validate_parser.add_argument("pgns", nargs="+", help="The pgns to validate")
+    validate_parser.add_argument("--workers", type=int, help="The number of processes, defaults to the number of processors")
+    validate_parser.set_defaults(handler=validate)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
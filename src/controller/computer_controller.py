@@ -1,6 +1,5 @@
 import sys
 import pygame
-import random
 
 from typing import List, Set, Dict
 
@@ -9,30 +8,41 @@ from .control_type import ControlType
 from ..view.board_view import BoardView
 from ..model.board import Board
 from ..preprocess import StateNode
+from ..repertoire.sampling import ContinuationSampler
+from ..repertoire.drill import Drill
 
 class ComputerController(Controller):
-    def __init__(self, state_map: Dict[str, Set[StateNode]]):
+    def __init__(self, 
+                state_map: Dict[str, Set[StateNode]], 
+                sampler: ContinuationSampler = None,
+                drill: Drill = None,
+                ready: Set[str] = None):
         self.state_map = state_map
+        self.sampler = sampler if sampler is not None else ContinuationSampler(state_map)
+        self.drill = drill
+        # While the repertoire is loading, the positions whose continuations are all known
+        self.ready = ready
 
     def handle_events(self, board_view: BoardView) -> ControlType:
         for event in pygame.event.get():
             if event.type == pygame.QUIT: 
                 sys.exit()
                 
-        possible_continuations = list(self.state_map[str(board_view.board_model)])
-        if not possible_continuations:
+        # Follow the drilled line while the player stays on it, otherwise pick any continuation
+        state = str(board_view.board_model)
+        node: StateNode = self.drill.next_move(state) if self.drill is not None else None
+        if node is None:
+            node = self.sampler.sample(state)
+        if node is None:
+            # The continuations may not be loaded yet, wait for them
             return ControlType.Computer
 
-        weights = list(map(lambda x: x.depth, possible_continuations))
-        node: StateNode = random.choices(possible_continuations, weights=weights, k=1)[0]
-
-        origin = board_view.board_model.get_move_origin(node.move)
-        dest = board_view.board_model.get_move_destination(node.move)
         new_board_model = Board(board_str=node.state)
-        board_view.update(new_board_model, origin, dest, comment=node.comment, move_str=node.move, append_detail=True)
+        board_view.update(new_board_model, node.origin, node.dest, comment=node.comment, move_str=node.move, append_detail=True)
 
         possible_continuations = self.state_map[str(new_board_model)]
-        if not possible_continuations:
+        line_loaded = self.ready is None or str(new_board_model) in self.ready
+        if not possible_continuations and line_loaded:
             board_view.prompt_for_restart = True
             return ControlType.Restart
         else:
@@ -6,6 +6,9 @@ from typing import List
 from .control_type import ControlType
 from ..view.board_view import BoardView
 
+# Shown when a move is made in a position whose continuations are still being loaded
+STILL_LOADING_NOTE = "Still loading the moves of this position, try again in a moment."
+
 class Controller(metaclass=abc.ABCMeta):
     @abc.abstractmethod
     def handle_events(self, board_view: BoardView) -> ControlType:
@@ -3,20 +3,27 @@ import sys
 
 from typing import Dict, List, Set, Tuple
 
-from .controller import Controller
+from .controller import STILL_LOADING_NOTE, Controller
 from .control_type import ControlType
 from ..view.board_view import BoardView
 from ..preprocess import StateNode
+from ..repertoire.similarity import SimilarityIndex
 
 
 class PlayerController(Controller):
     def __init__(self, 
                 state_map: Dict[str, Set[StateNode]], 
                 computer_response_enabled: bool = False, 
-                training_enabled: bool = True):
+                training_enabled: bool = True,
+                ready: Set[str] = None,
+                similar: SimilarityIndex = None):
         self.state_map = state_map
         self.computer_response_enabled = computer_response_enabled
         self.training_enabled = training_enabled
+        # While the repertoire is loading, the positions whose continuations are all known
+        self.ready = ready
+        # Shows the repertoire positions closest to the one a wrong move leads to
+        self.similar = similar
 
     def handle_events(self, board_view: BoardView) -> ControlType:
         new_control_type: ControlType = None
@@ -57,9 +64,13 @@ class PlayerController(Controller):
 
                 # Select the piece we pressed down on and display its legal moves and captures on the board.
                 piece_view.selected = True
-                legal_moves, legal_captures = piece_view.piece_model.legal_moves(board_view.board_model)
-                board_view.legal_moves_to_display = legal_moves
-                board_view.legal_captures_to_display = legal_captures
+                destinations = board_view.legal_moves.get(piece_view.piece_model.pos, set())
+                board_model = board_view.board_model
+                # The destination of an en passant capture is empty, captures are told apart by their notation
+                origin = piece_view.piece_model.pos
+                captures = {dest for dest in destinations if "x" in board_model.move_to_pgn_notation(origin, dest)}
+                board_view.legal_moves_to_display = [dest for dest in destinations if dest not in captures]
+                board_view.legal_captures_to_display = [dest for dest in destinations if dest in captures]
                 
                 # If we are holding the mouse button down, start moving the piece.
                 if pygame.mouse.get_pressed()[0]:
@@ -85,8 +96,7 @@ class PlayerController(Controller):
                     dest = tile.board_pos
 
                     # Check if the move is legal.
-                    move_type = board_model.is_legal_move(dest, moving_piece_view.piece_model)
-                    if move_type.is_legal():
+                    if dest in board_view.legal_moves.get(origin, ()):
                         # If we are attempting to promote a pawn, we need to promt the user to select which
                         # piece they want to promote to. We need to change the control type of the game to
                         # accomodate this.
@@ -103,24 +113,26 @@ class PlayerController(Controller):
                         
                         # If, however, this isn't a proper continuation in our state map we adjust the displayed hints
                         # and have the player make another move.
+                        # Moves can't be judged until every continuation of the position is loaded, without training
+                        # they aren't judged at all
+                        if self.training_enabled and self.ready is not None and str(board_model) not in self.ready:
+                            board_view.note = STILL_LOADING_NOTE
+                            return ControlType.Player
+
                         possible_continuations = self.state_map[str(board_model)]
                         if self.training_enabled and StateNode(move_pgn, str(new_board_model)) not in possible_continuations:
-                            move_origin = board_model.get_move_origin(move_pgn)
                             # At this point we know the move the player made was not a correct continuation but it may
                             # have been with a piece that has a correct move in the state map. If so we want to give the
                             # player a hint that the piece that was attempted to be moved was correct but the destination
                             # square was incorrect. Otherwise we want to tell the player that they should not try moving
                             # that piece again.
-                            correct_piece = False
-                            for node in possible_continuations:
-                                possible_move_origin = board_model.get_move_origin(node.move)
-                                if move_origin == possible_move_origin:
-                                    correct_piece = True
-                                    break
-                            if correct_piece:
+                            correct_origins = {node.origin for node in possible_continuations}
+                            if origin in correct_origins:
                                 board_view.positive_hints_to_display.add(origin)
                             else:
                                 board_view.negative_hints_to_display.add(origin)
+                            if self.similar is not None:
+                                board_view.note = self.similar.describe(str(new_board_model))
                             return ControlType.Player
                         else:
                             # In the case that the move was a proper continuation we update the board view with the new
@@ -135,7 +147,8 @@ class PlayerController(Controller):
                             # If there are no continuations from this line, prompt to restart the game
                             possible_continuations = self.state_map[str(new_board_model)]
 
-                            if self.training_enabled and not possible_continuations:
+                            line_loaded = self.ready is None or str(new_board_model) in self.ready
+                            if self.training_enabled and not possible_continuations and line_loaded:
                                 board_view.prompt_for_restart = True
                                 return ControlType.Restart
 
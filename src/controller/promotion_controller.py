@@ -2,23 +2,30 @@ import pygame
 
 from typing import List, Set, Dict
 
-from .controller import Controller
+from .controller import STILL_LOADING_NOTE, Controller
 from .control_type import ControlType
 from ..view.board_view import BoardView
 from ..view.promotion_view import PromotionView
 from ..view.utils.screen_pos import ScreenPos
 from ..model.player import Player
 from ..preprocess import StateNode
+from ..repertoire.similarity import SimilarityIndex
 
 
 class PromotionController(Controller):
     def __init__(self, 
                 state_map: Dict[str, Set[StateNode]], 
                 computer_response_enabled: bool = False, 
-                training_enabled: bool = True):
+                training_enabled: bool = True,
+                ready: Set[str] = None,
+                similar: SimilarityIndex = None):
         self.state_map = state_map
         self.computer_response_enabled = computer_response_enabled
         self.training_enabled = training_enabled
+        # While the repertoire is loading, the positions whose continuations are all known
+        self.ready = ready
+        # Shows the repertoire positions closest to the one a wrong move leads to
+        self.similar = similar
 
     def handle_events(self, board_view: BoardView) -> ControlType:
         new_control_type: ControlType = None
@@ -60,24 +67,26 @@ class PromotionController(Controller):
             
             # If, however, this isn't a proper continuation in our state map we adjust the displayed hints
             # and have the player make another move.
+            # Moves can't be judged until every continuation of the position is loaded, without training
+            # they aren't judged at all
+            if self.training_enabled and self.ready is not None and str(board_model) not in self.ready:
+                board_view.note = STILL_LOADING_NOTE
+                return ControlType.Player
+
             possible_continuations = self.state_map[str(board_model)]
             if self.training_enabled and StateNode(move_pgn, str(new_board_model)) not in possible_continuations:
-                move_origin = board_model.get_move_origin(move_pgn)
                 # At this point we know the move the player made was not a correct continuation but it may
                 # have been with a piece that has a correct move in the state map. If so we want to give the
                 # player a hint that the piece that was attempted to be moved was correct but the destination
                 # square was incorrect. Otherwise we want to tell the player that they should not try moving
                 # that piece again.
-                correct_piece = False
-                for node in possible_continuations:
-                    possible_move_origin = board_model.get_move_origin(node.move)
-                    if move_origin == possible_move_origin:
-                        correct_piece = True
-                        break
-                if correct_piece:
+                correct_origins = {node.origin for node in possible_continuations}
+                if origin in correct_origins:
                     board_view.positive_hints_to_display.add(origin)
                 else:
                     board_view.negative_hints_to_display.add(origin)
+                if self.similar is not None:
+                    board_view.note = self.similar.describe(str(new_board_model))
                 return ControlType.Player
             else:
                 # In the case that the move was a proper continuation we update the board view with the new
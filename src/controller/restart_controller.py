@@ -11,11 +11,14 @@ from ..view.utils.screen_pos import ScreenPos
 from ..model.player import Player
 from ..model.board import Board
 from ..preprocess import StateNode
+from ..repertoire.drill import Drill
 
 
 # TODO: IDEA: Restart screen should allow for changing whether computer is enabled!
 
 class RestartController(Controller):
+    def __init__(self, drill: Drill = None):
+        self.drill = drill
 
     def handle_events(self, board_view: BoardView) -> ControlType:
         new_control_type: ControlType = None
@@ -41,7 +44,9 @@ class RestartController(Controller):
         mouse_screen_pos = ScreenPos(mouse_pos[0], mouse_pos[1])
         clicked_restart = board_view.restart_view.click(mouse_screen_pos)
         if clicked_restart:
-            board_view.update(Board(), None, None)
+            # When drilling, restart from the drill position with a newly drawn line
+            board_model = self.drill.start() if self.drill is not None else Board()
+            board_view.update(board_model, None, None)
             return ControlType.Player
         else:
             return ControlType.Restart
\ No newline at end of file
@@ -1,16 +1,32 @@
 import pygame
 pygame.init()
 import os
+import sys
 
 from typing import Dict, Set
 
-from .preprocess import state_map_from_pgn, StateNode
+from .model.board import Board
+from .preprocess import all_states, state_map_from_pgn, StateNode
 from .controller.controller import Controller
 from .controller.control_type import ControlType
 from .controller.player_controller import PlayerController
 from .controller.computer_controller import ComputerController
 from .controller.promotion_controller import PromotionController
 from .controller.restart_controller import RestartController
+from .repertoire.sampling import ContinuationSampler, WeightStrategy
+from .repertoire.deviations import load_priorities
+from .repertoire.drill import Drill, drill_root
+from .repertoire.eco import Opening, OpeningTracker, load_eco_index
+from .repertoire.frequency import load_frequencies
+from .repertoire.incremental import IncrementalRepertoire
+from .repertoire.loader import LOADING_PLIES, RepertoireLoader
+from .repertoire.polyglot import PolyglotBook
+from .repertoire.query import PositionIndex
+from .repertoire.similarity import SimilarityIndex
+from .repertoire.store import RepertoireStore
+from .repertoire.structures import PawnStructureIndex
+from .repertoire.tensors import np
+from .repertoire.watcher import RepertoireReloader
 from .view.utils.colors import Colors
 from .view.board_view import BoardView
 from .view.utils.screen_pos import ScreenPos
@@ -22,16 +38,75 @@ DETAIL_PANEL_WIDTH = 300
 SCREEN_SIZE = (TILE_SIZE*8 + 3*BORDER + DETAIL_PANEL_WIDTH, TILE_SIZE*8 + 2*BORDER)
 COMPUTER_RESPONSE_ENABLED = True
 TRAINING_ENABLED = True
+COMPUTER_WEIGHT_STRATEGY = WeightStrategy.DEPTH
+# Table created with "python -m src.cli frequencies", used by WeightStrategy.FREQUENCY
+FREQUENCY_TABLE_PATH = None
+# Moves leading to the position to drill, i.e. ["e4", "e6", "d4", "d5", "e5"]. Every line below it is
+# equally likely to be drilled. Set to None to play freely from the starting position.
+DRILL_PREFIX = None
+# Drill the positions written by "python -m src.cli deviations --priorities", the positions forgotten
+# most often are drilled most often. Takes precedence over DRILL_PREFIX.
+DRILL_PRIORITIES_PATH = None
+# Drill the positions meeting every condition, i.e. ["Pe5", "pd5", "Q", "q"] for the advance French 
+# with queens on the board, see "python -m src.cli query". Takes precedence over DRILL_PREFIX.
+DRILL_QUERY = None
+# Drill the lines passing through a pawn structure, i.e. "french-advance", see STRUCTURES in
+# ./src/repertoire/structures.py. Takes precedence over DRILL_PREFIX.
+DRILL_STRUCTURE = None
+# Opening table in the format of the Lichess chess-openings tables, the opening of the position shown
+# is named in the detail panel. Set to None to disable.
+ECO_TABLE_PATH = "eco/openings.tsv"
+# After a wrong move show the repertoire positions closest to the one it leads to, requires numpy
+SIMILAR_POSITIONS_ENABLED = True
+# Train a repertoire from a store created with "python -m src.cli store-import" instead of a pgn
+REPERTOIRE_STORE_PATH = None
+REPERTOIRE_NAME = None
+# Pick up edits to the pgn while the trainer is running, only the edited chapters are parsed again
+HOT_RELOAD_ENABLED = True
+HOT_RELOAD_INTERVAL = 1.0
+# Show the board right away and load the pgn in the background, the opening moves of every chapter 
+# first. Drills need their whole subtree up front, so this is ignored when drilling.
+BACKGROUND_LOADING_ENABLED = True
 
 # TODO: Add accuracy tracker!!
 
 def main():
     pgn_path = os.path.join(os.getcwd(), "pgns/FrenchDefense.pgn")
-    state_map = state_map_from_pgn(pgn_path)
+    eco_index = load_eco_index(os.path.join(os.getcwd(), ECO_TABLE_PATH)) if ECO_TABLE_PATH is not None else None
+    similar_positions = SIMILAR_POSITIONS_ENABLED and np is not None
+    reloader = None
+    loader = None
+    if REPERTOIRE_STORE_PATH is not None:
+        # Repertoires in a store are queried as they are played, nothing is loaded up front
+        state_map = RepertoireStore(REPERTOIRE_STORE_PATH).open(REPERTOIRE_NAME)
+    elif pgn_path.endswith(".bin"):
+        # Polyglot books are used directly without any preprocessing
+        state_map = PolyglotBook(pgn_path)
+    elif BACKGROUND_LOADING_ENABLED and DRILL_PREFIX is None and DRILL_PRIORITIES_PATH is None and DRILL_QUERY is None and DRILL_STRUCTURE is None:
+        loader = RepertoireLoader(
+            pgn_path, 
+            plies=LOADING_PLIES, 
+            hot_reload_interval=HOT_RELOAD_INTERVAL if HOT_RELOAD_ENABLED else None,
+            eco_index=eco_index,
+            similar_positions=similar_positions,
+            frequency_table=FREQUENCY_TABLE_PATH)
+        state_map = loader.state_map
+    elif HOT_RELOAD_ENABLED:
+        reloader = RepertoireReloader(
+            IncrementalRepertoire(pgn_path), 
+            interval=HOT_RELOAD_INTERVAL, 
+            eco_index=eco_index,
+            similar_positions=similar_positions)
+        state_map = reloader.state_map
+    else:
+        state_map = state_map_from_pgn(pgn_path)
 
-    display_board(state_map)
+    display_board(state_map, reloader=reloader, loader=loader, eco_index=eco_index)
 
-def display_board(state_map: Dict[str, Set[StateNode]]):
+def display_board(state_map: Dict[str, Set[StateNode]], 
+                  reloader: RepertoireReloader = None, 
+                  loader: RepertoireLoader = None,
+                  eco_index: Dict[str, Opening] = None):
     image_directory = os.path.join(os.getcwd(), "sprites")
 
     game_display = pygame.display.set_mode(SCREEN_SIZE)
@@ -40,23 +115,87 @@ def display_board(state_map: Dict[str, Set[StateNode]]):
     icon = pygame.image.load(os.path.join(image_directory, "BLACK_Q.png"))
     pygame.display.set_icon(icon)
 
-    board_view = BoardView(image_directory, size=TILE_SIZE*8, board_offset=ScreenPos(BORDER, BORDER))
+    frequencies = None
+    if FREQUENCY_TABLE_PATH is not None and loader is not None:
+        # The positions of the repertoire are not known yet, the loader loads their moves once they are
+        frequencies = {}
+    elif FREQUENCY_TABLE_PATH is not None:
+        # Only the moves of the repertoire's positions are kept, those of repertoires that can't be
+        # enumerated are all kept
+        states = all_states(state_map) if isinstance(state_map, dict) else None
+        frequencies = load_frequencies(FREQUENCY_TABLE_PATH, states=states)
+    sampler = ContinuationSampler(
+        state_map, 
+        strategy=COMPUTER_WEIGHT_STRATEGY, 
+        frequencies=frequencies,
+        precompute=isinstance(state_map, dict))
+    drill = None
+    board_model = None
+    selection = drill_selection(state_map)
+    if selection is not None:
+        drill = Drill(sampler, **selection)
+        board_model = drill.start()
+
+    board_view = BoardView(image_directory, size=TILE_SIZE*8, board_offset=ScreenPos(BORDER, BORDER), board_model=board_model)
+
+    openings = None
+    if eco_index is not None:
+        openings = OpeningTracker(eco_index, state_map)
+    shown_board = None
+
+    # Nothing can be trained until the first lines are loaded
+    ready = set() if loader is not None else None
+
+    # Repertoires that can't be enumerated can't be searched. The index is built before the first
+    # wrong move, the reloader and the loader hand over those of the repertoires they publish.
+    similar = None
+    if SIMILAR_POSITIONS_ENABLED and np is not None and isinstance(state_map, dict):
+        similar = SimilarityIndex(state_map)
+        similar.build()
 
     controllers: Dict[ControlType, Controller] = {}
     controllers[ControlType.Player] = PlayerController(
         state_map, 
         computer_response_enabled=COMPUTER_RESPONSE_ENABLED,
-        training_enabled=TRAINING_ENABLED)
+        training_enabled=TRAINING_ENABLED,
+        ready=ready,
+        similar=similar)
     controllers[ControlType.Promotion] = PromotionController(
         state_map,
         computer_response_enabled=COMPUTER_RESPONSE_ENABLED,
-        training_enabled=TRAINING_ENABLED)
-    controllers[ControlType.Computer] = ComputerController(state_map)
-    controllers[ControlType.Restart] = RestartController()
+        training_enabled=TRAINING_ENABLED,
+        ready=ready,
+        similar=similar)
+    controllers[ControlType.Computer] = ComputerController(state_map, sampler=sampler, drill=drill, ready=ready)
+    controllers[ControlType.Restart] = RestartController(drill=drill)
 
     active_control_type = ControlType.Player
+    if reloader is not None:
+        reloader.start(sampler)
+    if loader is not None:
+        loader.start(sampler)
 
     while True:
+        # Swap in a reloaded repertoire between frames so a move is never handled by a mix of both
+        reloaded = reloader.poll() if reloader is not None else None
+        if reloaded is not None:
+            swap_repertoire(controllers, drill, reloaded.state_map, reloaded.sampler, similar=reloaded.similar)
+            if openings is not None:
+                # Classified on the reloader's thread
+                openings.set_state_map(reloaded.state_map, lines=reloaded.openings)
+
+        loaded = loader.poll() if loader is not None else None
+        if loaded is not None:
+            swap_repertoire(controllers, drill, loaded.state_map, loaded.sampler, ready=loaded.ready, similar=loaded.similar)
+            if openings is not None:
+                openings.set_state_map(loaded.state_map, lines=loaded.openings)
+            if loaded.ready is None:
+                # Fully loaded, from now on the pgn is watched for edits
+                reloader = loader.reloader
+                if reloader is not None:
+                    reloader.start(loaded.sampler)
+                loader = None
+
         controller: Controller = controllers[active_control_type]
         active_control_type = controller.handle_events(board_view)
  
@@ -66,11 +205,69 @@ def display_board(state_map: Dict[str, Set[StateNode]]):
         # TODO: Move this somewhere permanent
         font_size = TILE_SIZE // 5
         font = pygame.font.SysFont('Arial', font_size)
-        text_surface = multiLineSurface(board_view.detail, font, pygame.Rect(0, 0, DETAIL_PANEL_WIDTH, TILE_SIZE*8), Colors.BLACK.value, Colors.WHITE.value)
+        detail = board_view.detail
+        if board_view.note:
+            detail = detail + "\n\n" + board_view.note
+        if openings is not None:
+            # Positions are only classified when a new one is shown
+            if board_view.board_model is not shown_board:
+                shown_board = board_view.board_model
+                openings.update(str(shown_board))
+            if openings.opening is not None:
+                detail = str(openings.opening) + "\n\n" + detail
+        if loader is not None:
+            detail = loader.progress + "\n\n" + detail
+        text_surface = multiLineSurface(detail, font, pygame.Rect(0, 0, DETAIL_PANEL_WIDTH, TILE_SIZE*8), Colors.BLACK.value, Colors.WHITE.value)
         game_display.blit(text_surface, (840, 20))
 
         pygame.display.update()
 
+def swap_repertoire(controllers: Dict[ControlType, Controller],
+                    drill: Drill,
+                    state_map: Dict[str, Set[StateNode]],
+                    sampler: ContinuationSampler,
+                    ready: Set[str] = None,
+                    similar: SimilarityIndex = None):
+    for control_type in (ControlType.Player, ControlType.Promotion, ControlType.Computer):
+        controllers[control_type].state_map = state_map
+        controllers[control_type].ready = ready
+    controllers[ControlType.Computer].sampler = sampler
+    for control_type in (ControlType.Player, ControlType.Promotion):
+        controllers[control_type].similar = similar
+    if drill is not None:
+        try:
+            selection = drill_selection(state_map)
+        except ValueError as e:
+            # The drilled lines were removed from the pgn, drill from the starting position instead
+            print(e, file=sys.stderr)
+            selection = {}
+        drill.set_sampler(sampler, **selection)
+
+def drill_selection(state_map: Dict[str, Set[StateNode]]) -> Dict[str, object]:
+    """
+    Find the positions to drill in a repertoire, see the DRILL_ settings. They are found again in
+    every reloaded repertoire.
+
+    return:
+        The keyword arguments of the drill, or None if there is nothing to drill
+    """
+    if DRILL_PRIORITIES_PATH is not None:
+        priorities = {state: weight for state, weight in load_priorities(DRILL_PRIORITIES_PATH).items()
+                      if state_map.get(state)}
+        return {"priorities": priorities}
+    if DRILL_QUERY is not None:
+        positions = PositionIndex(state_map).query(DRILL_QUERY)
+        return {"priorities": {state: 1 for state in positions if state_map.get(state)}}
+    if DRILL_STRUCTURE is not None:
+        structures = PawnStructureIndex(state_map)
+        route = structures.route(structures.named[DRILL_STRUCTURE])
+        if str(Board()) not in route:
+            raise ValueError("The repertoire has no lines through the {} structure".format(DRILL_STRUCTURE))
+        return {"route": route}
+    if DRILL_PREFIX is not None:
+        return {"root": drill_root(state_map, DRILL_PREFIX)}
+    return None
+
 if __name__ == "__main__":
     main()
 
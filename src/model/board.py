@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import re
 from copy import copy
-from typing import Dict, List, Union
+from typing import Dict, List, Set, Union
 
 from src.model import pieces
 
@@ -49,7 +49,7 @@ class Board():
             self.current_player = Player.WHITE if board_str[-1] == "0" else Player.BLACK
             self.pieces = self.__init_pieces_from_board_str(board_str)
     
-    def get(self, tile: Union[Pos, str], player=None) -> Piece:
+    def get(self, tile: Union[Pos, str], player=Player.WHITE) -> Piece:
         """
         Get the piece at the given position
 
@@ -71,7 +71,7 @@ class Board():
 
         return self.pieces[pos.rank][pos.file]
 
-    def set(self, tile: Union[Pos, str], piece: Piece, player=None):
+    def set(self, tile: Union[Pos, str], piece: Piece, player=Player.WHITE):
         """
         Set the given tile to the given piece
 
@@ -94,7 +94,7 @@ class Board():
             piece.pos = pos
         self.pieces[pos.rank][pos.file] = piece
 
-    def is_empty(self, tile: Union[Pos, str], player=None) -> bool:
+    def is_empty(self, tile: Union[Pos, str], player=Player.WHITE) -> bool:
         """
         Is the given tile empty?
 
@@ -121,11 +121,12 @@ class Board():
         return:
             The position of the King
         """
+        # An exact type check, isinstance goes through the abstract base class of the pieces
         for rank in self.pieces:
             for piece in rank:
-                if isinstance(piece, King) and piece.player == player:
+                if type(piece) is King and piece.player == player:
                     return piece.pos
-        raise PieceNotFoundException(self, message="Did not find {} king".format(
+        raise PieceNotFoundException(message="Did not find {} king".format(
             "black" if player is Player.BLACK else "white"))
 
     # TODO: CRASHES IN ENGLUND GAMBIT LINE!!!
@@ -186,6 +187,25 @@ class Board():
         else:
             return Move.CAPTURE
 
+    def legal_move_table(self) -> Dict[Pos, Set[Pos]]:
+        """
+        Determine every legal move of the current player at once.
+
+        return:
+            A map from the position of every piece of the current player that can move to the
+            positions it can legally move to
+        """
+        table: Dict[Pos, Set[Pos]] = {}
+        for rank in self.pieces:
+            for piece in rank:
+                if piece is None or piece.player != self.current_player:
+                    continue
+                destinations = {Pos(i, j) for i in range(8) for j in range(8)
+                                if self.is_legal_move(Pos(i, j), piece).is_legal()}
+                if destinations:
+                    table[piece.pos] = destinations
+        return table
+
     def __blocks_attack(self, dest: Pos, from_piece: Piece, to_piece: Piece) -> bool:
         """
         Whether or not moving a piece to the position "pos" would block an attack.
@@ -239,7 +259,7 @@ class Board():
     def is_under_attack(self, 
                         tile: Union[Pos, str], 
                         transparent_piece: Piece = None, 
-                        player: Player = None) -> List[Pos]:
+                        player: Player = Player.WHITE) -> List[Pos]:
         """
         Determine which pieces, if any, are attack the given position.
 
@@ -347,6 +367,19 @@ class Board():
             # The move string represents moving a piece, no captures
             return move_destination
 
+    def get_move_promotion(self, move) -> str:
+        """
+        Return the piece a pawn is promoted to by the given move.
+
+        param move: 
+            The move string, i.e. "exd8=Q".
+
+        return: 
+            The promotion piece, i.e. "Q", or None if the move is not a promotion.
+        """
+        match = re.search("=([NBRQ])", move)
+        return match.group(1) if match is not None else None
+
     def get_move_origin(self, move) -> Pos:
         """
         Return the origin position of the given move.
@@ -589,18 +622,28 @@ class Board():
         if origin_hint == '':
             origin_hint = None
         if piece == "B":
-            return Bishop.get_origin(destination_pos, self, origin_hint=origin_hint)
+            origin = Bishop.get_origin(destination_pos, self, origin_hint=origin_hint)
         elif piece == "N":
-            return Knight.get_origin(destination_pos, self, origin_hint=origin_hint)
+            origin = Knight.get_origin(destination_pos, self, origin_hint=origin_hint)
         elif piece == "R":
-            return Rook.get_origin(destination_pos, self, origin_hint=origin_hint)
+            origin = Rook.get_origin(destination_pos, self, origin_hint=origin_hint)
         elif piece == "Q":
-            return Queen.get_origin(destination_pos, self, origin_hint=origin_hint)
+            origin = Queen.get_origin(destination_pos, self, origin_hint=origin_hint)
         elif piece == "K":
             return King.get_origin(destination_pos, self, origin_hint=origin_hint)
         else:
             raise PieceTypeDoesNotExistException()
 
+        # Moves are only disambiguated between pieces that can legally make them, so without a hint
+        # the piece found first may be pinned while another piece of its type makes the move
+        if origin_hint is None:
+            moving_piece = self.get(origin)
+            if not self.is_legal_move(destination_pos, moving_piece).is_legal():
+                for other_piece in self.__find_pieces_of_same_type(moving_piece.__class__, origin):
+                    if self.is_legal_move(destination_pos, other_piece).is_legal():
+                        return other_piece.pos
+        return origin
+
     def __convert_piece_str_to_type(self, piece: str, pos: Pos, player: Player, 
                                     in_check: bool = False, has_moved: bool = False) -> Piece:
         """
@@ -701,8 +744,14 @@ class Board():
         # Check if the current move results in a check. This can either come in the form of
         # a direct attack from the piece that was just moved or a discovered check.
         king_pos = self.get_king_pos(player.flip())
-        if piece.attacks_square_from_position(dest, king_pos, self) or \
-            self.__move_results_in_discovered_check(piece, dest, king_pos):
+        # A promoted pawn attacks the king as the piece it promoted to
+        attacking_piece = piece if promotion_piece is None else \
+            self.__convert_piece_str_to_type(promotion_piece, pos, player)
+        # Capturing en passant also takes the captured pawn off of the lines to the king
+        is_en_passant = isinstance(piece, Pawn) and dest.file != pos.file and dest_is_empty
+        if attacking_piece.attacks_square_from_position(dest, king_pos, self) or \
+            self.__move_results_in_discovered_check(piece, dest, king_pos) or \
+            (is_en_passant and len(self.update(move_string).is_under_attack(king_pos)) > 0):
             move_string = move_string + "+"
         elif move_string == "O-O":
             # Check if short castle results in check from the rook
@@ -792,6 +841,123 @@ class Board():
 
         return False
     
+    @staticmethod
+    def from_fen(fen: str) -> Board:
+        """
+        Create a board from a FEN string, i.e. 
+        "rnbqkbnr/pppppppp/8/8/4P3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 1". The halfmove clock and 
+        fullmove number are not tracked by the board and are ignored.
+
+        param fen:
+            The FEN string.
+
+        return:
+            The board
+        """
+        fields = fen.split()
+        placement = fields[0]
+        active_color = fields[1] if len(fields) > 1 else "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        en_passant = fields[3] if len(fields) > 3 else "-"
+
+        board = Board()
+        board.current_player = Player.WHITE if active_color == "w" else Player.BLACK
+
+        ranks = placement.split("/")
+        if len(ranks) != 8:
+            raise ValueError("Invalid FEN piece placement: {}".format(placement))
+        for i, rank_str in enumerate(ranks):
+            rank = 7 - i
+            file = 0
+            for c in rank_str:
+                if c.isdigit():
+                    for _ in range(int(c)):
+                        board.pieces[rank][file] = None
+                        file = file + 1
+                    continue
+                pos = Pos(rank, file)
+                player = Player.WHITE if c.isupper() else Player.BLACK
+                # Kings and rooks are assumed to have moved unless the castling rights say otherwise
+                board.pieces[rank][file] = board.__convert_piece_str_to_type(
+                    c.upper(), 
+                    pos, 
+                    player, 
+                    has_moved=True)
+                file = file + 1
+            if file != 8:
+                raise ValueError("Invalid FEN rank: {}".format(rank_str))
+
+        # Restore the castling rights
+        for symbol in castling:
+            player = Player.WHITE if symbol.isupper() else Player.BLACK
+            king = board.get("e1", player=player)
+            rook = board.get("h1" if symbol.upper() == "K" else "a1", player=player)
+            if isinstance(king, King) and isinstance(rook, Rook) and \
+                    king.player == player and rook.player == player:
+                king.has_moved = False
+                rook.has_moved = False
+
+        # The pawn which just moved two squares sits in front of the en passant target square
+        if en_passant != "-":
+            target = Pos.index(en_passant)
+            rank = target.rank + 1 if board.current_player is Player.BLACK else target.rank - 1
+            pawn = board.get(Pos(rank, target.file))
+            if isinstance(pawn, Pawn):
+                pawn.is_capturable_en_passant = True
+
+        # Only the player to move can be in check
+        king: King = board.get(board.get_king_pos(board.current_player))
+        king.in_check = len(board.is_under_attack(king.pos)) > 0
+
+        return board
+
+    def to_fen(self, halfmove_clock: int = 0, fullmove_number: int = 1) -> str:
+        """
+        param halfmove_clock:
+            The number of halfmoves since the last capture or pawn advance.
+        param fullmove_number:
+            The number of the current full move, starting at 1.
+
+        return:
+            The FEN string of the board
+        """
+        rows = []
+        en_passant = "-"
+        for rank in range(7, -1, -1):
+            row = ""
+            empty = 0
+            for file in range(8):
+                piece = self.pieces[rank][file]
+                if piece is None:
+                    empty = empty + 1
+                    continue
+                if empty > 0:
+                    row = row + str(empty)
+                    empty = 0
+                row = row + (piece.name if piece.player is Player.WHITE else piece.name.lower())
+
+                if isinstance(piece, Pawn) and piece.is_capturable_en_passant and \
+                        piece.player is not self.current_player:
+                    behind = rank - 1 if piece.player is Player.WHITE else rank + 1
+                    en_passant = Pos.file_from_index(file) + str(behind + 1)
+            if empty > 0:
+                row = row + str(empty)
+            rows.append(row)
+
+        castling = ""
+        for player, symbols in ((Player.WHITE, "KQ"), (Player.BLACK, "kq")):
+            king = self.get("e1", player=player)
+            if not isinstance(king, King) or king.player != player or king.has_moved:
+                continue
+            for corner, symbol in (("h1", symbols[0]), ("a1", symbols[1])):
+                rook = self.get(corner, player=player)
+                if isinstance(rook, Rook) and rook.player == player and not rook.has_moved:
+                    castling = castling + symbol
+
+        active_color = "w" if self.current_player is Player.WHITE else "b"
+        return "{} {} {} {} {} {}".format("/".join(rows), active_color, castling or "-", en_passant, 
+                                          halfmove_clock, fullmove_number)
+
     def __str__(self) -> str:
         output = ""
         for rank in self.pieces:
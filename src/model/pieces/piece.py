@@ -204,8 +204,9 @@ class Piece(metaclass=abc.ABCMeta):
             edge_rank = self.pos.rank + delta_rank * num_steps
             edge_file = self.pos.file + delta_file * num_steps
 
-            for i, j in zip(range(self.pos.rank + delta_rank, edge_rank, delta_rank), \
-                            range(self.pos.file + delta_file, edge_file, delta_file)):
+            # The edge tile is included, a piece pinning from it is just as much a pin
+            for i, j in zip(range(self.pos.rank + delta_rank, edge_rank + delta_rank, delta_rank), \
+                            range(self.pos.file + delta_file, edge_file + delta_file, delta_file)):
                 pos = Pos(rank=i, file=j)
                 possible_moves.append(pos)
                 piece = board.get(pos)
@@ -2,6 +2,7 @@ import itertools
 
 from .piece import Piece
 from ..pos import Pos
+from ..exceptions import PieceNotFoundException
 from ..board import *
 
 
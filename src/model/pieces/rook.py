@@ -1,5 +1,6 @@
 from .piece import Piece
 from ..pos import Pos
+from ..exceptions import PieceNotFoundException
 from ..board import *
 
 
@@ -1,16 +1,68 @@
+import os
 import re
-from typing import Set
+from typing import Iterable, Iterator, NamedTuple, Set, Tuple
 from .model.board import *
 from .model.player import Player
+from .repertoire.comments import CommentRef, load_comment
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
 
 class StateNode():
-    def __init__(self, move: str, state: str, comment: str = "", depth: int = None):
+    # Repertoires can hold hundreds of thousands of nodes, avoid a __dict__ per node.
+    __slots__ = ("move", "state", "comment_ref", "depth", "origin", "dest", "promotion")
+
+    def __init__(self, 
+                move: str, 
+                state: str, 
+                comment_ref: CommentRef = None, 
+                depth: int = None,
+                origin: Pos = None,
+                dest: Pos = None,
+                promotion: str = None):
         self.move = move
         self.state = state
-        self.comment = comment
+        self.comment_ref = comment_ref
         self.depth = depth
+        # The geometry of the move is computed once when the repertoire is built so the controllers 
+        # never have to parse the move string again.
+        self.origin = origin
+        self.dest = dest
+        self.promotion = promotion
+
+    @staticmethod
+    def from_move(board: Board, move: str, updated_board: Board, comment_ref: CommentRef = None):
+        """
+        Create the node reached by playing a move, along with the move's geometry.
+
+        param board:
+            The board before the move was made.
+        param move:
+            The move string, i.e. "Qd4".
+        param updated_board:
+            The board after the move was made.
+        param comment_ref:
+            The location of the comment attached to the move, if any.
+
+        return:
+            The StateNode
+        """
+        return StateNode(
+            move,
+            str(updated_board),
+            comment_ref=comment_ref,
+            origin=board.get_move_origin(move),
+            dest=board.get_move_destination(move),
+            promotion=board.get_move_promotion(move))
+
+    @property
+    def comment(self) -> str:
+        """
+        The sanitized comment attached to this move, loaded from the pgn on demand.
+        """
+        if self.comment_ref is None:
+            return ""
+        return load_comment(self.comment_ref)
 
     def __eq__(self, __o: object) -> bool:
         return isinstance(__o, StateNode)and self.move == __o.move and self.state == __o.state
@@ -48,108 +100,443 @@ class StatePair():
             self.black_moved = self.white_moved.update(move)
             return self.white_moved, self.black_moved   
 
-def state_map_from_pgn(filepath, state_map: Dict[str, Set[StateNode]] = None):
-    if state_map is None:
-        state_map = defaultdict(set)
+pattern_header = "(\[[^\[]*\])"
+# Tag pairs such as [FEN "..."], only matched at the start of a line so that embedded commands in
+# comments like [%csl ...] are not mistaken for them
+pattern_tag_pair = re.compile(r'^[ \t]*\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\][ \t]*$', re.MULTILINE)
+# pattern_comment = "(\{[^\}]*\})"
+pattern_exclamation = "(\$\d+)"
+# pattern_move_and_variation = "(?:\d+\.+\s*((?:(?:[PNBRQK](?:[a-h]|[1-8])?)?[a-h][1-8]|O(?:-?O"\
+#                              "){1,2}|(?:[PNBRQK](?:[a-h]|[1-8])?|[a-h])x[a-h][1-8])(?:=[NBRQ]"\
+#                              ")?[\+#]?)\s*((?:(?:[PNBRQK](?:[a-h]|[1-8])?)?[a-h][1-8]|O(?:-?O"\
+#                              "){1,2}|(?:[PNBRQK](?:[a-h]|[1-8])?|[a-h])x[a-h][1-8])(?:=[NBRQ]"\
+#                              ")?[\+#]?)?)|\(|\)"
+pattern_move_comment_variation = "(?:\s*(\{[^\}]*\})?\s*(\d+\.+)\s*((?:(?:[PNBRQK](?:[a-h]|"\
+                                     "[1-8])?)?[a-h][1-8]|O(?:-?O){1,2}|(?:[PNBRQK](?:[a-h]|["\
+                                     "1-8])?|[a-h])x[a-h][1-8])(?:=[NBRQ])?[\+#]?)\s*(\{[^\}]"\
+                                     "*\})?\s*((?:(?:[PNBRQK](?:[a-h]|[1-8])?)?[a-h][1-8]|O(?"\
+                                     ":-?O){1,2}|(?:[PNBRQK](?:[a-h]|[1-8])?|[a-h])x[a-h][1-8"\
+                                     "])(?:=[NBRQ])?[\+#]?)?)\s*(\{[^\}]*\})?|\(|\)"
+
 
-    pattern_header = "(\[[^\[]*\])"
-    # pattern_comment = "(\{[^\}]*\})"
-    pattern_exclamation = "(\$\d+)"
-    # pattern_move_and_variation = "(?:\d+\.+\s*((?:(?:[PNBRQK](?:[a-h]|[1-8])?)?[a-h][1-8]|O(?:-?O"\
-    #                              "){1,2}|(?:[PNBRQK](?:[a-h]|[1-8])?|[a-h])x[a-h][1-8])(?:=[NBRQ]"\
-    #                              ")?[\+#]?)\s*((?:(?:[PNBRQK](?:[a-h]|[1-8])?)?[a-h][1-8]|O(?:-?O"\
-    #                              "){1,2}|(?:[PNBRQK](?:[a-h]|[1-8])?|[a-h])x[a-h][1-8])(?:=[NBRQ]"\
-    #                              ")?[\+#]?)?)|\(|\)"
-    pattern_move_comment_variation = "(?:\s*(\{[^\}]*\})?\s*(\d+\.+)\s*((?:(?:[PNBRQK](?:[a-h]|"\
-                                         "[1-8])?)?[a-h][1-8]|O(?:-?O){1,2}|(?:[PNBRQK](?:[a-h]|["\
-                                         "1-8])?|[a-h])x[a-h][1-8])(?:=[NBRQ])?[\+#]?)\s*(\{[^\}]"\
-                                         "*\})?\s*((?:(?:[PNBRQK](?:[a-h]|[1-8])?)?[a-h][1-8]|O(?"\
-                                         ":-?O){1,2}|(?:[PNBRQK](?:[a-h]|[1-8])?|[a-h])x[a-h][1-8"\
-                                         "])(?:=[NBRQ])?[\+#]?)?)\s*(\{[^\}]*\})?|\(|\)"
-
-    with open(filepath) as f:
-        pgn = f.read().replace("\n", " ")
+def read_pgn(filepath) -> str:
+    """
+    Read a pgn file as latin-1 so that every character corresponds to exactly one byte, this way
+    offsets into the text can be used directly as file offsets. Line endings are kept as is.
+    """
+    with open(filepath, encoding="latin-1", newline="") as f:
+        pgn = f.read()
         f.close()
-    
-    # Remove comments, exclamations, and headers from the pgn
-    pgn_pruned = re.sub(pattern_header, '', pgn)
-    pgn_pruned = re.sub(pattern_exclamation, '', pgn_pruned)
-
-    # Each StatePair element in the stack contains the board States after the white and black moves
-    variation_states = []
-
-    for match in re.finditer(pattern_move_comment_variation, pgn_pruned):
-        overall = match.group(0)
-
-        if overall == "(":
-            # Entering a variation, push the current white and black states to the stack so we 
-            # can go back to our current state after we are done with the variation
-            variation_states.append(copy(variation_states[-1]))
-        elif overall == ")":
-            # Exiting a variation, pop the current states of the top of the stack and return to 
-            # the state we were in before starting the variation
-            variation_states.pop()
+    return pgn
+
+
+def split_chapters(pgn: str) -> List[Tuple[int, int]]:
+    """
+    Split a pgn into its chapters (games). A chapter is a block of tag pairs followed by its 
+    movetext, a pgn without any tag pairs is a single chapter.
+
+    param pgn:
+        The text of the pgn.
+
+    return:
+        The (start, end) offsets of every chapter
+    """
+    starts = []
+    previous_end = 0
+    for match in pattern_tag_pair.finditer(pgn):
+        # A tag pair starts a new chapter unless it directly follows another tag pair
+        if not starts or pgn[previous_end:match.start()].strip():
+            starts.append(match.start())
+        previous_end = match.end()
+
+    if not starts or pgn[:starts[0]].strip():
+        starts.insert(0, 0)
+    ends = starts[1:] + [len(pgn)]
+    return list(zip(starts, ends))
+
+
+def chapter_start(pgn: str) -> Board:
+    """
+    Determine the position a chapter starts from by its [SetUp] and [FEN] tag pairs.
+
+    param pgn:
+        The text of the chapter.
+
+    return:
+        The starting board
+    """
+    tags = {match.group(1): match.group(2) for match in pattern_tag_pair.finditer(pgn)}
+    if "FEN" in tags and tags.get("SetUp", "1") != "0":
+        return Board.from_fen(tags["FEN"])
+    return Board()
+
+
+def prune_movetext(pgn: str) -> str:
+    """
+    Blank out the line breaks, headers and exclamations of a chapter so that only its moves, 
+    comments and variations are left. Every offset into the text is kept intact.
+    """
+    pgn = pgn.replace("\r", " ").replace("\n", " ")
+    blank = lambda match: " " * len(match.group(0))
+    pgn_pruned = re.sub(pattern_header, blank, pgn)
+    return re.sub(pattern_exclamation, blank, pgn_pruned)
+
+
+class CutOff(NamedTuple):
+    """
+    Where a line of a chapter went past the number of plies the chapter was parsed up to. Parsing
+    the chapter further continues the line from here rather than from the start of the chapter.
+    """
+    # The offset of the first move past the number of plies in the chapter
+    offset: int
+    # Whether that move is the black one of a token like "12. e4 e5", the white one being made
+    black_only: bool
+    # The board states of the line before the move
+    states: StatePair
+    # The ply of the move before the first one of the chapter, according to its move numbers
+    first_ply: int
+    # The position the move is played in, whose continuations are not all known yet
+    state: str
+
+
+def state_map_from_chapter(filepath: str, start: int, end: int, max_ply: int = None) -> Dict[str, Set[StateNode]]:
+    """
+    Build the state map of a single chapter of a pgn.
+
+    param filepath:
+        The absolute path of the pgn.
+    param start:
+        The offset of the chapter in the file.
+    param end:
+        The offset of the end of the chapter in the file.
+    param max_ply:
+        Moves played more than this many plies after the start of the chapter are left out.
+
+    return:
+        The state map of the chapter
+    """
+    state_map, _ = resume_chapter(filepath, start, end, max_ply=max_ply)
+    return state_map
+
+
+def resume_chapter(filepath: str, 
+                   start: int, 
+                   end: int, 
+                   max_ply: int = None, 
+                   cut_offs: List[CutOff] = None) -> Tuple[Dict[str, Set[StateNode]], List[CutOff]]:
+    """
+    Parse a chapter of a pgn up to a number of plies, or further from where a previous call left
+    off. A line going past the number of plies is cut off at its first move past it, the rest of
+    the line and the variations branching from it are left to the next call.
+
+    param filepath:
+        The absolute path of the pgn.
+    param start:
+        The offset of the chapter in the file.
+    param end:
+        The offset of the end of the chapter in the file.
+    param max_ply:
+        Moves played more than this many plies after the start of the chapter are left out.
+    param cut_offs:
+        Where a previous call cut off the lines of the chapter, only what follows them is parsed.
+        The chapter is parsed from its start by default.
+
+    return:
+        The state map of the moves parsed and where lines were cut off, no cut offs are left once
+        the chapter is parsed in full
+    """
+    state_map: Dict[str, Set[StateNode]] = defaultdict(set)
+
+    with open(filepath, encoding="latin-1", newline="") as f:
+        f.seek(start)
+        pgn = f.read(end - start)
+        f.close()
+
+    board = chapter_start(pgn)
+    pgn_pruned = prune_movetext(pgn)
+
+    # Comments are only referenced by their location, they are read back when displayed
+    def comment_ref(match: re.Match, group: int) -> CommentRef:
+        if match.group(group) is None:
+            return None
+        match_start, match_end = match.span(group)
+        return CommentRef(filepath, start + match_start, match_end - match_start)
+
+    resumed = cut_offs is not None
+    if not resumed:
+        # Each StatePair element in the stack contains the board States after the white and black moves
+        if board.current_player is Player.WHITE:
+            initial_states = StatePair(black_moved=board)
         else:
+            initial_states = StatePair(white_moved=board)
+        cut_offs = [CutOff(0, False, initial_states, None, str(board))]
+
+    new_cut_offs: List[CutOff] = []
+    for cut_off in cut_offs:
+        variation_states = [copy(cut_off.states)]
+        first_ply = cut_off.first_ply
+        black_only = cut_off.black_only
+        # The depth of the variation stack of the line that was last cut off, everything is skipped
+        # until that line ends. Variations replace a move of the line they branch from, so once a
+        # line goes past the maximum ply so does every variation branching from it.
+        cut_depth = None
+        # Variations replacing the first move don't go past the maximum ply with the line they are
+        # in, the cut off depth and the depth of such a variation while it is parsed
+        suspended: List[Tuple[int, int]] = []
+
+        for match in re.compile(pattern_move_comment_variation).finditer(pgn_pruned, cut_off.offset):
+            overall = match.group(0)
+
+            if overall == "(":
+                # Entering a variation, push the current white and black states to the stack so we 
+                # can go back to our current state after we are done with the variation
+                variation_states.append(copy(variation_states[-1]))
+                continue
+            if overall == ")":
+                # Exiting a variation, pop the current states of the top of the stack and return to 
+                # the state we were in before starting the variation
+                variation_states.pop()
+                if not variation_states:
+                    # The end of the variation the line being continued was cut off in
+                    break
+                if cut_depth is not None and len(variation_states) < cut_depth:
+                    cut_depth = None
+                if suspended and len(variation_states) < suspended[-1][1]:
+                    cut_depth, _ = suspended.pop()
+                continue
+
             move_number = match.group(2)
             first_move = match.group(3)
-            first_move_comment = match.group(4) if match.group(4) is not None else ""
+            first_move_comment = comment_ref(match, 4)
             second_move = match.group(5)
-            second_move_comment = match.group(6) if match.group(6) is not None else ""
+            second_move_comment = comment_ref(match, 6)
+            skip_first_move = black_only
+            black_only = False
+
+            if move_number == "1." and board.current_player is Player.WHITE: 
+                if resumed:
+                    # The chapter started over or a variation replaces the first move, either was
+                    # parsed along with the start of the chapter
+                    if len(variation_states) == 1:
+                        break
+                    cut_depth = min(cut_depth, len(variation_states)) if cut_depth is not None else len(variation_states)
+                    continue
+                # Started the chapter over, or a variation replacing the first move. The current line
+                # starts from the initial state again, pushing it would unbalance the variation stack
+                variation_states[-1] = StatePair(black_moved=board)
+                if cut_depth is not None and len(variation_states) > cut_depth:
+                    suspended.append((cut_depth, len(variation_states)))
+                cut_depth = None
+            if cut_depth is not None:
+                continue
+
+            # The ply of white's move
+            ply = 2 * int(move_number.rstrip(".")) - 1
+            if first_ply is None:
+                first_ply = ply if "..." in move_number else ply - 1
 
-            if move_number == "1.": 
-                # Started a new pgn chapter, add the initial state to the stack
-                variation_states.append(StatePair(black_moved=Board()))
-            
             if "..." in move_number:
                 # This indicates white has moved and it is currently black's turn
+                if max_ply is not None and ply + 1 - first_ply > max_ply:
+                    new_cut_offs.append(CutOff(match.start(), False, copy(variation_states[-1]), first_ply,
+                                               str(variation_states[-1].white_moved)))
+                    cut_depth = len(variation_states)
+                    continue
                 key, val = variation_states[-1].make_move(Player.BLACK, first_move)
-                state_map[str(key)].add(StateNode(first_move, str(val), comment=first_move_comment))
+                state_map[str(key)].add(StateNode.from_move(key, first_move, val, comment_ref=first_move_comment))
             else:
                 # It is white's turn to move
-                key, val = variation_states[-1].make_move(Player.WHITE, first_move)
-                state_map[str(key)].add(StateNode(first_move, str(val), comment=first_move_comment))
+                if not skip_first_move:
+                    if max_ply is not None and ply - first_ply > max_ply:
+                        new_cut_offs.append(CutOff(match.start(), False, copy(variation_states[-1]), first_ply,
+                                                   str(variation_states[-1].black_moved)))
+                        cut_depth = len(variation_states)
+                        continue
+                    key, val = variation_states[-1].make_move(Player.WHITE, first_move)
+                    state_map[str(key)].add(StateNode.from_move(key, first_move, val, comment_ref=first_move_comment))
 
                 if second_move is None: 
                     continue
+                if max_ply is not None and ply + 1 - first_ply > max_ply:
+                    new_cut_offs.append(CutOff(match.start(), True, copy(variation_states[-1]), first_ply,
+                                               str(variation_states[-1].white_moved)))
+                    cut_depth = len(variation_states)
+                    continue
 
                 key, val = variation_states[-1].make_move(Player.BLACK, second_move)
-                state_map[str(key)].add(StateNode(second_move, str(val), comment=second_move_comment))
-
-    # Third element of each tuple in the continuations should be the greatest depth in that variation.
-    states_to_compute: List[StateNode] = list(state_map[str(Board())])
-    finished_states = 0
-    
-    while states_to_compute:
-        curr_node = states_to_compute[-1]
-
-        if curr_node.depth is not None:
-            states_to_compute.pop()
-            finished_states = finished_states + 1
-            continue
-
-        possible_continuations = state_map[curr_node.state]
-        if not possible_continuations:
-            curr_node.depth = 1
-            states_to_compute.pop()
-            finished_states = finished_states + 1
-            continue
+                state_map[str(key)].add(StateNode.from_move(key, second_move, val, comment_ref=second_move_comment))
+
+    return dict(state_map), new_cut_offs
+
+
+def merge_state_maps(state_map: Dict[str, Set[StateNode]], other: Dict[str, Set[StateNode]]):
+    """
+    Merge the continuations of one state map into another. When both contain the same move the
+    commented one is kept.
+
+    param state_map:
+        The state map that is updated in place.
+    param other:
+        The state map to merge in.
+    """
+    for key, nodes in other.items():
+        existing = state_map[key]
+        for node in nodes:
+            if node not in existing:
+                existing.add(node)
+            elif node.comment_ref is not None:
+                for existing_node in existing:
+                    if existing_node == node and existing_node.comment_ref is None:
+                        existing_node.comment_ref = node.comment_ref
+                        break
+
+
+def all_states(state_map: Dict[str, Set[StateNode]]) -> Set[str]:
+    """
+    return:
+        Every position of a state map, those with continuations and those the lines end in
+    """
+    states = set(state for state, continuations in state_map.items() if continuations)
+    for continuations in state_map.values():
+        states.update(node.state for node in continuations)
+    return states
+
+
+def compute_depths(state_map: Dict[str, Set[StateNode]], roots: Iterable[str] = None):
+    """
+    Set the depth of every node to the greatest number of moves in the lines following it.
+
+    param state_map:
+        The state map.
+    param roots:
+        The positions whose continuations should be computed, along with everything below them.
+        Defaults to every position. Nodes which already have a depth are left untouched.
+    """
+    for root in list(roots if roots is not None else state_map.keys()):
+        states_to_compute: List[StateNode] = [node for node in state_map[root] if node.depth is None]
         
-        depths = []
-        found_none = False
-        for node in possible_continuations:
-            node: StateNode = node
-            if node.depth is None:
-                if node in states_to_compute:
-                    node.depth = 1
-                else:
-                    found_none = True
-                    states_to_compute.append(node)
-            depths.append(node.depth)
-
-        if not found_none:
-            curr_node.depth = max(depths) + 1
-            states_to_compute.pop()
-            finished_states = finished_states + 1
+        while states_to_compute:
+            curr_node = states_to_compute[-1]
+
+            if curr_node.depth is not None:
+                states_to_compute.pop()
+                continue
+
+            possible_continuations = state_map[curr_node.state]
+            if not possible_continuations:
+                curr_node.depth = 1
+                states_to_compute.pop()
+                continue
+            
+            depths = []
+            found_none = False
+            for node in possible_continuations:
+                node: StateNode = node
+                if node.depth is None:
+                    if node in states_to_compute:
+                        node.depth = 1
+                    else:
+                        found_none = True
+                        states_to_compute.append(node)
+                depths.append(node.depth)
+
+            if not found_none:
+                curr_node.depth = max(depths) + 1
+                states_to_compute.pop()
+
+
+def state_maps_from_chapters(filepath: str, 
+                             chapters: List[Tuple[int, int]], 
+                             workers: int = None,
+                             max_ply: int = None) -> Iterator[Dict[str, Set[StateNode]]]:
+    """
+    Parse chapters of a pgn, in parallel across a process pool when there is more than one.
+
+    param filepath:
+        The absolute path of the pgn.
+    param chapters:
+        The (start, end) offsets of the chapters.
+    param workers:
+        The number of processes used to parse chapters, defaults to the number of processors.
+    param max_ply:
+        Moves played more than this many plies after the start of their chapter are left out.
+
+    return:
+        The state map of every chapter, in order
+    """
+    if len(chapters) <= 1 or workers == 1:
+        for start, end in chapters:
+            yield state_map_from_chapter(filepath, start, end, max_ply=max_ply)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(
+                state_map_from_chapter, 
+                [filepath] * len(chapters), 
+                [start for start, _ in chapters], 
+                [end for _, end in chapters],
+                [max_ply] * len(chapters))
+
+
+def resume_chapters(filepath: str, 
+                    chapters: List[Tuple[int, int]], 
+                    cut_offs: List[List[CutOff]],
+                    workers: int = None,
+                    max_ply: int = None) -> Iterator[Tuple[Dict[str, Set[StateNode]], List[CutOff]]]:
+    """
+    Parse chapters of a pgn further, see resume_chapter, in parallel across a process pool when 
+    there is more than one.
+
+    param filepath:
+        The absolute path of the pgn.
+    param chapters:
+        The (start, end) offsets of the chapters.
+    param cut_offs:
+        Where the lines of every chapter were cut off, None for a chapter that was not parsed yet.
+    param workers:
+        The number of processes used to parse chapters, defaults to the number of processors.
+    param max_ply:
+        Moves played more than this many plies after the start of their chapter are left out.
+
+    return:
+        The state map of the moves parsed in every chapter and where its lines were cut off, in order
+    """
+    if len(chapters) <= 1 or workers == 1:
+        for (start, end), chapter_cut_offs in zip(chapters, cut_offs):
+            yield resume_chapter(filepath, start, end, max_ply=max_ply, cut_offs=chapter_cut_offs)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(
+                resume_chapter, 
+                [filepath] * len(chapters), 
+                [start for start, _ in chapters], 
+                [end for _, end in chapters],
+                [max_ply] * len(chapters),
+                cut_offs)
+
+
+def state_map_from_pgn(filepath, state_map: Dict[str, Set[StateNode]] = None, workers: int = None):
+    """
+    Build the state map of a pgn. Every chapter is parsed independently, in parallel across a 
+    process pool when there is more than one, and the results are merged.
+
+    param filepath:
+        The path of the pgn.
+    param state_map:
+        An existing state map to add the pgn to.
+    param workers:
+        The number of processes used to parse chapters, defaults to the number of processors.
+
+    return:
+        The state map
+    """
+    if state_map is None:
+        state_map = defaultdict(set)
+
+    filepath = os.path.abspath(filepath)
+    chapters = split_chapters(read_pgn(filepath))
+    for chapter_map in state_maps_from_chapters(filepath, chapters, workers=workers):
+        merge_state_maps(state_map, chapter_map)
+
+    compute_depths(state_map)
 
     return state_map
-        
\ No newline at end of file
@@ -0,0 +1,180 @@
+import sys
+from collections import Counter
+from typing import Dict, List, NamedTuple, Set
+
+from ..model.board import Board
+from ..preprocess import StateNode
+from .eco import Opening, classify_state_map
+from .writer import root_states
+
+
+class RepertoireStats(NamedTuple):
+    positions: int
+    edges: int
+    # Map from a number of continuations to the number of positions with that many
+    branching: Dict[int, int]
+    lines: int
+    max_line_length: int
+    average_line_length: float
+    # Positions reached from more than one position
+    transpositions: int
+    # Map from the first two moves of the starting position, i.e. "1. e4 e6", to the number of lines
+    lines_by_first_moves: Dict[str, int]
+    # Map from an opening to the number of lines ending in it, only filled with an opening table
+    lines_by_opening: Dict[Opening, int]
+    # Map from a part of the repertoire to the bytes it takes
+    memory: Dict[str, int]
+
+
+def analyze(state_map: Dict[str, Set[StateNode]], index: Dict[str, Opening] = None) -> RepertoireStats:
+    """
+    Compute the statistics of a repertoire in one post order traversal from its roots, every
+    position and every continuation is visited once. Lines are counted from the number of lines
+    below every position rather than by walking them, so a repertoire with many transpositions
+    does not take exponential time. A continuation looping back to a position still being visited
+    ends its line.
+
+    param state_map:
+        The repertoire.
+    param index:
+        The compiled opening table, see load_eco_index, to count the lines of every opening.
+
+    return:
+        The statistics
+    """
+    # The number of lines below every position, the sum of their lengths and the longest one
+    lines: Dict[str, int] = {}
+    total_lengths: Dict[str, int] = {}
+    longest: Dict[str, int] = {}
+    parents: Counter = Counter()
+    branching: Counter = Counter()
+    # The positions in the order they were finished, every position after those it leads to
+    finished: List[str] = []
+    in_progress: Set[str] = set()
+
+    seen: Set[int] = set()
+    memory: Counter = Counter()
+
+    def measure(part: str, obj: object):
+        # Positions and moves are often the same string object in several places
+        if obj is not None and id(obj) not in seen:
+            seen.add(id(obj))
+            memory[part] += sys.getsizeof(obj)
+
+    memory["state map"] = sys.getsizeof(state_map)
+    roots = root_states(state_map)
+    for root in roots:
+        stack = [(root, iter(state_map.get(root, ())))]
+        in_progress.add(root)
+        measure("positions", root)
+        while stack:
+            state, continuations = stack[-1]
+            node = next(continuations, None)
+            if node is not None:
+                parents[node.state] += 1
+                measure("nodes", node)
+                measure("moves", node.move)
+                measure("comment refs", node.comment_ref)
+                measure("move geometry", node.origin)
+                measure("move geometry", node.dest)
+                if node.state not in lines and node.state not in in_progress:
+                    in_progress.add(node.state)
+                    measure("positions", node.state)
+                    stack.append((node.state, iter(state_map.get(node.state, ()))))
+                continue
+
+            stack.pop()
+            in_progress.discard(state)
+            finished.append(state)
+            nodes = state_map.get(state, ())
+            if state in state_map:
+                measure("continuation sets", nodes)
+            branching[len(nodes)] += 1
+            if not nodes:
+                lines[state], total_lengths[state], longest[state] = 1, 0, 0
+                continue
+            # Positions not counted yet are still being visited, the continuation ends the line
+            lines[state] = sum(lines.get(node.state, 1) for node in nodes)
+            total_lengths[state] = sum(total_lengths.get(node.state, 0) + lines.get(node.state, 1) for node in nodes)
+            longest[state] = max(longest.get(node.state, 0) for node in nodes) + 1
+
+    num_lines = sum(lines[root] for root in roots)
+    total_length = sum(total_lengths[root] for root in roots)
+
+    lines_by_first_moves: Dict[str, int] = {}
+    start = str(Board())
+    for first in state_map.get(start, ()):
+        replies = state_map.get(first.state, ())
+        if not replies:
+            lines_by_first_moves["1. {}".format(first.move)] = lines[first.state]
+        for reply in replies:
+            lines_by_first_moves["1. {} {}".format(first.move, reply.move)] = lines.get(reply.state, 1)
+
+    lines_by_opening: Counter = Counter()
+    if index is not None:
+        # The number of lines reaching every position, following the finishing order backwards
+        # visits a position after every position leading to it
+        order = {state: i for i, state in enumerate(finished)}
+        reaching: Counter = Counter({root: 1 for root in roots})
+        for state in reversed(finished):
+            for node in state_map.get(state, ()):
+                # Continuations looping back to a position leading to this one are skipped
+                if order[node.state] < order[state]:
+                    reaching[node.state] += reaching[state]
+        openings = classify_state_map(state_map, index)
+        for state in finished:
+            if not state_map.get(state):
+                lines_by_opening[openings.get(state)] += reaching[state]
+
+    return RepertoireStats(
+        positions=len(finished),
+        edges=sum(parents.values()),
+        branching=dict(branching),
+        lines=num_lines,
+        max_line_length=max((longest[root] for root in roots), default=0),
+        average_line_length=total_length / num_lines if num_lines else 0.0,
+        transpositions=sum(1 for count in parents.values() if count > 1),
+        lines_by_first_moves=lines_by_first_moves,
+        lines_by_opening=dict(lines_by_opening),
+        memory=dict(memory))
+
+
+def format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return "{:.0f} {}".format(size, unit) if unit == "B" else "{:.1f} {}".format(size, unit)
+        size /= 1024
+    return "{:.1f} GB".format(size)
+
+
+def format_stats(stats: RepertoireStats) -> List[str]:
+    """
+    return:
+        The statistics as lines of text, meant to be printed
+    """
+    output = [
+        "positions: {}".format(stats.positions),
+        "continuations: {}".format(stats.edges),
+        "transpositions: {}".format(stats.transpositions),
+        "lines: {}".format(stats.lines),
+        "longest line: {} moves".format(stats.max_line_length),
+        "average line: {:.1f} moves".format(stats.average_line_length),
+        "",
+        "continuations per position:"]
+    for count, positions in sorted(stats.branching.items()):
+        output.append("{:>6}  {}".format(count, positions))
+
+    output += ["", "lines by first moves:"]
+    for moves, count in sorted(stats.lines_by_first_moves.items(), key=lambda item: (-item[1], item[0])):
+        output.append("{:>6}  {}".format(count, moves))
+
+    if stats.lines_by_opening:
+        output += ["", "lines by opening:"]
+        for opening, count in sorted(stats.lines_by_opening.items(), key=lambda item: (-item[1], str(item[0]))):
+            output.append("{:>6}  {}".format(count, opening if opening is not None else "Unclassified"))
+
+    output += ["", "memory:"]
+    for part, size in sorted(stats.memory.items(), key=lambda item: -item[1]):
+        output.append("{:>10}  {}".format(format_size(size), part))
+    output.append("{:>10}  total".format(format_size(sum(stats.memory.values()))))
+    return output
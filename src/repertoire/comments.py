@@ -0,0 +1,55 @@
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+COMMENT_CACHE_SIZE = 256
+
+# Embedded PGN commands such as [%csl ...], [%cal ...] or [%clk ...]. These are meant for other
+# GUIs to draw arrows and highlights and are noise in the detail panel.
+pattern_command = re.compile(r"\[%[^\]]*\]")
+pattern_whitespace = re.compile(r"\s+")
+
+
+class CommentRef(NamedTuple):
+    """
+    Location of a comment inside the pgn it was read from. Only this is kept in memory, the
+    comment text itself is read back from disk when it is displayed.
+    """
+    filepath: str
+    offset: int
+    length: int
+
+    def load(self) -> str:
+        with open(self.filepath, "rb") as f:
+            f.seek(self.offset)
+            raw = f.read(self.length)
+        return sanitize_comment(raw.decode("utf-8", errors="replace"))
+
+
+def sanitize_comment(comment: str) -> str:
+    """
+    Strip the braces, embedded commands and redundant whitespace from a raw pgn comment.
+
+    param comment:
+        The raw comment, i.e. "{[%cal dd4c5] The idea is to play c5}"
+
+    return:
+        The comment text as it should be displayed, i.e. "The idea is to play c5"
+    """
+    comment = comment.replace("{", "").replace("}", "")
+    comment = pattern_command.sub(" ", comment)
+    return pattern_whitespace.sub(" ", comment).strip()
+
+
+@lru_cache(maxsize=COMMENT_CACHE_SIZE)
+def load_comment(ref: CommentRef) -> str:
+    """
+    Read a comment back from where it is stored. Recently displayed comments are cached.
+
+    param ref:
+        The location of the comment, any hashable reference with a load method will do.
+
+    return:
+        The sanitized comment text.
+    """
+    return ref.load()
@@ -0,0 +1,176 @@
+from collections import Counter
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..model.player import Player
+from ..preprocess import StateNode
+from .diff import LineNames
+from .games import game_tags, iter_games, map_game_chunks, replay
+from .gaps import player_to_move
+
+
+class DeviationCounts(NamedTuple):
+    # The number of games the player played
+    games: int
+    # The number of games that left the repertoire at every (position, move) pair
+    forgotten: Counter
+    # The same for the moves the opponent left the repertoire with
+    left_book: Counter
+
+
+def book_moves(state_map: Dict[str, Set[StateNode]]) -> Dict[str, Set[str]]:
+    """
+    The moves of every position of the repertoire without check markers, which are not always
+    written the same way in games and repertoires.
+    """
+    return {state: {node.move.rstrip("+#") for node in continuations}
+            for state, continuations in state_map.items() if continuations}
+
+
+def deviations_chunk(filepath: str,
+                     start: int,
+                     end: int,
+                     player_name: str,
+                     book: Dict[str, Set[str]],
+                     max_ply: int) -> DeviationCounts:
+    """
+    Find the first move of every game of the player in a chunk of a game database that is not part
+    of the repertoire.
+
+    param filepath:
+        The path of the database.
+    param start:
+        The offset of the chunk in the file.
+    param end:
+        The offset of the end of the chunk in the file.
+    param player_name:
+        The name of the player in the White and Black tags, compared ignoring case.
+    param book:
+        The moves of every position of the repertoire, see book_moves.
+    param max_ply:
+        The number of plies of every game to replay.
+
+    return:
+        The deviations of the player and of their opponents
+    """
+    games = 0
+    forgotten: Counter = Counter()
+    left_book: Counter = Counter()
+    player_name = player_name.casefold()
+    for game in iter_games(filepath, start, end):
+        tags = game_tags(game)
+        if player_name == tags.get("White", "").casefold():
+            player = Player.WHITE
+        elif player_name == tags.get("Black", "").casefold():
+            player = Player.BLACK
+        else:
+            continue
+        games += 1
+
+        for board, move, _ in replay(game, max_ply=max_ply):
+            state = str(board)
+            moves = book.get(state)
+            # The game reached the end of a line without leaving the repertoire
+            if moves is None:
+                break
+            if move.rstrip("+#") in moves:
+                continue
+            if player_to_move(state) is player:
+                forgotten[(state, move)] += 1
+            else:
+                left_book[(state, move)] += 1
+            break
+    return DeviationCounts(games, forgotten, left_book)
+
+
+def find_deviations(state_map: Dict[str, Set[StateNode]],
+                    database: str,
+                    player_name: str,
+                    max_ply: int = 40,
+                    workers: int = None) -> DeviationCounts:
+    """
+    Find where the games of a player left the repertoire, either because the player forgot the
+    move to play or because the opponent played a move the repertoire does not cover. Chunks of
+    games are replayed in parallel and every game only as long as it stays in the repertoire.
+
+    param state_map:
+        The repertoire.
+    param database:
+        The path of the pgn export of the player's games.
+    param player_name:
+        The name of the player in the White and Black tags, compared ignoring case.
+    param max_ply:
+        The number of plies of every game to replay.
+    param workers:
+        The number of processes, defaults to the number of processors.
+
+    return:
+        The deviations of the player and of their opponents
+    """
+    games = 0
+    forgotten: Counter = Counter()
+    left_book: Counter = Counter()
+    book = book_moves(state_map)
+    for counts in map_game_chunks(deviations_chunk, database, player_name, book, max_ply, workers=workers):
+        games += counts.games
+        forgotten.update(counts.forgotten)
+        left_book.update(counts.left_book)
+    return DeviationCounts(games, forgotten, left_book)
+
+
+def forgotten_positions(counts: DeviationCounts) -> List[Tuple[str, int]]:
+    """
+    return:
+        The positions the player forgot the move to play in along with the number of games they
+        forgot it in, the most frequently forgotten first
+    """
+    positions: Counter = Counter()
+    for (state, _), count in counts.forgotten.items():
+        positions[state] += count
+    return sorted(positions.items(), key=lambda item: (-item[1], item[0]))
+
+
+def write_priorities(positions: List[Tuple[str, int]], filepath: str):
+    """
+    Write positions to drill along with their weight, one "position\tweight" per line.
+    """
+    with open(filepath, "w", encoding="latin-1", newline="\n") as f:
+        for state, weight in positions:
+            f.write("{}\t{}\n".format(state, weight))
+
+
+def load_priorities(filepath: str) -> Dict[str, float]:
+    """
+    Load the positions to drill written by write_priorities.
+
+    return:
+        Map from the string representation of a board to its weight
+    """
+    priorities = {}
+    with open(filepath, encoding="latin-1", newline="\n") as f:
+        for line in f:
+            state, weight = line.rstrip("\n").split("\t")
+            priorities[state] = float(weight)
+    return priorities
+
+
+def format_deviations(counts: DeviationCounts, state_map: Dict[str, Set[StateNode]], limit: int = 20) -> List[str]:
+    """
+    Describe the positions the player forgot the move to play in most often along with the moves
+    they played instead, followed by the moves opponents left the repertoire with most often.
+    """
+    names = LineNames(state_map)
+    played: Dict[str, Counter] = {}
+    for (state, move), count in counts.forgotten.items():
+        played.setdefault(state, Counter())[move] += count
+
+    output = ["{} games".format(counts.games), "", "Most frequently forgotten:"]
+    for state, count in forgotten_positions(counts)[:limit]:
+        expected = ", ".join(sorted(node.move for node in state_map[state]))
+        instead = ", ".join("{} ({})".format(move, n) for move, n in played[state].most_common(5))
+        output.append("{:>5}  {}".format(count, names.line(state) or "the starting position"))
+        output.append("       expected {}, played {}".format(expected, instead))
+
+    output += ["", "Most frequent opponent moves out of the repertoire:"]
+    for (state, move), count in counts.left_book.most_common(limit):
+        output.append("{:>5}  {}".format(count, names.line(state, move)))
+    return output
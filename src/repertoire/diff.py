@@ -0,0 +1,166 @@
+from collections import deque
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..model.board import Board
+from ..model.player import Player
+from ..preprocess import StateNode, compute_depths, merge_state_maps
+from .comments import CommentRef, sanitize_comment
+from .writer import root_states
+
+
+class ContinuationChange(NamedTuple):
+    state: str
+    move: str
+    # None when the continuation was added
+    old: StateNode
+    # None when the continuation was removed
+    new: StateNode
+
+
+class RepertoireDiff(NamedTuple):
+    added: List[ContinuationChange]
+    removed: List[ContinuationChange]
+    # Continuations whose comment changed
+    changed: List[ContinuationChange]
+
+
+class CommentReader():
+    def __init__(self):
+        """
+        Reads the comments of many nodes, every pgn is read only once instead of once per comment.
+        """
+        self.files: Dict[str, bytes] = {}
+
+    def comment(self, node: StateNode) -> str:
+        ref = node.comment_ref
+        if not isinstance(ref, CommentRef):
+            return node.comment
+        if ref.filepath not in self.files:
+            with open(ref.filepath, "rb") as f:
+                self.files[ref.filepath] = f.read()
+        raw = self.files[ref.filepath][ref.offset:ref.offset + ref.length]
+        return sanitize_comment(raw.decode("utf-8", errors="replace"))
+
+
+def edge_index(state_map: Dict[str, Set[StateNode]]) -> Dict[Tuple[str, str], StateNode]:
+    """
+    Index every continuation of a state map by its position and move.
+    """
+    return {(state, node.move): node for state, continuations in state_map.items() for node in continuations}
+
+
+def diff_state_maps(old: Dict[str, Set[StateNode]], new: Dict[str, Set[StateNode]]) -> RepertoireDiff:
+    """
+    Compare two versions of a repertoire in time linear to their number of continuations.
+
+    param old:
+        The state map of the old version.
+    param new:
+        The state map of the new version.
+
+    return:
+        The continuations that were added, removed or whose comment changed
+    """
+    old_edges = edge_index(old)
+    new_edges = edge_index(new)
+    comments = CommentReader()
+
+    added = [ContinuationChange(state, move, None, node) for (state, move), node in new_edges.items()
+             if (state, move) not in old_edges]
+    removed = [ContinuationChange(state, move, node, None) for (state, move), node in old_edges.items()
+               if (state, move) not in new_edges]
+    changed = []
+    for key, new_node in new_edges.items():
+        old_node = old_edges.get(key)
+        if old_node is None or (old_node.comment_ref is None and new_node.comment_ref is None):
+            continue
+        if comments.comment(old_node) != comments.comment(new_node):
+            changed.append(ContinuationChange(key[0], key[1], old_node, new_node))
+    return RepertoireDiff(added, removed, changed)
+
+
+def merge_repertoires(master: Dict[str, Set[StateNode]], other: Dict[str, Set[StateNode]]) -> Dict[str, Set[StateNode]]:
+    """
+    Add the continuations of a repertoire to a master repertoire. The comments of the master are
+    kept, comments of the other repertoire are only used for moves the master has none for.
+
+    param master:
+        The master state map, updated in place.
+    param other:
+        The state map to merge in.
+
+    return:
+        The merged state map
+    """
+    merge_state_maps(master, other)
+    for continuations in master.values():
+        for node in continuations:
+            node.depth = None
+    compute_depths(master)
+    return master
+
+
+class LineNames():
+    def __init__(self, state_map: Dict[str, Set[StateNode]]):
+        """
+        Names positions by the shortest line of moves leading to them from the start of a chapter.
+        """
+        self.parents: Dict[str, Tuple[str, str]] = {}
+        self.roots: Set[str] = set(root_states(state_map))
+        queue = deque(self.roots)
+        while queue:
+            state = queue.popleft()
+            for node in sorted(state_map.get(state, ()), key=lambda node: node.move):
+                if node.state not in self.parents and node.state not in self.roots:
+                    self.parents[node.state] = (state, node.move)
+                    queue.append(node.state)
+
+    def line(self, state: str, move: str = None) -> str:
+        """
+        param state:
+            The string representation of a board.
+        param move:
+            A move played in the position to add to the line.
+
+        return:
+            The numbered moves leading to the position, i.e. "1. e4 e6 2. d4"
+        """
+        moves = [move] if move is not None else []
+        while state in self.parents:
+            state, parent_move = self.parents[state]
+            moves.append(parent_move)
+        moves.reverse()
+
+        # Lines which can't be traced back to a chapter start are named from the position itself
+        ply = 0 if Board(board_str=state).current_player is Player.WHITE else 1
+        tokens = [] if state in self.roots else ["[{}]".format(Board(board_str=state).to_fen())]
+        for i, move in enumerate(moves):
+            if ply % 2 == 0:
+                tokens.append("{}. {}".format(ply // 2 + 1, move))
+            elif i == 0:
+                tokens.append("{}... {}".format(ply // 2 + 1, move))
+            else:
+                tokens.append(move)
+            ply += 1
+        return " ".join(tokens)
+
+
+def format_diff(diff: RepertoireDiff, old: Dict[str, Set[StateNode]], new: Dict[str, Set[StateNode]]) -> List[str]:
+    """
+    Describe a diff line by line, added continuations are prefixed with "+", removed ones with "-"
+    and continuations whose comment changed with "~".
+    """
+    old_names = LineNames(old)
+    new_names = LineNames(new)
+    comments = CommentReader()
+
+    output = []
+    for change in diff.added:
+        output.append("+ " + new_names.line(change.state, change.move))
+    for change in diff.removed:
+        output.append("- " + old_names.line(change.state, change.move))
+    for change in diff.changed:
+        output.append("~ " + new_names.line(change.state, change.move))
+        output.append("    old: " + comments.comment(change.old))
+        output.append("    new: " + comments.comment(change.new))
+    return output
@@ -0,0 +1,145 @@
+from copy import copy
+from typing import Dict, List, Set, Tuple, Union
+
+from ..model.board import Board
+from ..preprocess import StateNode
+from .sampling import AliasTable, ContinuationSampler, LineSampler, WeightStrategy, leaf_counts
+
+
+def drill_root(state_map: Dict[str, Set[StateNode]], position: Union[Board, str, List[str]] = None) -> Board:
+    """
+    Resolve the position a drill should start from.
+
+    param state_map:
+        The repertoire.
+    param position:
+        Either a board, the string representation of a board, or a list of moves played from the
+        starting position, i.e. ["e4", "e6", "d4"]. Defaults to the starting position.
+
+    return:
+        The board the drill starts from
+    """
+    if position is None:
+        return Board()
+    if isinstance(position, Board):
+        board = position
+    elif isinstance(position, str):
+        board = Board(board_str=position)
+    else:
+        # Replay the move prefix, every move has to be part of the repertoire
+        board = Board()
+        for i, move in enumerate(position):
+            updated_board = board.update(move)
+            if StateNode(move, str(updated_board)) not in state_map.get(str(board), ()):
+                raise ValueError("{} is not part of the repertoire after {}".format(
+                    move, " ".join(position[:i]) or "the starting position"))
+            board = updated_board
+
+    if not state_map.get(str(board)):
+        raise ValueError("The repertoire has no continuations from the drill position")
+    return board
+
+
+class Drill():
+    def __init__(self,
+                sampler: ContinuationSampler,
+                root: Board = None,
+                strategy: WeightStrategy = WeightStrategy.LEAVES,
+                priorities: Dict[str, float] = None,
+                route: Dict[str, List[StateNode]] = None):
+        """
+        Drills the subtree below a root position. Each round draws a complete line from the root
+        which the computer follows for as long as the player stays on it.
+
+        param sampler:
+            The continuation sampler of the repertoire.
+        param root:
+            The position every round starts from, see drill_root.
+        param strategy:
+            How lines are weighted, by default every line below the root is equally likely.
+        param priorities:
+            Positions to start rounds from instead of the root, drawn proportionally to their 
+            weight, i.e. the positions the player forgets most often.
+        param route:
+            Restricts the lines drawn to those passing through a set of positions, by the 
+            continuations that lead into the set from every position before it. The route is 
+            followed proportionally to the number of lines through the set below every 
+            continuation, so with WeightStrategy.LEAVES every line through it is equally likely.
+        """
+        self.line_sampler = LineSampler(sampler, strategy=strategy)
+        self.line: Dict[str, StateNode] = {}
+        self.__select(root, priorities, route)
+
+    def __select(self, root: Board, priorities: Dict[str, float], route: Dict[str, List[StateNode]]):
+        self.root = root if root is not None else Board()
+        self.priority_states: List[str] = list(priorities) if priorities else []
+        self.priority_table = AliasTable([priorities[state] for state in self.priority_states]) if priorities else None
+        self.route = route
+        self.route_tables: Dict[str, Tuple[List[StateNode], AliasTable]] = {}
+        if route is not None:
+            # Below the continuations entering the set every line passes through it
+            counts = self.line_sampler.sampler.line_counts()
+            entering = {node.state: counts.get(node.state, 1) 
+                        for nodes in route.values() for node in nodes if node.state not in route}
+            route_counts = leaf_counts(route, known=entering)
+            self.route_tables = {state: (nodes, AliasTable([route_counts.get(node.state, 1) for node in nodes]))
+                                 for state, nodes in route.items() if nodes}
+
+    def start(self) -> Board:
+        """
+        Draw a new line to drill.
+
+        return:
+            The board the line starts from
+        """
+        if self.priority_table is not None:
+            root = Board(board_str=self.priority_states[self.priority_table.sample(self.line_sampler.sampler.rng)])
+        else:
+            root = copy(self.root)
+
+        root_state = str(root)
+        self.line = {}
+        if self.route is not None:
+            # Follow the route until the line enters the positions it leads to
+            rng = self.line_sampler.sampler.rng
+            # The route may loop back on itself through transpositions
+            visited = set()
+            while root_state in self.route_tables and root_state not in visited:
+                visited.add(root_state)
+                nodes, table = self.route_tables[root_state]
+                node = nodes[table.sample(rng)]
+                self.line[root_state] = node
+                root_state = node.state
+        for node in self.line_sampler.sample_line(root_state):
+            self.line[root_state] = node
+            root_state = node.state
+        return root
+
+    def set_sampler(self,
+                    sampler: ContinuationSampler,
+                    root: Board = None,
+                    priorities: Dict[str, float] = None,
+                    route: Dict[str, List[StateNode]] = None):
+        """
+        Draw the next lines from another sampler, i.e. after the repertoire was reloaded. The line
+        being drilled is kept as far as its moves are still part of the repertoire.
+
+        param sampler:
+            The continuation sampler of the reloaded repertoire.
+        param root, priorities, route:
+            The positions to drill in the reloaded repertoire, see the constructor. They replace
+            those of the previous repertoire, whose continuations may have been removed.
+        """
+        self.line_sampler.sampler = sampler
+        self.line = {state: node for state, node in self.line.items() if node in sampler.state_map.get(state, ())}
+        self.__select(root, priorities, route)
+
+    def next_move(self, state: str) -> StateNode:
+        """
+        param state:
+            The string representation of the current board.
+
+        return:
+            The move of the drilled line in this position, or None if the player left the line
+        """
+        return self.line.get(state)
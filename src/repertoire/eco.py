@@ -0,0 +1,193 @@
+import hashlib
+import os
+from collections import deque
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..model.board import Board
+from ..preprocess import StateNode
+from .games import mainline_moves
+from .writer import root_states
+
+
+class Opening(NamedTuple):
+    eco: str
+    name: str
+
+    def __str__(self) -> str:
+        return "{} {}".format(self.eco, self.name)
+
+
+def opening_key(state: str) -> str:
+    """
+    The key of a position in the opening index. Pawns that can be captured en passant are written
+    differently, they are counted as regular pawns so that move orders ending in a double pawn
+    push are transpositions of those that don't.
+    """
+    return state[:64].replace("G", "P").replace("g", "p") + state[64:]
+
+
+def read_openings(filepath: str) -> List[Tuple[str, str, str]]:
+    """
+    Read an opening table in the format of the Lichess chess-openings tables, a header line
+    followed by one "eco\tname\tpgn" line per opening.
+
+    return:
+        The ECO code, name and moves of every opening
+    """
+    openings = []
+    with open(filepath, encoding="utf-8") as f:
+        header = f.readline().rstrip("\n").split("\t")
+        columns = [header.index(column) for column in ("eco", "name", "pgn")]
+        for line in f:
+            values = line.rstrip("\n").split("\t")
+            if len(values) >= len(header):
+                openings.append(tuple(values[column] for column in columns))
+    return openings
+
+
+def compile_openings(openings: List[Tuple[str, str, str]]) -> Dict[str, Opening]:
+    """
+    Replay every opening of a table to index it by the position it reaches, so that transpositions
+    into an opening are classified as well. Boards are shared between openings with the same first
+    moves so every distinct move sequence is only played once.
+
+    param openings:
+        The ECO code, name and moves of every opening.
+
+    return:
+        Map from the key of a position to its opening, see opening_key. The opening with the most
+        moves wins when several reach the same position
+    """
+    boards: Dict[Tuple[str, ...], Board] = {(): Board()}
+    index: Dict[str, Opening] = {}
+    plies: Dict[str, int] = {}
+    for eco, name, pgn in openings:
+        moves = tuple(mainline_moves(pgn))
+        try:
+            for i in range(len(moves)):
+                if moves[:i + 1] not in boards:
+                    boards[moves[:i + 1]] = boards[moves[:i]].update(moves[i])
+        except Exception:
+            continue
+        state = opening_key(str(boards[moves]))
+        if len(moves) >= plies.get(state, 0):
+            index[state] = Opening(eco, name)
+            plies[state] = len(moves)
+    return index
+
+
+def table_digest(filepath: str) -> str:
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_eco_index(filepath: str, cache_path: str = None) -> Dict[str, Opening]:
+    """
+    Load the position index of an opening table. Compiling a table replays every opening, so the
+    compiled index is cached next to the table and only compiled again when the table changes.
+
+    param filepath:
+        The path of the opening table, see read_openings.
+    param cache_path:
+        The path of the compiled index, defaults to the path of the table with ".index" appended.
+
+    return:
+        Map from the key of a position to its opening, see opening_key
+    """
+    cache_path = cache_path if cache_path is not None else filepath + ".index"
+    digest = table_digest(filepath)
+    if os.path.exists(cache_path):
+        with open(cache_path, encoding="utf-8", newline="\n") as f:
+            if f.readline().rstrip("\n") == digest:
+                index = {}
+                for line in f:
+                    state, eco, name = line.rstrip("\n").split("\t")
+                    index[state] = Opening(eco, name)
+                return index
+
+    index = compile_openings(read_openings(filepath))
+    try:
+        with open(cache_path, "w", encoding="utf-8", newline="\n") as f:
+            f.write(digest + "\n")
+            for state, opening in index.items():
+                f.write("{}\t{}\t{}\n".format(state, opening.eco, opening.name))
+    except OSError:
+        # A read only table can still be used, it is just compiled every time
+        pass
+    return index
+
+
+def classify_state_map(state_map: Dict[str, Set[StateNode]], index: Dict[str, Opening]) -> Dict[str, Opening]:
+    """
+    Classify every position of a repertoire by the last opening of the table on the shortest line
+    leading to it, so positions past the end of the table keep the name of their line.
+
+    param state_map:
+        The repertoire.
+    param index:
+        The compiled opening table, see load_eco_index.
+
+    return:
+        Map from the string representation of a board to its opening, None for positions before
+        any opening of the table
+    """
+    openings: Dict[str, Opening] = {}
+    roots = root_states(state_map)
+    for root in roots:
+        openings[root] = index.get(opening_key(root))
+    queue = deque(roots)
+    while queue:
+        state = queue.popleft()
+        for node in state_map.get(state, ()):
+            if node.state not in openings:
+                openings[node.state] = index.get(opening_key(node.state), openings[state])
+                queue.append(node.state)
+    return openings
+
+
+class OpeningTracker():
+    def __init__(self, index: Dict[str, Opening], state_map: Dict[str, Set[StateNode]] = None):
+        """
+        Follows the opening of the positions shown on the board.
+
+        param index:
+            The compiled opening table, see load_eco_index.
+        param state_map:
+            The repertoire, its positions are classified up front.
+        """
+        self.index = index
+        self.lines: Dict[str, Opening] = {}
+        self.opening: Opening = None
+        self.set_state_map(state_map)
+
+    def set_state_map(self, state_map: Dict[str, Set[StateNode]], lines: Dict[str, Opening] = None):
+        """
+        Follow the openings of another repertoire, i.e. after it was reloaded.
+
+        param state_map:
+            The repertoire.
+        param lines:
+            The classification of the repertoire, see classify_state_map, when it was already
+            computed on another thread. It is computed here otherwise.
+        """
+        if lines is None:
+            # Only repertoires held in memory can be traversed, positions of others are looked up as played
+            lines = classify_state_map(state_map, self.index) if isinstance(state_map, dict) else {}
+        self.lines = lines
+        self.lines[str(Board())] = None
+
+    def update(self, state: str) -> Opening:
+        """
+        param state:
+            The string representation of the board shown.
+
+        return:
+            The opening of the position, positions outside of the table and the repertoire keep the
+            opening of the position before them
+        """
+        key = opening_key(state)
+        if key in self.index:
+            self.opening = self.index[key]
+        elif state in self.lines:
+            self.opening = self.lines[state]
+        return self.opening
@@ -0,0 +1,181 @@
+import heapq
+import os
+import tempfile
+from collections import Counter
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from .games import iter_games, map_game_chunks, replay
+
+# The number of distinct (position, move) pairs a worker counts in memory before spilling them
+MAX_ENTRIES = 1000000
+# The number of run files merged at once, every one of them holds a file handle and a read buffer
+MAX_FAN_IN = 64
+
+
+def spill(counts: Counter, spill_dir: str) -> str:
+    """
+    Write counts to a run file sorted by position and move, one "position\tmove\tcount" per line.
+
+    return:
+        The path of the run file
+    """
+    return write_run(((state, move, count) for (state, move), count in sorted(counts.items())), spill_dir)
+
+
+def write_run(entries: Iterable[Tuple[str, str, int]], spill_dir: str) -> str:
+    """
+    Write entries already sorted by position and move to a run file.
+
+    return:
+        The path of the run file
+    """
+    fd, path = tempfile.mkstemp(suffix=".run", dir=spill_dir)
+    with os.fdopen(fd, "w", encoding="latin-1", newline="\n") as f:
+        for state, move, count in entries:
+            f.write("{}\t{}\t{}\n".format(state, move, count))
+    return path
+
+
+def count_chunk(filepath: str, start: int, end: int, max_ply: int, spill_dir: str, max_entries: int) -> List[str]:
+    """
+    Count the moves played in every position of a chunk of a game database.
+
+    param filepath:
+        The path of the database.
+    param start:
+        The offset of the chunk in the file.
+    param end:
+        The offset of the end of the chunk in the file.
+    param max_ply:
+        The number of plies of every game to count.
+    param spill_dir:
+        The directory run files are written to.
+    param max_entries:
+        The number of distinct (position, move) pairs counted in memory before they are spilled.
+
+    return:
+        The paths of the run files holding the counts
+    """
+    runs = []
+    counts: Counter = Counter()
+    for game in iter_games(filepath, start, end):
+        for board, move, _ in replay(game, max_ply=max_ply):
+            counts[(str(board), move)] += 1
+        if len(counts) >= max_entries:
+            runs.append(spill(counts, spill_dir))
+            counts.clear()
+    if counts:
+        runs.append(spill(counts, spill_dir))
+    return runs
+
+
+def read_run(path: str) -> Iterator[Tuple[str, str, int]]:
+    with open(path, encoding="latin-1", newline="\n") as f:
+        for line in f:
+            state, move, count = line.rstrip("\n").split("\t")
+            yield state, move, int(count)
+
+
+def merge_runs(runs: List[str], spill_dir: str = None, fan_in: int = MAX_FAN_IN) -> Iterator[Tuple[str, str, int]]:
+    """
+    Merge sorted run files, summing the counts of the same position and move. At most fan_in runs
+    are open at once, when there are more of them they are merged in passes, every fan_in runs
+    into an intermediate run, until few enough are left. Runs merged into an intermediate run are
+    deleted.
+
+    param runs:
+        The paths of the run files.
+    param spill_dir:
+        The directory intermediate runs are written to, defaults to the system's.
+    param fan_in:
+        The number of runs merged at once.
+    """
+    while len(runs) > fan_in:
+        merged = []
+        for i in range(0, len(runs), fan_in):
+            group = runs[i:i + fan_in]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            merged.append(write_run(merge_sorted_runs(group), spill_dir))
+            for run in group:
+                os.remove(run)
+        runs = merged
+    yield from merge_sorted_runs(runs)
+
+
+def merge_sorted_runs(runs: List[str]) -> Iterator[Tuple[str, str, int]]:
+    """
+    Merge sorted run files all at once, summing the counts of the same position and move.
+    """
+    key = None
+    total = 0
+    for state, move, count in heapq.merge(*[read_run(run) for run in runs]):
+        if (state, move) != key:
+            if key is not None:
+                yield key[0], key[1], total
+            key = (state, move)
+            total = 0
+        total += count
+    if key is not None:
+        yield key[0], key[1], total
+
+
+def build_frequency_table(database: str,
+                          output: str,
+                          max_ply: int = 20,
+                          min_count: int = 1,
+                          workers: int = None,
+                          max_entries: int = MAX_ENTRIES) -> int:
+    """
+    Count how often every move is played in every position of a game database. Chunks of games are
+    counted in parallel, every worker spills its counts to sorted run files whenever it holds too
+    many of them and the runs are merged afterwards, so memory stays bounded however large the
+    database is.
+
+    param database:
+        The path of the pgn game database.
+    param output:
+        The path of the frequency table to write, one "position\tmove\tcount" per line.
+    param max_ply:
+        The number of plies of every game to count.
+    param min_count:
+        Moves played fewer times than this in a position are left out of the table.
+    param workers:
+        The number of processes, defaults to the number of processors.
+    param max_entries:
+        The number of distinct (position, move) pairs a worker counts in memory.
+
+    return:
+        The number of entries written
+    """
+    num_entries = 0
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as spill_dir:
+        runs = [run for chunk_runs in map_game_chunks(
+                    count_chunk, database, max_ply, spill_dir, max_entries, workers=workers)
+                for run in chunk_runs]
+        with open(output, "w", encoding="latin-1", newline="\n") as f:
+            for state, move, count in merge_runs(runs, spill_dir=spill_dir):
+                if count >= min_count:
+                    f.write("{}\t{}\t{}\n".format(state, move, count))
+                    num_entries += 1
+    return num_entries
+
+
+def load_frequencies(filepath: str, states: Set[str] = None) -> Dict[Tuple[str, str], int]:
+    """
+    Load a frequency table to weight continuations with WeightStrategy.FREQUENCY.
+
+    param filepath:
+        The path of the table written by build_frequency_table.
+    param states:
+        Only load the moves of these positions, i.e. those of the repertoire.
+
+    return:
+        Map from (position, move) to the number of times the move was played in that position
+    """
+    frequencies = {}
+    for state, move, count in read_run(filepath):
+        if states is None or state in states:
+            frequencies[(state, move)] = count
+    return frequencies
@@ -0,0 +1,163 @@
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+
+from ..model.board import Board
+from ..preprocess import chapter_start, pattern_tag_pair, split_chapters
+
+# Game databases are split into chunks of about this many bytes which are processed in parallel
+CHUNK_SIZE = 8 * 1024 * 1024
+
+pattern_tag_line = re.compile(rb'^\s*\[\s*\w+\s+"')
+pattern_comment = re.compile(r"\{[^}]*\}|;[^\n]*")
+pattern_variation = re.compile(r"\([^()]*\)")
+pattern_san_token = re.compile(r"(?<![\w-])(?:[NBRQK]?[a-h]?[1-8]?x?[a-h][1-8](?:=[NBRQ])?|O-O(?:-O)?)[+#]?")
+
+
+def game_chunks(filepath: str, chunk_size: int = CHUNK_SIZE) -> List[Tuple[int, int]]:
+    """
+    Split a game database into chunks of whole games without reading all of it. Every chunk
+    boundary is moved forward to the start of the next game.
+
+    param filepath:
+        The path of the database.
+    param chunk_size:
+        The approximate number of bytes of every chunk.
+
+    return:
+        The (start, end) offsets of every chunk
+    """
+    size = os.path.getsize(filepath)
+    starts = [0]
+    with open(filepath, "rb") as f:
+        offset = chunk_size
+        while offset < size:
+            f.seek(offset)
+            # The first line is most likely only partially read
+            f.readline()
+            seen_movetext = False
+            while True:
+                position = f.tell()
+                line = f.readline()
+                if not line:
+                    position = size
+                    break
+                # A game starts with the first tag pair following the movetext of the previous one
+                if pattern_tag_line.match(line):
+                    if seen_movetext:
+                        break
+                elif line.strip():
+                    seen_movetext = True
+            if position >= size:
+                break
+            if position > starts[-1]:
+                starts.append(position)
+            offset = position + chunk_size
+        f.close()
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def iter_games(filepath: str, start: int, end: int) -> Iterator[str]:
+    """
+    param filepath:
+        The path of the database.
+    param start:
+        The offset of the chunk in the file.
+    param end:
+        The offset of the end of the chunk in the file.
+
+    return:
+        The text of every game of the chunk
+    """
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        # Latin-1 never fails to decode, moves and tag names are ascii either way
+        text = f.read(end - start).decode("latin-1")
+        f.close()
+    for game_start, game_end in split_chapters(text):
+        yield text[game_start:game_end]
+
+
+def game_tags(game: str) -> Dict[str, str]:
+    """
+    return:
+        The tag pairs of a game, i.e. {"White": "Carlsen, Magnus"}
+    """
+    return {match.group(1): match.group(2) for match in pattern_tag_pair.finditer(game)}
+
+
+def mainline_moves(game: str) -> List[str]:
+    """
+    param game:
+        The text of a game.
+
+    return:
+        The moves of the main line of the game, without comments, variations and annotations
+    """
+    movetext = pattern_tag_pair.sub(" ", game)
+    movetext = pattern_comment.sub(" ", movetext)
+    # Remove variations from the innermost out
+    while "(" in movetext:
+        pruned = pattern_variation.sub(" ", movetext)
+        if pruned == movetext:
+            break
+        movetext = pruned
+    movetext = movetext.replace("0-0-0", "O-O-O").replace("0-0", "O-O")
+    return pattern_san_token.findall(movetext)
+
+
+def replay(game: str, max_ply: int = None) -> Iterator[Tuple[Board, str, Board]]:
+    """
+    Replay the main line of a game. Replaying stops at the first move that can't be played.
+
+    param game:
+        The text of a game.
+    param max_ply:
+        The number of plies to replay, all of them by default.
+
+    return:
+        Every move of the game along with the boards before and after it
+    """
+    try:
+        board = chapter_start(game)
+    except ValueError:
+        return
+    for move in mainline_moves(game)[:max_ply]:
+        try:
+            updated_board = board.update(move)
+        except Exception:
+            return
+        yield board, move, updated_board
+        board = updated_board
+
+
+def map_game_chunks(function: Callable, filepath: str, *args, workers: int = None, chunk_size: int = CHUNK_SIZE) -> Iterator:
+    """
+    Apply a function to every chunk of a game database, in parallel across a process pool.
+
+    param function:
+        Called with the path of the database, the offsets of a chunk and the extra arguments.
+    param filepath:
+        The path of the database.
+    param workers:
+        The number of processes, defaults to the number of processors.
+    param chunk_size:
+        The approximate number of bytes of every chunk.
+
+    return:
+        The result for every chunk, in order
+    """
+    filepath = os.path.abspath(filepath)
+    chunks = game_chunks(filepath, chunk_size=chunk_size)
+    if len(chunks) <= 1 or workers == 1:
+        for start, end in chunks:
+            yield function(filepath, start, end, *args)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(
+                function,
+                [filepath] * len(chunks),
+                [start for start, _ in chunks],
+                [end for _, end in chunks],
+                *[[arg] * len(chunks) for arg in args])
@@ -0,0 +1,136 @@
+from collections import Counter
+from typing import Dict, List, NamedTuple, Set
+
+from ..model.player import Player
+from ..preprocess import StateNode, all_states
+from .diff import LineNames
+from .games import iter_games, map_game_chunks, replay
+
+
+class Gap(NamedTuple):
+    state: str
+    move: str
+    # The number of games the reply was played in
+    count: int
+    # The number of games that reached the position
+    total: int
+
+
+def player_to_move(state: str) -> Player:
+    """
+    The player to move in a position, read from its string representation without building a board.
+    """
+    return Player.WHITE if state[-1] == "0" else Player.BLACK
+
+
+def opponent_states(state_map: Dict[str, Set[StateNode]], player: Player) -> Set[str]:
+    """
+    param state_map:
+        The repertoire.
+    param player:
+        The player the repertoire is played as.
+
+    return:
+        The positions of the repertoire where the opponent is to move and has replies prepared for
+    """
+    return {state for state, continuations in state_map.items()
+            if continuations and player_to_move(state) is not player}
+
+
+def count_replies_chunk(filepath: str,
+                        start: int,
+                        end: int,
+                        repertoire: Set[str],
+                        opponent: Set[str],
+                        max_ply: int) -> Counter:
+    """
+    Count the replies played in the opponent's positions of the repertoire in a chunk of a game
+    database. A game is replayed only as long as it stays in the repertoire.
+
+    param filepath:
+        The path of the database.
+    param start:
+        The offset of the chunk in the file.
+    param end:
+        The offset of the end of the chunk in the file.
+    param repertoire:
+        Every position of the repertoire.
+    param opponent:
+        The positions of the repertoire where the opponent is to move.
+    param max_ply:
+        The number of plies of every game to replay.
+
+    return:
+        The number of times every (position, move) pair was played
+    """
+    counts: Counter = Counter()
+    for game in iter_games(filepath, start, end):
+        for board, move, updated_board in replay(game, max_ply=max_ply):
+            state = str(board)
+            if state not in repertoire:
+                break
+            if state in opponent:
+                counts[(state, move)] += 1
+            if str(updated_board) not in repertoire:
+                break
+    return counts
+
+
+def find_gaps(state_map: Dict[str, Set[StateNode]],
+              database: str,
+              player: Player,
+              max_ply: int = 20,
+              min_count: int = 1,
+              workers: int = None) -> List[Gap]:
+    """
+    Find the replies of the opponent that are played in a game database but missing from the
+    repertoire. Chunks of games are replayed in parallel, every move costs a single lookup in the
+    positions of the repertoire and games are dropped as soon as they leave it.
+
+    param state_map:
+        The repertoire.
+    param database:
+        The path of the pgn game database.
+    param player:
+        The player the repertoire is played as.
+    param max_ply:
+        The number of plies of every game to replay.
+    param min_count:
+        Replies played in fewer games are not reported.
+    param workers:
+        The number of processes, defaults to the number of processors.
+
+    return:
+        The missing replies, the most frequent first
+    """
+    repertoire = all_states(state_map)
+    opponent = opponent_states(state_map, player)
+
+    counts: Counter = Counter()
+    for chunk_counts in map_game_chunks(count_replies_chunk, database, repertoire, opponent, max_ply, workers=workers):
+        counts.update(chunk_counts)
+
+    totals: Counter = Counter()
+    for (state, _), count in counts.items():
+        totals[state] += count
+
+    gaps = []
+    for (state, move), count in counts.items():
+        if count < min_count:
+            continue
+        # Check markers are not always written the same way in games and repertoires
+        if any(node.move.rstrip("+#") == move.rstrip("+#") for node in state_map[state]):
+            continue
+        gaps.append(Gap(state, move, count, totals[state]))
+    gaps.sort(key=lambda gap: (-gap.count, gap.state, gap.move))
+    return gaps
+
+
+def format_gaps(gaps: List[Gap], state_map: Dict[str, Set[StateNode]]) -> List[str]:
+    """
+    Describe every missing reply along with the line leading to it, i.e.
+    "  412  37.5%  1. e4 e6 2. d4 d5 3. Nc3 dxe4"
+    """
+    names = LineNames(state_map)
+    return ["{:>5} {:>6.1%}  {}".format(gap.count, gap.count / gap.total, names.line(gap.state, gap.move))
+            for gap in gaps]
@@ -0,0 +1,229 @@
+import hashlib
+import os
+from collections import defaultdict
+from copy import copy
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..preprocess import StateNode, compute_depths, read_pgn, split_chapters, state_maps_from_chapters
+from .comments import CommentRef
+
+
+class Chapter():
+    def __init__(self, filepath: str, digest: str, start: int, end: int):
+        """
+        A chapter of a pgn along with the edges it produced.
+
+        param filepath:
+            The absolute path of the pgn.
+        param digest:
+            The hash of the chapter's text.
+        param start:
+            The offset of the chapter in the file. A chapter that moves because earlier chapters
+            were edited is replaced by a new one, comments of published state maps keep reading
+            through the old one.
+        param end:
+            The offset of the end of the chapter in the file.
+        """
+        self.filepath = filepath
+        self.digest = digest
+        self.start = start
+        self.end = end
+        self.edges: List[Tuple[str, StateNode]] = []
+
+
+class ChapterCommentRef(NamedTuple):
+    """
+    Location of a comment relative to the start of its chapter, so that moving a chapter around
+    the file does not invalidate its comments.
+    """
+    chapter: Chapter
+    offset: int
+    length: int
+
+    def load(self) -> str:
+        return CommentRef(self.chapter.filepath, self.chapter.start + self.offset, self.length).load()
+
+
+class IncrementalRepertoire():
+    def __init__(self, 
+                filepath: str, 
+                workers: int = None, 
+                parsed: Dict[Tuple[str, int], Dict[str, Set[StateNode]]] = None):
+        """
+        A state map which remembers which chapters of its pgn produced which edges. When the pgn
+        is edited only the chapters whose hash changed are parsed again, stale edges are removed
+        and the depths are only recomputed for the ancestors of the positions that changed.
+
+        The sets of the state map are only ever modified in place, never the nodes in them: a
+        node whose depth or comment changes is replaced by a copy. A copy of the sets of the
+        positions that changed is therefore a consistent snapshot sharing every other node.
+
+        param filepath:
+            The path of the pgn.
+        param workers:
+            The number of processes used to parse changed chapters.
+        param parsed:
+            The state maps of chapters that were already parsed, i.e. by a RepertoireLoader, by the
+            hash of their text and their offset in the file. They are not parsed again.
+        """
+        self.filepath = os.path.abspath(filepath)
+        self.workers = workers
+        self.state_map: Dict[str, Set[StateNode]] = defaultdict(set)
+        self.chapters: List[Chapter] = []
+        # For every edge, the canonical node in the state map and the comment each chapter gives it
+        self.sources: Dict[Tuple[str, StateNode], Tuple[StateNode, Dict[Chapter, ChapterCommentRef]]] = {}
+        # For every position, the edges leading to it
+        self.parents: Dict[str, Set[Tuple[str, StateNode]]] = defaultdict(set)
+        # The positions which gained or lost continuations in the last rebuild, as opposed to those
+        # whose continuations were only replaced by copies
+        self.restructured: Set[str] = set()
+        self.rebuild(parsed=parsed)
+
+    def rebuild(self, parsed: Dict[Tuple[str, int], Dict[str, Set[StateNode]]] = None) -> Set[str]:
+        """
+        Bring the state map up to date with the pgn.
+
+        param parsed:
+            The state maps of chapters that were already parsed, by the hash of their text and their
+            offset in the file.
+
+        return:
+            The positions whose continuations changed
+        """
+        pgn = read_pgn(self.filepath)
+
+        previous_chapters: Dict[str, List[Chapter]] = defaultdict(list)
+        for chapter in self.chapters:
+            previous_chapters[chapter.digest].append(chapter)
+
+        # Every added chapter is parsed before anything is modified, a chapter that fails to parse
+        # leaves the state map as it was
+        chapters: List[Chapter] = []
+        added_chapters: List[Chapter] = []
+        moved_chapters: List[Tuple[int, Chapter]] = []
+        for start, end in split_chapters(pgn):
+            digest = hashlib.sha1(pgn[start:end].encode("latin-1")).hexdigest()
+            if previous_chapters[digest]:
+                # An unchanged chapter, it only needs to know where it lives now
+                chapter = previous_chapters[digest].pop(0)
+                if chapter.start != start:
+                    moved_chapters.append((len(chapters), Chapter(self.filepath, digest, start, end)))
+            else:
+                chapter = Chapter(self.filepath, digest, start, end)
+                added_chapters.append(chapter)
+            chapters.append(chapter)
+        removed_chapters = [chapter for unmatched in previous_chapters.values() for chapter in unmatched]
+
+        parsed = parsed if parsed is not None else {}
+        chapter_maps = iter(list(state_maps_from_chapters(
+            self.filepath,
+            [(chapter.start, chapter.end) for chapter in added_chapters if (chapter.digest, chapter.start) not in parsed],
+            workers=self.workers)))
+
+        changed: Set[str] = set()
+        self.restructured = set()
+        for i, moved in moved_chapters:
+            chapters[i] = self.__move_chapter(chapters[i], moved, changed)
+        self.chapters = chapters
+        # Add before removing so that edges shared by an edited chapter and its old version are kept
+        for chapter in added_chapters:
+            chapter_map = parsed.get((chapter.digest, chapter.start))
+            if chapter_map is None:
+                chapter_map = next(chapter_maps)
+            self.__add_chapter(chapter, chapter_map, changed)
+        for chapter in removed_chapters:
+            self.__remove_chapter(chapter, changed)
+
+        self.__update_depths(changed)
+        return changed
+
+    def __add_chapter(self, chapter: Chapter, chapter_map: Dict[str, Set[StateNode]], changed: Set[str]):
+        for state, nodes in chapter_map.items():
+            for node in nodes:
+                comment_ref = None
+                if node.comment_ref is not None:
+                    comment_ref = ChapterCommentRef(
+                        chapter,
+                        node.comment_ref.offset - chapter.start,
+                        node.comment_ref.length)
+
+                key = (state, node)
+                if key in self.sources:
+                    canonical, comment_refs = self.sources[key]
+                    comment_refs[chapter] = comment_ref
+                    if canonical.comment_ref is None and comment_ref is not None:
+                        self.__replace(key, changed, comment_ref=comment_ref)
+                else:
+                    node.comment_ref = comment_ref
+                    node.depth = None
+                    self.sources[key] = (node, {chapter: comment_ref})
+                    self.state_map[state].add(node)
+                    self.parents[node.state].add(key)
+                    changed.add(state)
+                    self.restructured.add(state)
+                chapter.edges.append(key)
+
+    def __remove_chapter(self, chapter: Chapter, changed: Set[str]):
+        for key in chapter.edges:
+            state, _ = key
+            canonical, comment_refs = self.sources[key]
+            comment_refs.pop(chapter, None)
+
+            if not comment_refs:
+                # No chapter produces this edge anymore
+                del self.sources[key]
+                self.state_map[state].discard(canonical)
+                if not self.state_map[state]:
+                    del self.state_map[state]
+                self.parents[canonical.state].discard(key)
+                if not self.parents[canonical.state]:
+                    del self.parents[canonical.state]
+                changed.add(state)
+                self.restructured.add(state)
+            elif isinstance(canonical.comment_ref, ChapterCommentRef) and canonical.comment_ref.chapter is chapter:
+                # Fall back on the comment of another chapter
+                comment_ref = next((ref for ref in comment_refs.values() if ref is not None), None)
+                self.__replace(key, changed, comment_ref=comment_ref)
+
+    def __update_depths(self, changed: Set[str]):
+        # New nodes get their depth from the lines below them
+        compute_depths(self.state_map, roots=[state for state in changed if state in self.state_map])
+
+        # The longest line through every ancestor of a changed position may have changed as well. A
+        # depth can't exceed the number of edges, anything beyond that is going around a cycle.
+        max_depth = len(self.sources)
+        positions_to_update = list(changed)
+        while positions_to_update:
+            state = positions_to_update.pop()
+            depth = max((node.depth for node in self.state_map.get(state, ())), default=0) + 1
+            if depth > max_depth:
+                continue
+            for key in self.parents.get(state, ()):
+                canonical, _ = self.sources[key]
+                if canonical.depth != depth:
+                    self.__replace(key, changed, depth=depth)
+                    positions_to_update.append(key[0])
+
+    def __move_chapter(self, chapter: Chapter, moved: Chapter, changed: Set[str]) -> Chapter:
+        moved.edges = chapter.edges
+        for key in chapter.edges:
+            canonical, comment_refs = self.sources[key]
+            comment_ref = comment_refs.pop(chapter)
+            if comment_ref is not None:
+                comment_ref = ChapterCommentRef(moved, comment_ref.offset, comment_ref.length)
+            comment_refs[moved] = comment_ref
+            if isinstance(canonical.comment_ref, ChapterCommentRef) and canonical.comment_ref.chapter is chapter:
+                self.__replace(key, changed, comment_ref=comment_ref)
+        return moved
+
+    def __replace(self, key: Tuple[str, StateNode], changed: Set[str], **fields):
+        # Published state maps may hold the node, a copy with the new fields takes its place
+        canonical, comment_refs = self.sources[key]
+        node = copy(canonical)
+        for name, value in fields.items():
+            setattr(node, name, value)
+        state, _ = key
+        self.state_map[state].discard(canonical)
+        self.state_map[state].add(node)
+        self.sources[key] = (node, comment_refs)
+        changed.add(state)
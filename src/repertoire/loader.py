@@ -0,0 +1,190 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import defaultdict
+from copy import copy
+from typing import Dict, List, Sequence, Set, Tuple
+
+from ..preprocess import (CutOff, StateNode, all_states, compute_depths, merge_state_maps, read_pgn, resume_chapters,
+                          split_chapters)
+from .eco import Opening, classify_state_map
+from .frequency import load_frequencies
+from .incremental import IncrementalRepertoire
+from .sampling import ContinuationSampler
+from .similarity import SimilarityIndex
+from .watcher import ReloadedRepertoire, RepertoireReloader
+
+LOADING_PLIES = (4, 8, 16)
+
+
+class RepertoireLoader():
+    def __init__(self,
+                filepath: str,
+                plies: Sequence[int] = LOADING_PLIES,
+                workers: int = None,
+                hot_reload_interval: float = None,
+                eco_index: Dict[str, Opening] = None,
+                similar_positions: bool = False,
+                frequency_table: str = None):
+        """
+        Loads a repertoire on a background thread so the board can be shown right away. The lines
+        are loaded breadth first, every chapter is first parsed up to a few plies so the opening
+        moves can be trained while the rest is loading. Every step only parses the lines the step
+        before it cut off, and is published like a reload.
+
+        param filepath:
+            The path of the pgn.
+        param plies:
+            The increasing number of plies every chapter is parsed up to before it is parsed in full.
+        param workers:
+            The number of processes used to parse chapters.
+        param hot_reload_interval:
+            When set, the repertoire is loaded as an IncrementalRepertoire and a RepertoireReloader
+            polling it at this interval is available once loading is done.
+        param eco_index:
+            The compiled opening table, see load_eco_index. Every step is classified by it on the
+            background thread.
+        param similar_positions:
+            Whether every step is indexed by a SimilarityIndex on the background thread, requires
+            numpy.
+        param frequency_table:
+            The frequency table of the sampler, see load_frequencies. Only the moves of the loaded
+            positions are loaded from it once every position is known, the steps before have no
+            frequencies.
+        """
+        self.filepath = os.path.abspath(filepath)
+        self.plies = plies
+        self.workers = workers
+        self.hot_reload_interval = hot_reload_interval
+        self.eco_index = eco_index
+        self.similar_positions = similar_positions
+        self.frequency_table = frequency_table
+        self.lock = threading.Lock()
+        self.pending: ReloadedRepertoire = None
+        self.sampler: ContinuationSampler = None
+        self.reloader: RepertoireReloader = None
+        self.thread: threading.Thread = None
+        self.done = False
+        self.progress = "Loading repertoire..."
+        self.state_map: Dict[str, Set[StateNode]] = defaultdict(set)
+
+    def start(self, sampler: ContinuationSampler):
+        """
+        Start loading the repertoire.
+
+        param sampler:
+            The sampler in use, the samplers of the loaded repertoire are built with its strategies
+            and frequencies.
+        """
+        self.sampler = sampler
+        self.thread = threading.Thread(target=self.__run, name="repertoire-loader", daemon=True)
+        self.thread.start()
+
+    def poll(self) -> ReloadedRepertoire:
+        """
+        return:
+            The repertoire loaded since the last poll, if any
+        """
+        with self.lock:
+            loaded = self.pending
+            self.pending = None
+        return loaded
+
+    def __run(self):
+        try:
+            self.__load()
+        except Exception as e:
+            self.progress = "Could not load {}: {}".format(os.path.basename(self.filepath), e)
+            print(self.progress, file=sys.stderr)
+
+    def __load(self):
+        pgn = read_pgn(self.filepath)
+        chapters = split_chapters(pgn)
+        # The IncrementalRepertoire recognizes the chapters parsed here by the hash of their text
+        digests = [hashlib.sha1(pgn[start:end].encode("latin-1")).hexdigest() for start, end in chapters]
+        del pgn
+
+        # Every step parses the lines of every chapter from where the previous step cut them off, the
+        # moves of every chapter are kept apart so that the last step can hand them over
+        chapter_maps: List[Dict[str, Set[StateNode]]] = [defaultdict(set) for _ in chapters]
+        cut_offs: List[List[CutOff]] = [None] * len(chapters)
+        for max_ply in list(self.plies) + [None]:
+            # Chapters without lines cut off are loaded in full
+            remaining = [i for i, chapter_cut_offs in enumerate(cut_offs) if chapter_cut_offs != []]
+            results = resume_chapters(
+                self.filepath, 
+                [chapters[i] for i in remaining], 
+                [cut_offs[i] for i in remaining], 
+                workers=self.workers, 
+                max_ply=max_ply)
+            for loaded, (i, (chapter_map, chapter_cut_offs)) in enumerate(zip(remaining, results)):
+                if max_ply is None:
+                    self.progress = "Loading all moves: {}/{} chapters".format(loaded + 1, len(remaining))
+                else:
+                    self.progress = "Loading moves 1 to {}: {}/{} chapters".format(
+                        (max_ply + 1) // 2, loaded + 1, len(remaining))
+                merge_state_maps(chapter_maps[i], chapter_map)
+                cut_offs[i] = chapter_cut_offs
+
+            # Once nothing is cut off the next steps would have nothing left to load
+            if max_ply is None or not any(cut_offs):
+                break
+
+            # The nodes of every step are copies, the depths computed for one step are stale in the next
+            state_map: Dict[str, Set[StateNode]] = defaultdict(set)
+            for chapter_map in chapter_maps:
+                merge_state_maps(state_map, {state: {copy(node) for node in nodes} for state, nodes in chapter_map.items()})
+            compute_depths(state_map)
+            self.__publish(state_map, ready=ready_states(state_map, cut_offs))
+
+        if self.hot_reload_interval is not None:
+            parsed = {(digest, start): chapter_map 
+                      for (start, _), digest, chapter_map in zip(chapters, digests, chapter_maps)}
+            self.reloader = RepertoireReloader(
+                IncrementalRepertoire(self.filepath, workers=self.workers, parsed=parsed),
+                interval=self.hot_reload_interval,
+                eco_index=self.eco_index,
+                similar_positions=self.similar_positions)
+            state_map = self.reloader.state_map
+        else:
+            state_map = defaultdict(set)
+            for chapter_map in chapter_maps:
+                merge_state_maps(state_map, chapter_map)
+            compute_depths(state_map)
+        frequencies = None
+        if self.frequency_table is not None:
+            frequencies = load_frequencies(self.frequency_table, states=all_states(state_map))
+        self.__publish(state_map, ready=None, frequencies=frequencies)
+        self.done = True
+
+    def __publish(self, state_map: Dict[str, Set[StateNode]], ready: Set[str], frequencies: Dict[Tuple[str, str], int] = None):
+        sampler = self.sampler.with_state_map(state_map)
+        if frequencies is not None:
+            # The sampler isn't published yet, the main loop may still be drawing from the previous one
+            sampler.set_frequencies(frequencies)
+        self.sampler = sampler
+        openings = classify_state_map(state_map, self.eco_index) if self.eco_index is not None else None
+        similar = None
+        if self.similar_positions:
+            similar = SimilarityIndex(state_map)
+            similar.build()
+        with self.lock:
+            self.pending = ReloadedRepertoire(state_map, self.sampler, ready=ready, openings=openings, similar=similar)
+
+
+def ready_states(state_map: Dict[str, Set[StateNode]], cut_offs: List[List[CutOff]]) -> Set[str]:
+    """
+    The positions whose continuations were all loaded, which are those of the loaded state map
+    except where a line was cut off. Positions a line transposes into are ready as soon as any
+    chapter loaded them.
+
+    param state_map:
+        The partially loaded state map.
+    param cut_offs:
+        Where the lines of every chapter were cut off.
+
+    return:
+        The positions that are ready to be trained
+    """
+    return all_states(state_map) - {cut_off.state for chapter_cut_offs in cut_offs for cut_off in chapter_cut_offs}
@@ -0,0 +1,171 @@
+import mmap
+import os
+import struct
+from functools import lru_cache
+from typing import Dict, List, Set, Tuple
+
+from ..model.board import Board
+from ..model.pieces.king import King
+from ..model.pos import Pos
+from ..preprocess import StateNode
+from .zobrist import zobrist_hash
+
+# Every entry is a big endian key (8 bytes), move (2 bytes), weight (2 bytes) and learn (4 bytes)
+entry_struct = struct.Struct(">QHHI")
+ENTRY_SIZE = entry_struct.size
+MAX_WEIGHT = 0xFFFF
+
+promotion_codes = {None: 0, "N": 1, "B": 2, "R": 3, "Q": 4}
+promotion_pieces = {code: piece for piece, code in promotion_codes.items()}
+
+
+def encode_move(origin: Pos, dest: Pos, promotion: str = None, is_castle: bool = False) -> int:
+    """
+    Encode a move in the Polyglot format. Castling is encoded as the king capturing its own rook.
+
+    param origin:
+        The position of the piece being moved.
+    param dest:
+        The position the piece is being moved to.
+    param promotion:
+        The piece a pawn is promoted to, i.e. "Q", if any.
+    param is_castle:
+        Whether or not the move is a castle.
+
+    return:
+        The 16 bit move
+    """
+    if is_castle:
+        dest = Pos(dest.rank, 7 if dest.file == 6 else 0)
+    return dest.file | (dest.rank << 3) | (origin.file << 6) | (origin.rank << 9) | \
+        (promotion_codes[promotion] << 12)
+
+
+def decode_move(move: int, board: Board) -> Tuple[Pos, Pos, str]:
+    """
+    Decode a Polyglot move played on the given board.
+
+    return:
+        A tuple of the form (origin, dest, promotion)
+    """
+    dest = Pos((move >> 3) & 7, move & 7)
+    origin = Pos((move >> 9) & 7, (move >> 6) & 7)
+    promotion = promotion_pieces.get((move >> 12) & 7)
+
+    # Translate the king capturing its own rook into the king's castling destination
+    piece = board.get(origin)
+    if isinstance(piece, King) and origin.file == 4 and dest.rank == origin.rank and dest.file in (0, 7):
+        dest = Pos(dest.rank, 6 if dest.file == 7 else 2)
+    return origin, dest, promotion
+
+
+def write_polyglot(state_map: Dict[str, Set[StateNode]], filepath: str):
+    """
+    Export a repertoire as a Polyglot book. Every move is weighted by the depth of its node.
+
+    param state_map:
+        The repertoire.
+    param filepath:
+        The path of the .bin book to write.
+    """
+    entries: List[Tuple[int, int, int]] = []
+    for state, continuations in state_map.items():
+        if not continuations:
+            continue
+        board = Board(board_str=state)
+        key = zobrist_hash(board)
+        for node in continuations:
+            is_castle = node.move.startswith("O-O")
+            move = encode_move(node.origin, node.dest, node.promotion, is_castle=is_castle)
+            weight = min(node.depth if node.depth is not None else 1, MAX_WEIGHT)
+            entries.append((key, move, weight))
+
+    # Books are sorted by key, moves of the same position from the highest weight down
+    entries.sort(key=lambda entry: (entry[0], -entry[2], entry[1]))
+    with open(filepath, "wb") as f:
+        for key, move, weight in entries:
+            f.write(entry_struct.pack(key, move, weight, 0))
+        f.close()
+
+
+class PolyglotBook():
+    def __init__(self, filepath: str, cache_size: int = 4096):
+        """
+        A Polyglot book used in place of a state map. Nothing is preprocessed, the positions are
+        looked up with a binary search over the memory mapped file whenever they are needed.
+
+        param filepath:
+            The path of the .bin book.
+        param cache_size:
+            The number of recently looked up positions to keep decoded.
+        """
+        self.filepath = filepath
+        self.file = open(filepath, "rb")
+        # An empty file can't be memory mapped
+        self.size = os.path.getsize(filepath)
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b""
+        self.num_entries = self.size // ENTRY_SIZE
+        self.__continuations = lru_cache(maxsize=cache_size)(self.__continuations_uncached)
+
+    def close(self):
+        if self.size:
+            self.data.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.num_entries
+
+    def __getitem__(self, state: str) -> Set[StateNode]:
+        return self.__continuations(state)
+
+    def __contains__(self, state: str) -> bool:
+        return len(self.__continuations(state)) > 0
+
+    def get(self, state: str, default=None) -> Set[StateNode]:
+        continuations = self.__continuations(state)
+        return continuations if continuations else default
+
+    def entries(self, key: int) -> List[Tuple[int, int]]:
+        """
+        param key:
+            The Zobrist hash of a position.
+
+        return:
+            The (move, weight) pairs stored for the position
+        """
+        # Binary search for the first entry with the key
+        lo = 0
+        hi = self.num_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entry_struct.unpack_from(self.data, mid * ENTRY_SIZE)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        entries = []
+        for i in range(lo, self.num_entries):
+            entry_key, move, weight, _ = entry_struct.unpack_from(self.data, i * ENTRY_SIZE)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+        return entries
+
+    def __continuations_uncached(self, state: str) -> Set[StateNode]:
+        board = Board(board_str=state)
+        continuations = set()
+        for move, weight in self.entries(zobrist_hash(board)):
+            origin, dest, promotion = decode_move(move, board)
+            piece = board.get(origin)
+            # A hash collision or a broken book can produce moves that make no sense here
+            if piece is None or not board.is_legal_move(dest, piece).is_legal():
+                continue
+            move_str = board.move_to_pgn_notation(origin, dest, promotion_piece=promotion)
+            continuations.add(StateNode(
+                move_str,
+                str(board.update(move_str)),
+                depth=max(weight, 1),
+                origin=origin,
+                dest=dest,
+                promotion=promotion))
+        return continuations
@@ -0,0 +1,146 @@
+import re
+from typing import Dict, List, Set
+
+from ..model.pos import Pos
+from ..preprocess import StateNode, all_states
+
+# Also the order pieces are listed in by material signatures, i.e. "KRPPkrp"
+PIECES = "KQRBNPkqrbnp"
+
+# Pieces are sorted by sorting the letters they are translated to
+to_sort_keys = str.maketrans({**{piece: chr(ord("a") + i) for i, piece in enumerate(PIECES)}, "G": "f", "g": "l", "_": None})
+from_sort_keys = str.maketrans({chr(ord("a") + i): piece for i, piece in enumerate(PIECES)})
+
+pattern_condition = re.compile(r"^(-)?(?:([KQRBNPkqrbnp])([a-h][1-8])?|(white|black|check)|material=([KQRBNPkqrbnp]+))$")
+
+
+def material_signature(pieces: str) -> str:
+    """
+    param pieces:
+        The pieces of a position in any order, pawns that can be captured en passant and empty
+        squares included.
+
+    return:
+        The pieces in the order of PIECES, i.e. "KRPPkrp"
+    """
+    return "".join(sorted(pieces.translate(to_sort_keys))).translate(from_sort_keys)
+
+
+def bitset(column: str, matches: str) -> int:
+    """
+    param column:
+        One character of every position, i.e. the piece on a square.
+    param matches:
+        The characters that set a bit.
+
+    return:
+        The set of positions as an integer, bit i is set if the character of position i matches
+    """
+    table = str.maketrans({c: ("1" if c in matches else "0") for c in set(column)})
+    # The first position is the least significant bit
+    return int("0" + column.translate(table)[::-1], 2)
+
+
+def bits_from_indices(indices: List[int], size: int) -> int:
+    """
+    return:
+        The set of positions with the given indices, see bitset
+    """
+    bits = bytearray((size + 7) // 8)
+    for i in indices:
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, "little")
+
+
+def bit_indices(bits: int) -> List[int]:
+    """
+    return:
+        The indices of the bits set, in ascending order
+    """
+    digits = bin(bits)[:1:-1]
+    indices = []
+    i = digits.find("1")
+    while i != -1:
+        indices.append(i)
+        i = digits.find("1", i + 1)
+    return indices
+
+
+class PositionIndex():
+    def __init__(self, state_map: Dict[str, Set[StateNode]]):
+        """
+        Bitmap indexes over every position of a repertoire, so conditions on the pieces, the player
+        to move and the material are answered with a few bitwise operations on integers instead
+        of decoding every position into a board.
+
+        param state_map:
+            The repertoire.
+        """
+        self.states: List[str] = sorted(all_states(state_map))
+        self.all = (1 << len(self.states)) - 1
+
+        # Every position is 73 characters long, slicing with a step of 73 picks one character of
+        # every position at once
+        joined = "".join(self.states)
+        step = len(self.states[0]) if self.states else 73
+        pawns = {"P": "PG", "p": "pg"}
+
+        # A bitset for every piece on every square and for every piece anywhere on the board
+        self.piece_squares: Dict[str, int] = {}
+        self.pieces: Dict[str, int] = {piece: 0 for piece in PIECES}
+        for square in range(64):
+            column = joined[square::step]
+            present = set(column)
+            for piece in PIECES:
+                matches = pawns.get(piece, piece)
+                bits = bitset(column, matches) if any(c in present for c in matches) else 0
+                self.piece_squares[piece + Pos.file_from_index(square % 8) + str(square // 8 + 1)] = bits
+                self.pieces[piece] |= bits
+
+        white_check = bitset(joined[70::step], "1")
+        black_check = bitset(joined[71::step], "1")
+        self.white = bitset(joined[72::step], "0")
+        self.black = self.all & ~self.white
+        self.check = (self.white & white_check) | (self.black & black_check)
+
+        indices: Dict[str, List[int]] = {}
+        for i, state in enumerate(self.states):
+            indices.setdefault(material_signature(state[:64]), []).append(i)
+        self.signatures: Dict[str, int] = {signature: bits_from_indices(positions, len(self.states))
+                                           for signature, positions in indices.items()}
+
+    def condition(self, condition: str) -> int:
+        """
+        param condition:
+            One of "Pe5" for a white pawn on e5, "q" for a black queen anywhere on the board, "white"
+            or "black" for the player to move, "check" for the player to move being in check or
+            "material=KRPkr" for the exact pieces on the board. Any condition can be negated by a
+            leading "-", i.e. "-Q".
+
+        return:
+            The set of positions meeting the condition, see bitset
+        """
+        match = pattern_condition.match(condition)
+        if match is None:
+            raise ValueError("Unknown condition {}".format(condition))
+        negate, piece, square, flag, signature = match.groups()
+        if piece is not None:
+            bits = self.piece_squares[piece + square] if square is not None else self.pieces[piece]
+        elif flag is not None:
+            bits = getattr(self, flag)
+        else:
+            bits = self.signatures.get(material_signature(signature), 0)
+        return self.all & ~bits if negate else bits
+
+    def query(self, conditions: List[str]) -> List[str]:
+        """
+        param conditions:
+            The conditions every position has to meet, see condition.
+
+        return:
+            The string representations of the boards of the matching positions
+        """
+        bits = self.all
+        for condition in conditions:
+            bits &= self.condition(condition)
+        return [self.states[i] for i in bit_indices(bits)]
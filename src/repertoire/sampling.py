@@ -0,0 +1,325 @@
+import random
+from copy import copy
+from enum import Enum
+from typing import Dict, Iterable, List, Set, Tuple
+
+from ..preprocess import StateNode
+
+
+class WeightStrategy(Enum):
+    # Weight a continuation by the length of the longest line following it
+    DEPTH = 0
+    # Weight a continuation by the number of complete lines following it
+    LEAVES = 1
+    # Every continuation is equally likely
+    UNIFORM = 2
+    # Weight a continuation by how often it is played according to an external frequency table
+    FREQUENCY = 3
+
+
+class AliasTable():
+    """
+    Vose's alias method: after O(n) preprocessing a weighted index can be drawn in O(1).
+    """
+    def __init__(self, weights: List[float]):
+        n = len(weights)
+        total = sum(weights)
+        if total <= 0:
+            # Nothing to go by, fall back to a uniform distribution
+            weights = [1] * n
+            total = n
+
+        self.prob: List[float] = [0.0] * n
+        self.alias: List[int] = list(range(n))
+
+        scaled = [weight * n / total for weight in weights]
+        small = [i for i, p in enumerate(scaled) if p < 1]
+        large = [i for i, p in enumerate(scaled) if p >= 1]
+
+        while small and large:
+            less = small.pop()
+            more = large.pop()
+            self.prob[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] = scaled[more] + scaled[less] - 1
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+
+        # Whatever is left over only differs from 1 by floating point error
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.prob)
+
+    def sample(self, rng: random.Random = random) -> int:
+        """
+        return:
+            An index drawn with probability proportional to its weight
+        """
+        u = rng.random() * len(self.prob)
+        i = int(u)
+        return i if u - i < self.prob[i] else self.alias[i]
+
+
+def leaf_counts(state_map: Dict[str, Set[StateNode]],
+                roots: Iterable[str] = None,
+                known: Dict[str, int] = None) -> Dict[str, int]:
+    """
+    Count the number of complete lines that can be played from every position in the state map.
+    A position without continuations ends exactly one line.
+
+    param state_map:
+        The repertoire.
+    param roots:
+        The positions to count, along with everything below them. Defaults to every position.
+    param known:
+        Counts that are still valid, i.e. those of the positions that did not change and do not
+        lead to one that did. They are not counted again.
+
+    return:
+        A map from position to the number of lines through it
+    """
+    counts: Dict[str, int] = dict(known) if known is not None else {}
+    in_progress: Set[str] = set()
+
+    for root in list(roots if roots is not None else state_map.keys()):
+        if root in counts:
+            continue
+
+        # Iterative post order traversal, a position is counted once all of its children are
+        stack = [root]
+        while stack:
+            state = stack[-1]
+            if state in counts:
+                stack.pop()
+                continue
+
+            in_progress.add(state)
+            pending = False
+            for node in state_map.get(state, ()):
+                if node.state not in counts and node.state not in in_progress:
+                    stack.append(node.state)
+                    pending = True
+            if pending:
+                continue
+
+            # A continuation that loops back to a position still being counted ends the line
+            continuations = state_map.get(state, ())
+            if continuations:
+                counts[state] = sum(counts.get(node.state, 1) for node in continuations)
+            else:
+                counts[state] = 1
+            in_progress.discard(state)
+            stack.pop()
+
+    return counts
+
+
+class ContinuationSampler():
+    def __init__(self,
+                state_map: Dict[str, Set[StateNode]],
+                strategy: WeightStrategy = WeightStrategy.DEPTH,
+                frequencies: Dict[Tuple[str, str], int] = None,
+                rng: random.Random = None,
+                precompute: bool = True):
+        """
+        Draws continuations from the state map in O(1). The alias tables of every position are
+        built once per strategy and cached.
+
+        param state_map:
+            The repertoire.
+        param strategy:
+            How continuations should be weighted.
+        param frequencies:
+            Map from (position, move) to the number of times the move was played in that position.
+            Required by WeightStrategy.FREQUENCY.
+        param rng:
+            The random number generator to draw from, useful to seed automated drills.
+        param precompute:
+            Whether the tables of every position are built up front. State maps that can't be 
+            enumerated, like a Polyglot book, build the table of a position when it is first needed.
+        """
+        self.state_map = state_map
+        self.precompute = precompute
+        self.frequencies = frequencies
+        self.rng = rng if rng is not None else random.Random()
+        self.tables: Dict[WeightStrategy, Dict[str, Tuple[List[StateNode], AliasTable]]] = {}
+        self.leaf_counts: Dict[str, int] = None
+        self.set_strategy(strategy)
+
+    def set_strategy(self, strategy: WeightStrategy):
+        """
+        Change how continuations are weighted, building the alias tables for the strategy if they
+        have not been built before.
+        """
+        self.__get_tables(strategy)
+        self.strategy = strategy
+
+    def set_frequencies(self, frequencies: Dict[Tuple[str, str], int]):
+        """
+        Replace the external frequency table, discarding any tables that were built from it.
+        """
+        self.frequencies = frequencies
+        self.tables.pop(WeightStrategy.FREQUENCY, None)
+        if self.strategy is WeightStrategy.FREQUENCY:
+            self.set_strategy(WeightStrategy.FREQUENCY)
+
+    def with_state_map(self, state_map: Dict[str, Set[StateNode]], changed: Set[str] = None) -> "ContinuationSampler":
+        """
+        A sampler of another state map, i.e. a reloaded repertoire, with the same strategy and 
+        frequencies. The tables of every strategy this sampler has built are built up front.
+
+        param state_map:
+            The state map of the new sampler.
+        param changed:
+            The positions whose continuations differ from those of this sampler's state map, along
+            with every position leading to one of them. The tables and line counts of every other
+            position are shared with this sampler rather than built again. Defaults to every
+            position.
+        """
+        if changed is not None:
+            return self.__with_changes(state_map, changed)
+
+        sampler = ContinuationSampler(
+            state_map,
+            strategy=self.strategy,
+            frequencies=self.frequencies,
+            rng=self.rng,
+            precompute=self.precompute)
+        for strategy in list(self.tables.keys()):
+            sampler.set_strategy(strategy)
+        sampler.set_strategy(self.strategy)
+        return sampler
+
+    def line_counts(self) -> Dict[str, int]:
+        """
+        return:
+            The number of complete lines that can be played from every position, see leaf_counts.
+            They are counted once and shared with WeightStrategy.LEAVES.
+        """
+        if self.leaf_counts is None:
+            if not self.precompute:
+                raise ValueError("Counting lines requires a repertoire held in memory")
+            self.leaf_counts = leaf_counts(self.state_map)
+        return self.leaf_counts
+
+    def sample(self, state: str, strategy: WeightStrategy = None) -> StateNode:
+        """
+        param state:
+            The string representation of the current board.
+        param strategy:
+            Overrides the current strategy for this draw.
+
+        return:
+            A continuation drawn according to the strategy, or None if there isn't one
+        """
+        strategy = strategy if strategy is not None else self.strategy
+        tables = self.__get_tables(strategy)
+        if not self.precompute and state not in tables:
+            tables[state] = self.__build_table(strategy, state, self.state_map.get(state))
+        entry = tables.get(state)
+        if entry is None:
+            return None
+        nodes, table = entry
+        return nodes[table.sample(self.rng)]
+
+    def __with_changes(self, state_map: Dict[str, Set[StateNode]], changed: Set[str]) -> "ContinuationSampler":
+        sampler = copy(self)
+        sampler.state_map = state_map
+        if self.leaf_counts is not None:
+            sampler.leaf_counts = leaf_counts(
+                state_map,
+                roots=changed,
+                known={state: count for state, count in self.leaf_counts.items() if state not in changed})
+
+        # The tables of this sampler are copied rather than modified, the main loop may still be
+        # drawing from them
+        sampler.tables = {}
+        for strategy, tables in list(self.tables.items()):
+            tables = dict(tables)
+            for state in changed:
+                entry = sampler.__build_table(strategy, state, state_map.get(state)) if self.precompute else None
+                if entry is not None:
+                    tables[state] = entry
+                else:
+                    tables.pop(state, None)
+            sampler.tables[strategy] = tables
+        return sampler
+
+    def __get_tables(self, strategy: WeightStrategy) -> Dict[str, Tuple[List[StateNode], AliasTable]]:
+        if strategy is WeightStrategy.FREQUENCY and self.frequencies is None:
+            raise ValueError("The frequency strategy requires a frequency table")
+        if strategy not in self.tables:
+            self.tables[strategy] = self.__build_tables(strategy)
+        return self.tables[strategy]
+
+    def __build_tables(self, strategy: WeightStrategy) -> Dict[str, Tuple[List[StateNode], AliasTable]]:
+        if strategy is WeightStrategy.LEAVES and self.leaf_counts is None:
+            if not self.precompute:
+                raise ValueError("The leaves strategy requires a repertoire held in memory")
+            self.line_counts()
+
+        tables = {}
+        if self.precompute:
+            for state, continuations in self.state_map.items():
+                if continuations:
+                    tables[state] = self.__build_table(strategy, state, continuations)
+        return tables
+
+    def __build_table(self, 
+                      strategy: WeightStrategy, 
+                      state: str, 
+                      continuations: Set[StateNode]) -> Tuple[List[StateNode], AliasTable]:
+        if not continuations:
+            return None
+        nodes = list(continuations)
+        weights = [self.__weight(strategy, state, node) for node in nodes]
+        return nodes, AliasTable(weights)
+
+    def __weight(self, strategy: WeightStrategy, state: str, node: StateNode) -> float:
+        if strategy is WeightStrategy.DEPTH:
+            return node.depth if node.depth is not None else 1
+        elif strategy is WeightStrategy.LEAVES:
+            return self.leaf_counts.get(node.state, 1)
+        elif strategy is WeightStrategy.FREQUENCY:
+            return self.frequencies.get((state, node.move), 0)
+        else:
+            return 1
+
+
+class LineSampler():
+    def __init__(self, sampler: ContinuationSampler, strategy: WeightStrategy = WeightStrategy.LEAVES):
+        """
+        Draws complete repertoire lines. With WeightStrategy.LEAVES every line below the root is 
+        equally likely since each continuation is chosen proportionally to the number of lines 
+        following it, other strategies weight lines by importance instead.
+
+        param sampler:
+            The continuation sampler whose cached alias tables are used to descend.
+        param strategy:
+            How continuations should be weighted while descending.
+        """
+        self.sampler = sampler
+        self.strategy = strategy
+
+    def sample_line(self, root: str) -> List[StateNode]:
+        """
+        Draw a line in O(depth) by descending from the root until no continuations are left.
+
+        param root:
+            The string representation of the board the line starts from.
+
+        return:
+            The moves of the line in order
+        """
+        line: List[StateNode] = []
+        visited = {root}
+        node = self.sampler.sample(root, strategy=self.strategy)
+        while node is not None and node.state not in visited:
+            line.append(node)
+            visited.add(node.state)
+            node = self.sampler.sample(node.state, strategy=self.strategy)
+        return line
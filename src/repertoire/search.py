@@ -0,0 +1,138 @@
+import hashlib
+import os
+import re
+from collections import Counter
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..preprocess import StateNode
+from .diff import CommentReader
+
+# Bumped whenever the layout of saved indexes changes, older indexes are built again
+INDEX_FORMAT_VERSION = 1
+# Words and moves alike, i.e. "c5", "nxe4" or "knight"
+pattern_term = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    return:
+        The lowercase terms of a text, in order
+    """
+    return pattern_term.findall(text.lower())
+
+
+class SearchResult(NamedTuple):
+    state: str
+    move: str
+    # The number of times the terms of the query occur in the comment
+    score: int
+
+
+class CommentIndex():
+    def __init__(self, postings: Dict[str, Dict[Tuple[str, str], int]] = None):
+        """
+        An inverted index from the terms of the comments of a repertoire to the moves carrying them.
+
+        param postings:
+            Map from a term to the (position, move) pairs whose comment holds it, along with the
+            number of times it occurs in the comment.
+        """
+        self.postings: Dict[str, Dict[Tuple[str, str], int]] = postings if postings is not None else {}
+
+    @staticmethod
+    def build(state_map: Dict[str, Set[StateNode]]) -> "CommentIndex":
+        """
+        Index the comments of every move of a repertoire. Every pgn is read once.
+        """
+        index = CommentIndex()
+        comments = CommentReader()
+        for state, continuations in state_map.items():
+            for node in continuations:
+                if node.comment_ref is None:
+                    continue
+                for term, count in Counter(tokenize(comments.comment(node))).items():
+                    index.postings.setdefault(term, {})[(state, node.move)] = count
+        return index
+
+    def search(self, query: str) -> List[SearchResult]:
+        """
+        Find the moves whose comment holds every term of a query, i.e. "c5 break".
+
+        return:
+            The moves found, ranked by the number of times the terms occur in their comment
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        # Intersect starting from the rarest term so the fewest postings are visited
+        ordered = sorted(terms, key=lambda term: len(self.postings.get(term, ())))
+        matches = set(self.postings.get(ordered[0], ()))
+        for term in ordered[1:]:
+            matches.intersection_update(self.postings.get(term, ()))
+            if not matches:
+                break
+        results = [SearchResult(state, move, sum(self.postings[term][(state, move)] for term in terms))
+                   for state, move in matches]
+        results.sort(key=lambda result: (-result.score, result.state, result.move))
+        return results
+
+    def save(self, filepath: str, digest: str):
+        """
+        Write the index, one "term\tposition\tmove\tcount" per line after a header holding the
+        format version and the digest of the pgn.
+        """
+        with open(filepath, "w", encoding="utf-8", newline="\n") as f:
+            f.write("{}\t{}\n".format(INDEX_FORMAT_VERSION, digest))
+            for term, postings in self.postings.items():
+                for (state, move), count in postings.items():
+                    f.write("{}\t{}\t{}\t{}\n".format(term, state, move, count))
+
+    @staticmethod
+    def load(filepath: str, digest: str) -> "CommentIndex":
+        """
+        return:
+            The index saved to the file, or None if it was built from another version of the pgn
+            or saved in another format
+        """
+        with open(filepath, encoding="utf-8", newline="\n") as f:
+            if f.readline().rstrip("\n") != "{}\t{}".format(INDEX_FORMAT_VERSION, digest):
+                return None
+            index = CommentIndex()
+            for line in f:
+                term, state, move, count = line.rstrip("\n").split("\t")
+                index.postings.setdefault(term, {})[(state, move)] = int(count)
+        return index
+
+
+def pgn_digest(filepath: str) -> str:
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def load_comment_index(filepath: str, state_map: Dict[str, Set[StateNode]]) -> CommentIndex:
+    """
+    Load the comment index of a pgn, which is kept next to it and built again when the pgn changes
+    or was saved in another format.
+
+    param filepath:
+        The path of the pgn.
+    param state_map:
+        The repertoire read from the pgn, indexed if there is no index of this version of it.
+
+    return:
+        The comment index
+    """
+    digest = pgn_digest(filepath)
+    index_path = filepath + ".comments"
+    if os.path.exists(index_path):
+        index = CommentIndex.load(index_path, digest)
+        if index is not None:
+            return index
+
+    index = CommentIndex.build(state_map)
+    try:
+        index.save(index_path, digest)
+    except OSError:
+        # The index only saves building it again, i.e. next to a pgn in a read only directory
+        pass
+    return index
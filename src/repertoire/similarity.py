@@ -0,0 +1,120 @@
+from typing import Dict, List, Set, Tuple
+
+from ..preprocess import StateNode, all_states
+from .diff import LineNames
+from .tensors import PIECE_PLANES, STATE_LENGTH, np, require_numpy
+
+BLOCK_SIZE = 16384
+# A feature for every piece on every square, one for white to move and one that pads positions
+WHITE_TO_MOVE = len(PIECE_PLANES) * 64
+PADDING = WHITE_TO_MOVE + 1
+# At most 32 pieces and the player to move
+MAX_FEATURES = 33
+
+
+def encode_features(states: List[str]) -> "np.ndarray":
+    """
+    Encode positions as the sorted indices of their piece-square features, padded with PADDING.
+
+    return:
+        An array of shape (len(states), MAX_FEATURES)
+    """
+    require_numpy()
+    n = len(states)
+    chars = np.frombuffer("".join(states).encode("latin-1"), dtype=np.uint8).reshape(n, STATE_LENGTH)
+
+    planes = np.full(256, -1, dtype=np.int16)
+    for plane, piece in enumerate(PIECE_PLANES):
+        planes[ord(piece)] = plane
+    planes[ord("G")] = PIECE_PLANES.index("P")
+    planes[ord("g")] = PIECE_PLANES.index("p")
+
+    square_planes = planes[chars[:, :64]]
+    features = np.where(square_planes >= 0, square_planes * 64 + np.arange(64, dtype=np.int16), PADDING)
+    side = np.where(chars[:, STATE_LENGTH - 1] == ord("0"), WHITE_TO_MOVE, PADDING).astype(np.int16)
+    features = np.concatenate([features, side[:, None]], axis=1)
+    # Padding sorts last, so only the first columns hold features
+    return np.sort(features, axis=1)[:, :MAX_FEATURES]
+
+
+class SimilarityIndex():
+    def __init__(self, state_map: Dict[str, Set[StateNode]], block_size: int = BLOCK_SIZE):
+        """
+        Finds the positions of a repertoire closest to any position. The distance between two
+        positions is the number of piece-square features, and the player to move, that only one
+        of them has, so moving one pawn is a distance of 2. Every position is encoded once and
+        searched by brute force, one block of positions at a time. The index is built when it is
+        first searched unless build was called before, i.e. on the thread that loaded the repertoire.
+
+        param state_map:
+            The repertoire.
+        param block_size:
+            The number of positions compared at once.
+        """
+        self.block_size = block_size
+        self.state_map = state_map
+        self.states: List[str] = None
+        self.features: "np.ndarray" = None
+        self.counts: "np.ndarray" = None
+        self.names: LineNames = None
+
+    def set_state_map(self, state_map: Dict[str, Set[StateNode]]):
+        """
+        Search another repertoire, i.e. after it was reloaded. It is indexed when it is first searched.
+        """
+        self.state_map = state_map
+        self.states = None
+
+    def build(self):
+        """
+        Encode every position of the repertoire. Takes a while on large repertoires, the trainer
+        builds its indices on the thread loading the repertoire rather than on a wrong move.
+        """
+        require_numpy()
+        self.states = sorted(all_states(self.state_map))
+        if self.states:
+            self.features = np.concatenate([encode_features(self.states[start:start + self.block_size])
+                                            for start in range(0, len(self.states), self.block_size)])
+        else:
+            self.features = np.zeros((0, MAX_FEATURES), dtype=np.int16)
+        self.counts = (self.features != PADDING).sum(axis=1)
+        self.names = LineNames(self.state_map)
+
+    def nearest(self, state: str, k: int = 3) -> List[Tuple[str, int]]:
+        """
+        param state:
+            The string representation of a board.
+        param k:
+            The number of positions to find.
+
+        return:
+            The k closest positions of the repertoire along with their distance, the closest first
+        """
+        if self.states is None:
+            self.build()
+        query = np.zeros(PADDING + 1, dtype=np.int16)
+        query_features = encode_features([state])[0]
+        query[query_features] = 1
+        query[PADDING] = 0
+        query_count = int((query_features != PADDING).sum())
+
+        candidates: List[Tuple[int, int]] = []
+        for start in range(0, len(self.states), self.block_size):
+            block = self.features[start:start + self.block_size]
+            shared = query[block].sum(axis=1)
+            distances = self.counts[start:start + self.block_size] + query_count - 2 * shared
+            closest = np.argpartition(distances, k - 1)[:k] if len(distances) > k else np.arange(len(distances))
+            candidates.extend((int(distances[i]), start + int(i)) for i in closest)
+        candidates.sort()
+        return [(self.states[i], distance) for distance, i in candidates[:k]]
+
+    def describe(self, state: str, k: int = 3) -> str:
+        """
+        return:
+            The lines leading to the closest positions of the repertoire, for the detail panel
+        """
+        lines = ["Closest repertoire positions:"]
+        for similar, distance in self.nearest(state, k=k):
+            name = self.names.line(similar) or "the starting position"
+            lines.append("{} ({} difference{})".format(name, distance, "" if distance == 1 else "s"))
+        return "\n".join(lines)
@@ -0,0 +1,253 @@
+import sqlite3
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..model.pos import Pos
+from ..preprocess import StateNode, state_map_from_pgn
+
+schema = """
+CREATE TABLE IF NOT EXISTS repertoires (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS positions (
+    id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS edges (
+    id INTEGER PRIMARY KEY,
+    repertoire_id INTEGER NOT NULL REFERENCES repertoires(id) ON DELETE CASCADE,
+    position_id INTEGER NOT NULL REFERENCES positions(id),
+    move TEXT NOT NULL,
+    result_id INTEGER NOT NULL REFERENCES positions(id),
+    depth INTEGER,
+    origin INTEGER,
+    dest INTEGER,
+    promotion TEXT,
+    comment TEXT,
+    UNIQUE (repertoire_id, position_id, move)
+);
+CREATE INDEX IF NOT EXISTS edges_by_result ON edges (repertoire_id, result_id);
+"""
+
+
+def square(pos: Pos) -> int:
+    return None if pos is None else 8 * pos.rank + pos.file
+
+
+def pos_from_square(square: int) -> Pos:
+    return None if square is None else Pos(square // 8, square % 8)
+
+
+class StoredCommentRef(NamedTuple):
+    """
+    Reference to a comment stored in the edges table of a repertoire store.
+    """
+    filepath: str
+    edge_id: int
+
+    def load(self) -> str:
+        connection = sqlite3.connect(self.filepath)
+        try:
+            row = connection.execute("SELECT comment FROM edges WHERE id = ?", (self.edge_id,)).fetchone()
+        finally:
+            connection.close()
+        return row[0] if row is not None and row[0] is not None else ""
+
+
+class RepertoireStore():
+    def __init__(self, filepath: str):
+        """
+        Persists any number of named repertoires to a SQLite database. Positions are shared between
+        repertoires and indexed by their string representation.
+
+        param filepath:
+            The path of the database, it is created if it does not exist.
+        """
+        self.filepath = filepath
+        self.connection = sqlite3.connect(filepath)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(schema)
+
+    def close(self):
+        self.connection.close()
+
+    def names(self) -> List[str]:
+        return [row[0] for row in self.connection.execute("SELECT name FROM repertoires ORDER BY name")]
+
+    def import_pgn(self, name: str, filepath: str):
+        """
+        Add the lines of a pgn to a repertoire, creating the repertoire if needed.
+        """
+        self.upsert(name, state_map_from_pgn(filepath))
+
+    def upsert(self, name: str, state_map: Dict[str, Set[StateNode]]):
+        """
+        Add the continuations of a state map to a repertoire. Moves which are already stored keep
+        their comment unless the state map has one, afterwards the depths of the repertoire are
+        brought up to date.
+
+        param name:
+            The name of the repertoire, it is created if it does not exist.
+        param state_map:
+            The continuations to add.
+        """
+        with self.connection:
+            repertoire_id = self.__repertoire_id(name, create=True)
+            position_ids: Dict[str, int] = {}
+
+            rows = []
+            for state, continuations in state_map.items():
+                for node in continuations:
+                    rows.append((
+                        repertoire_id,
+                        self.__position_id(state, position_ids),
+                        node.move,
+                        self.__position_id(node.state, position_ids),
+                        square(node.origin),
+                        square(node.dest),
+                        node.promotion,
+                        node.comment or None))
+
+            self.connection.executemany(
+                "INSERT INTO edges (repertoire_id, position_id, move, result_id, origin, dest, promotion, comment) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (repertoire_id, position_id, move) DO UPDATE SET "
+                "comment = COALESCE(excluded.comment, edges.comment)",
+                rows)
+
+            self.__update_depths(repertoire_id)
+
+    def continuations(self, name: str, state: str) -> Set[StateNode]:
+        """
+        param name:
+            The name of the repertoire.
+        param state:
+            The string representation of the board.
+
+        return:
+            The continuations of the position in the repertoire
+        """
+        repertoire_id = self.__repertoire_id(name)
+        rows = self.connection.execute(
+            "SELECT edges.id, edges.move, results.state, edges.depth, edges.origin, edges.dest, "
+            "edges.promotion, edges.comment IS NOT NULL "
+            "FROM positions JOIN edges ON edges.position_id = positions.id "
+            "JOIN positions AS results ON edges.result_id = results.id "
+            "WHERE positions.state = ? AND edges.repertoire_id = ?",
+            (state, repertoire_id))
+
+        continuations = set()
+        for edge_id, move, result, depth, origin, dest, promotion, has_comment in rows:
+            continuations.add(StateNode(
+                move,
+                result,
+                comment_ref=StoredCommentRef(self.filepath, edge_id) if has_comment else None,
+                depth=depth,
+                origin=pos_from_square(origin),
+                dest=pos_from_square(dest),
+                promotion=promotion))
+        return continuations
+
+    def open(self, name: str, cache_size: int = 4096):
+        """
+        Open a repertoire to be used in place of a state map.
+        """
+        return StoredRepertoire(self, name, cache_size=cache_size)
+
+    def __repertoire_id(self, name: str, create: bool = False) -> int:
+        if create:
+            self.connection.execute("INSERT OR IGNORE INTO repertoires (name) VALUES (?)", (name,))
+        row = self.connection.execute("SELECT id FROM repertoires WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError("No repertoire named {}".format(name))
+        return row[0]
+
+    def __position_id(self, state: str, position_ids: Dict[str, int]) -> int:
+        if state not in position_ids:
+            self.connection.execute("INSERT OR IGNORE INTO positions (state) VALUES (?)", (state,))
+            position_ids[state] = self.connection.execute(
+                "SELECT id FROM positions WHERE state = ?", (state,)).fetchone()[0]
+        return position_ids[state]
+
+    def __update_depths(self, repertoire_id: int):
+        # Only the integer ids of the graph are loaded to compute the depths
+        edges: Dict[int, List[Tuple[int, int, int]]] = defaultdict(list)
+        for edge_id, position_id, result_id, depth in self.connection.execute(
+                "SELECT id, position_id, result_id, depth FROM edges WHERE repertoire_id = ?",
+                (repertoire_id,)):
+            edges[position_id].append((edge_id, result_id, depth))
+
+        depths = position_depths(edges)
+        updates = []
+        for outgoing in edges.values():
+            for edge_id, result_id, depth in outgoing:
+                new_depth = depths.get(result_id, 0) + 1
+                if new_depth != depth:
+                    updates.append((new_depth, edge_id))
+        self.connection.executemany("UPDATE edges SET depth = ? WHERE id = ?", updates)
+
+
+def position_depths(edges: Dict[int, List[Tuple]]) -> Dict[int, int]:
+    """
+    Compute the greatest number of moves that can be played from every position. Moves which loop
+    back to a position that is still being computed end the line.
+
+    param edges:
+        Map from a position to its outgoing edges, the second element of each edge is the position
+        it leads to.
+
+    return:
+        Map from position to depth
+    """
+    depths: Dict[int, int] = {}
+    in_progress: Set[int] = set()
+    for root in list(edges.keys()):
+        stack = [root]
+        while stack:
+            position = stack[-1]
+            if position in depths:
+                stack.pop()
+                continue
+
+            in_progress.add(position)
+            pending = False
+            for edge in edges.get(position, ()):
+                result = edge[1]
+                if result not in depths and result not in in_progress:
+                    stack.append(result)
+                    pending = True
+            if pending:
+                continue
+
+            depths[position] = max((depths.get(edge[1], 0) + 1 for edge in edges.get(position, ())), default=0)
+            in_progress.discard(position)
+            stack.pop()
+    return depths
+
+
+class StoredRepertoire():
+    def __init__(self, store: RepertoireStore, name: str, cache_size: int = 4096):
+        """
+        A repertoire of a store used in place of a state map. Positions are queried when they are
+        needed so startup is instant and only recently visited positions are held in memory.
+        """
+        if name not in store.names():
+            raise KeyError("No repertoire named {}".format(name))
+        self.store = store
+        self.name = name
+        self.__continuations = lru_cache(maxsize=cache_size)(self.__continuations_uncached)
+
+    def __getitem__(self, state: str) -> Set[StateNode]:
+        return self.__continuations(state)
+
+    def __contains__(self, state: str) -> bool:
+        return len(self.__continuations(state)) > 0
+
+    def get(self, state: str, default=None) -> Set[StateNode]:
+        continuations = self.__continuations(state)
+        return continuations if continuations else default
+
+    def __continuations_uncached(self, state: str) -> Set[StateNode]:
+        return self.store.continuations(self.name, state)
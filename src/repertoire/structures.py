@@ -0,0 +1,119 @@
+from collections import deque
+from typing import Callable, Dict, List, NamedTuple, Set
+
+from ..model.pos import Pos
+from ..preprocess import StateNode
+
+# Everything but the pawns is cleared from a position to get its pawn structure
+pawns_only = str.maketrans({c: "_" for c in "KQRBNkqrbn"})
+pawns_only.update({ord("G"): "P", ord("g"): "p"})
+
+
+def pawn_structure(state: str) -> str:
+    """
+    param state:
+        The string representation of a board.
+
+    return:
+        The 64 squares of the board with only the pawns left on them
+    """
+    return state[:64].translate(pawns_only)
+
+
+def square(name: str) -> int:
+    pos = Pos.index(name)
+    return pos.rank * 8 + pos.file
+
+
+def has(structure: str, *pawns: str) -> bool:
+    """
+    param structure:
+        A pawn structure, see pawn_structure.
+    param pawns:
+        Pawns like "Pd4" for a white pawn on d4 or "pd5" for a black pawn on d5.
+
+    return:
+        Whether every pawn is in the structure
+    """
+    return all(structure[square(pawn[1:])] == pawn[0] for pawn in pawns)
+
+
+def has_on_file(structure: str, pawn: str, file: str) -> bool:
+    """
+    return:
+        Whether there is a white ("P") or black ("p") pawn on the file, i.e. "c"
+    """
+    return pawn in structure[Pos.index_from_file(file)::8]
+
+
+class Structure(NamedTuple):
+    description: str
+    matches: Callable[[str], bool]
+
+
+STRUCTURES: Dict[str, Structure] = {
+    "french-advance": Structure(
+        "French advance chain, white pawns on d4 and e5 against black pawns on d5 and e6",
+        lambda s: has(s, "Pd4", "Pe5", "pd5", "pe6")),
+    "iqp": Structure(
+        "Isolated queen pawn, a pawn on d4 or d5 without pawns of its color on the c and e files",
+        lambda s: (has(s, "Pd4") and not has_on_file(s, "P", "c") and not has_on_file(s, "P", "e")) or
+                  (has(s, "pd5") and not has_on_file(s, "p", "c") and not has_on_file(s, "p", "e"))),
+    "carlsbad": Structure(
+        "Carlsbad, a white pawn on d4 without a c pawn against black pawns on c6 and d5 without an e pawn",
+        lambda s: has(s, "Pd4", "pc6", "pd5") and not has_on_file(s, "P", "c") and not has_on_file(s, "p", "e")),
+    "maroczy-bind": Structure(
+        "Maroczy bind, white pawns on c4 and e4 without a d pawn against no black c pawn",
+        lambda s: has(s, "Pc4", "Pe4") and not has_on_file(s, "P", "d") and not has_on_file(s, "p", "c")),
+}
+
+
+class PawnStructureIndex():
+    def __init__(self, state_map: Dict[str, Set[StateNode]]):
+        """
+        Groups the positions of a repertoire by their pawn structure. The index is built once, named
+        structures are matched against every distinct pawn structure rather than every position.
+
+        param state_map:
+            The repertoire.
+        """
+        self.state_map = state_map
+        self.groups: Dict[str, Set[str]] = {}
+        # The positions every position is reached from, to find the lines leading into a structure
+        self.parents: Dict[str, List[str]] = {}
+        for state, continuations in state_map.items():
+            if continuations:
+                self.groups.setdefault(pawn_structure(state), set()).add(state)
+            for node in continuations:
+                self.groups.setdefault(pawn_structure(node.state), set()).add(node.state)
+                self.parents.setdefault(node.state, []).append(state)
+
+        self.named: Dict[str, Set[str]] = {}
+        for name, structure in STRUCTURES.items():
+            self.named[name] = set()
+            for key, states in self.groups.items():
+                if structure.matches(key):
+                    self.named[name].update(states)
+
+    def route(self, positions: Set[str]) -> Dict[str, List[StateNode]]:
+        """
+        Find the lines of the repertoire leading into a set of positions.
+
+        param positions:
+            The positions the lines should pass through, i.e. those of a named structure.
+
+        return:
+            Map from every position outside of the set that leads into it to the continuations
+            leading there
+        """
+        leading: Set[str] = set()
+        queue = deque(positions)
+        while queue:
+            state = queue.popleft()
+            for parent in self.parents.get(state, ()):
+                if parent not in leading and parent not in positions:
+                    leading.add(parent)
+                    queue.append(parent)
+        return {state: sorted((node for node in self.state_map[state] if node.state in leading or node.state in positions),
+                              key=lambda node: node.move)
+                for state in leading}
@@ -0,0 +1,271 @@
+import random
+from copy import copy
+from typing import List, Set, Tuple
+
+from ..model.board import Board
+from ..model.pos import Pos
+from .writer import TokenWriter
+
+# The words comments are made of, moves of the line are mixed in so comments can be searched by move
+COMMENT_WORDS = (
+    "the", "plan", "is", "to", "play", "with", "a", "break", "pressure", "on", "center", "kingside",
+    "queenside", "attack", "pawn", "bishop", "knight", "rook", "queen", "initiative", "weakness",
+    "outpost", "exchange", "endgame", "tempo", "development", "castle", "file", "diagonal", "idea")
+# The number of times a line is drawn again when it could not branch off the repertoire
+MAX_ATTEMPTS = 100
+
+
+class GeneratedMove():
+    # Generated repertoires can hold millions of moves, avoid a __dict__ per move.
+    __slots__ = ("move", "comment", "children", "closed")
+
+    def __init__(self, move: str = None, comment: str = None):
+        self.move = move
+        self.comment = comment
+        # The first child is the main line, the others are variations
+        self.children: List[GeneratedMove] = []
+        # Whether no line branches off after this move, i.e. it ends a transposition
+        self.closed = False
+
+
+def random_move(board: Board, rng: random.Random, exclude: Set[str] = frozenset()) -> str:
+    """
+    Draw a legal move of the player to move. Pieces and destinations are tried in a random order
+    until a legal move is found, rather than listing every legal move first.
+
+    param board:
+        The position.
+    param rng:
+        The random number generator to draw from.
+    param exclude:
+        Moves that should not be drawn, i.e. those already in the repertoire.
+
+    return:
+        The move string, i.e. "Nf3", or None if there is no legal move left
+    """
+    pieces = [piece for rank in board.pieces for piece in rank
+              if piece is not None and piece.player is board.current_player]
+    rng.shuffle(pieces)
+    squares = list(range(64))
+    for piece in pieces:
+        rng.shuffle(squares)
+        for square in squares:
+            dest = Pos(square // 8, square % 8)
+            if not board.is_legal_move(dest, piece).is_legal():
+                continue
+            promotion = rng.choice("QQQN") if board.move_requires_promotion(piece.pos, dest) else None
+            move = board.move_to_pgn_notation(piece.pos, dest, promotion)
+            if move not in exclude and not leaves_king_attacked(board, move):
+                return move
+    return None
+
+
+def leaves_king_attacked(board: Board, move: str) -> bool:
+    """
+    Whether a move leaves the king of the player making it attacked. This is checked from the
+    attacks on the king after the move rather than by is_legal_move, so a pin is_legal_move misses
+    can't put an illegal move in a generated repertoire.
+    """
+    updated = copy(board.update(move))
+    # The attacks on a king are those of the pieces of the player not to move
+    updated.current_player = board.current_player
+    return bool(updated.is_under_attack(updated.get_king_pos(board.current_player)))
+
+
+def random_comment(rng: random.Random, move: str) -> str:
+    words = [rng.choice(COMMENT_WORDS) for _ in range(rng.randint(4, 12))]
+    words[0] = words[0].capitalize()
+    # Moves are case sensitive, one never starts the comment
+    words.insert(rng.randrange(1, len(words) + 1), move)
+    return " ".join(words)
+
+
+def transposed_moves(board: Board, moves: List[str]) -> List[str]:
+    """
+    Play three moves of a line in the opposite order, i.e. "Nf3 d5 d4" as "d4 d5 Nf3".
+
+    param board:
+        The position before the moves.
+    param moves:
+        The three moves, the first and last played by the same player.
+
+    return:
+        The moves in the opposite order with their check markers updated, or None if that is
+        illegal or leads to another position
+    """
+    # The geometry of every move is taken from the position it was played in
+    geometry: List[Tuple[Pos, Pos, str]] = []
+    target = board
+    for move in moves:
+        geometry.append((target.get_move_origin(move), target.get_move_destination(move), target.get_move_promotion(move)))
+        target = target.update(move)
+
+    transposed = []
+    for origin, dest, promotion in reversed(geometry):
+        piece = board.get(origin)
+        if piece is None or not board.is_legal_move(dest, piece).is_legal():
+            return None
+        move = board.move_to_pgn_notation(origin, dest, promotion)
+        if leaves_king_attacked(board, move):
+            return None
+        transposed.append(move)
+        board = board.update(move)
+    # A double pawn push played last leaves a pawn that can be captured en passant, the
+    # positions differ then
+    return transposed if str(board) == str(target) else None
+
+
+def add_line(root: GeneratedMove, rng: random.Random, depth: int, branching: int, comment_density: float,
+             transposition_rate: float) -> bool:
+    """
+    Add a line to a generated repertoire. A random line of the repertoire is followed until it
+    branches off at a position with fewer than branching continuations, every position along the
+    line being about as likely to branch off at. The new line is then filled with random moves.
+
+    return:
+        Whether a line was added
+    """
+    board = Board()
+    node = root
+    ply = 0
+    while ply < depth:
+        open_children = [child for child in node.children if not child.closed]
+        can_branch = len(node.children) < branching and not node.closed
+        if can_branch and (not open_children or rng.random() < 1 / (depth - ply)):
+            break
+        if not open_children:
+            return False
+        node = rng.choice(open_children)
+        board = board.update(node.move)
+        ply += 1
+    else:
+        return False
+
+    if node.children and depth - ply >= 3 and rng.random() < transposition_rate:
+        # Follow the repertoire three moves further and play them in the opposite order
+        line = [rng.choice(node.children)]
+        while len(line) < 3 and line[-1].children:
+            line.append(rng.choice(line[-1].children))
+        moves = transposed_moves(board, [child.move for child in line]) if len(line) == 3 else None
+        if moves is not None and moves[0] not in {child.move for child in node.children}:
+            for move in moves:
+                child = GeneratedMove(move, random_comment(rng, move) if rng.random() < comment_density else None)
+                node.children.append(child)
+                node = child
+            node.closed = True
+            return True
+
+    exclude = {child.move for child in node.children}
+    while ply < depth:
+        move = random_move(board, rng, exclude=exclude)
+        if move is None:
+            # Checkmate or stalemate, nothing can follow
+            node.closed = True
+            break
+        child = GeneratedMove(move, random_comment(rng, move) if rng.random() < comment_density else None)
+        node.children.append(child)
+        node = child
+        board = board.update(move)
+        exclude = set()
+        ply += 1
+    return True
+
+
+def write_chapter(root: GeneratedMove, writer: TokenWriter, event: str):
+    """
+    Write a generated chapter, the first continuation of every move being its main line.
+    """
+    for name, value in [("Event", event), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"),
+                        ("White", "?"), ("Black", "?"), ("Result", "*")]:
+        writer.f.write('[{} "{}"]\n'.format(name, value))
+    writer.f.write("\n")
+
+    # Every move needs its number after a variation or a comment, not just white's
+    number_next_move = True
+    # The stack holds the moves left to write in reverse, along with "(" and ")" around variations
+    stack: List = [("expand", root, 0)]
+    while stack:
+        item = stack.pop()
+        if item == "(" or item == ")":
+            writer.write(item)
+            number_next_move = True
+            continue
+
+        action, node, ply = item
+        if action == "move":
+            move_number = ply // 2 + 1
+            if ply % 2 == 0:
+                writer.write("{}. {}".format(move_number, node.move))
+            elif number_next_move:
+                writer.write("{}... {}".format(move_number, node.move))
+            else:
+                writer.write(node.move)
+            number_next_move = False
+            if node.comment:
+                writer.write_comment(node.comment)
+                number_next_move = True
+        elif node.children:
+            main = node.children[0]
+            # Pushed in reverse: the main move, its variations, then the rest of the main line
+            stack.append(("expand", main, ply + 1))
+            for child in reversed(node.children[1:]):
+                stack.append(")")
+                stack.append(("expand", child, ply + 1))
+                stack.append(("move", child, ply))
+                stack.append("(")
+            stack.append(("move", main, ply))
+
+    writer.write("*")
+    writer.end_line()
+
+
+def generate_repertoire(filepath: str,
+                        lines: int = 100,
+                        depth: int = 20,
+                        branching: int = 3,
+                        comment_density: float = 0.1,
+                        transposition_rate: float = 0.05,
+                        chapters: int = 1,
+                        seed: int = 0) -> int:
+    """
+    Write a random repertoire of legal moves from the starting position, meant as input for
+    benchmarks. The same arguments always write the same pgn.
+
+    param filepath:
+        The path of the pgn to write.
+    param lines:
+        The number of lines, split evenly between the chapters. Fewer are written if the
+        repertoire runs out of positions to branch off at.
+    param depth:
+        The number of moves of every line, lines ending in checkmate or stalemate are shorter.
+    param branching:
+        The greatest number of continuations of a position.
+    param comment_density:
+        The share of moves with a comment.
+    param transposition_rate:
+        The share of lines that play three moves of another line in the opposite order and end
+        in its position.
+    param chapters:
+        The number of chapters, every one of them starting from the starting position.
+    param seed:
+        The seed of the random number generator.
+
+    return:
+        The number of lines written
+    """
+    rng = random.Random(seed)
+    written = 0
+    with open(filepath, "w", encoding="utf-8", newline="\n") as f:
+        writer = TokenWriter(f)
+        for chapter in range(chapters):
+            root = GeneratedMove()
+            chapter_lines = lines // chapters + (1 if chapter < lines % chapters else 0)
+            for _ in range(chapter_lines):
+                for _ in range(MAX_ATTEMPTS):
+                    if add_line(root, rng, depth, branching, comment_density, transposition_rate):
+                        written += 1
+                        break
+            if chapter:
+                f.write("\n")
+            write_chapter(root, writer, "Synthetic {} chapter {}".format(seed, chapter + 1))
+    return written
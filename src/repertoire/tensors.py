@@ -0,0 +1,85 @@
+from typing import Dict, List, Set
+
+try:
+    import numpy as np
+except ImportError:
+    # Only the tensor export and the similarity search need numpy
+    np = None
+
+from ..preprocess import StateNode, all_states
+
+# The pieces of the first 12 planes, white then black
+PIECE_PLANES = "PNBRQKpnbrqk"
+# Planes 12 to 16 are filled with ones when white is to move and for every castling right left
+SIDE_TO_MOVE_PLANE = 12
+CASTLING_PLANES = {"K": 13, "Q": 14, "k": 15, "q": 16}
+NUM_PLANES = 17
+STATE_LENGTH = 73
+BATCH_SIZE = 65536
+
+# The characters of the moved flags of the rooks and kings following the 64 squares
+A1, E1, H1, A8, E8, H8 = range(64, 70)
+CASTLING_FLAGS = {"K": (E1, H1), "Q": (E1, A1), "k": (E8, H8), "q": (E8, A8)}
+
+
+def require_numpy():
+    if np is None:
+        raise ImportError("numpy is required, install it with \"pip install numpy\"")
+
+
+def encode_states(states: List[str]) -> "np.ndarray":
+    """
+    Encode positions as planes in one vectorized pass over their string representations, without
+    building a board for any of them.
+
+    param states:
+        The string representations of the boards.
+
+    return:
+        An array of shape (len(states), NUM_PLANES, 8, 8) of 0s and 1s indexed by plane, rank and
+        file, rank 0 being white's first rank
+    """
+    require_numpy()
+    n = len(states)
+    chars = np.frombuffer("".join(states).encode("latin-1"), dtype=np.uint8).reshape(n, STATE_LENGTH)
+    squares = chars[:, :64].reshape(n, 8, 8)
+
+    tensors = np.zeros((n, NUM_PLANES, 8, 8), dtype=np.uint8)
+    for plane, piece in enumerate(PIECE_PLANES):
+        tensors[:, plane] = squares == ord(piece)
+    # Pawns that can be captured en passant are written differently
+    tensors[:, PIECE_PLANES.index("P")] |= squares == ord("G")
+    tensors[:, PIECE_PLANES.index("p")] |= squares == ord("g")
+
+    unmoved = chars[:, A1:H8 + 1] == ord("0")
+    tensors[:, SIDE_TO_MOVE_PLANE] = (chars[:, STATE_LENGTH - 1] == ord("0"))[:, None, None]
+    for right, (king, rook) in CASTLING_FLAGS.items():
+        tensors[:, CASTLING_PLANES[right]] = (unmoved[:, king - A1] & unmoved[:, rook - A1])[:, None, None]
+    return tensors
+
+
+def export_tensors(state_map: Dict[str, Set[StateNode]], filepath: str, batch_size: int = BATCH_SIZE) -> int:
+    """
+    Write every position of a repertoire to a .npy file of shape (N, NUM_PLANES, 8, 8), see
+    encode_states. The file is written through a memory map one batch at a time, so neither the
+    repertoire's tensors nor the file have to fit in memory. Positions are written in the order of
+    their sorted string representations.
+
+    param state_map:
+        The repertoire.
+    param filepath:
+        The path of the .npy file, it can be opened with np.load(filepath, mmap_mode="r").
+    param batch_size:
+        The number of positions encoded at once.
+
+    return:
+        The number of positions written
+    """
+    require_numpy()
+    states = sorted(all_states(state_map))
+    tensors = np.lib.format.open_memmap(filepath, mode="w+", dtype=np.uint8, shape=(len(states), NUM_PLANES, 8, 8))
+    for start in range(0, len(states), batch_size):
+        batch = states[start:start + batch_size]
+        tensors[start:start + len(batch)] = encode_states(batch)
+    tensors.flush()
+    return len(states)
@@ -0,0 +1,251 @@
+import os
+import re
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from typing import Iterator, List, NamedTuple, Tuple
+
+from ..model.board import Board
+from ..model.pieces.bishop import Bishop
+from ..model.pieces.king import King
+from ..model.pieces.knight import Knight
+from ..model.pieces.pawn import Pawn
+from ..model.pieces.piece import Piece
+from ..model.pieces.queen import Queen
+from ..model.pieces.rook import Rook
+from ..model.player import Player
+from ..model.pos import Pos
+from ..preprocess import chapter_start, pattern_move_comment_variation, prune_movetext, read_pgn, split_chapters
+
+pattern_san = re.compile(r"^(?:(O-O-O|O-O)|([NBRQK])?([a-h])?([1-8])?(x)?([a-h][1-8])(?:=([NBRQ]))?)([+#])?$")
+piece_types = {None: Pawn, "N": Knight, "B": Bishop, "R": Rook, "Q": Queen, "K": King}
+
+
+class IssueType(Enum):
+    # No piece can legally play the move
+    ILLEGAL = 0
+    # More than one piece can play the move
+    AMBIGUOUS = 1
+    # The move is missing its check marker or has one without giving check
+    CHECK_MARKER = 2
+    # The move number does not match the side to move
+    MOVE_NUMBER = 3
+    # The variation branches off a move that could not be replayed
+    UNREACHABLE = 4
+
+
+issue_descriptions = {
+    IssueType.ILLEGAL: "illegal move",
+    IssueType.AMBIGUOUS: "ambiguous move",
+    IssueType.CHECK_MARKER: "wrong check marker",
+    IssueType.MOVE_NUMBER: "wrong move number",
+    IssueType.UNREACHABLE: "unreachable variation",
+}
+
+
+class Issue(NamedTuple):
+    filepath: str
+    line: int
+    column: int
+    issue_type: IssueType
+    move: str
+    message: str
+
+    def __str__(self) -> str:
+        return "{}:{}:{}: {} {}: {}".format(
+            self.filepath, self.line, self.column, issue_descriptions[self.issue_type], self.move, self.message)
+
+
+class MoveCheck(NamedTuple):
+    # The move to replay, with its check marker corrected, or None if it can't be replayed
+    move: str
+    issue_type: IssueType = None
+    message: str = None
+
+
+def check_move(board: Board, move: str) -> MoveCheck:
+    """
+    Check that a move can be played on a board exactly as it is written.
+
+    param board:
+        The board the move is played on.
+    param move:
+        The move string, i.e. "Nbd7".
+
+    return:
+        The move to replay along with the issue found, if any
+    """
+    match = pattern_san.match(move)
+    if match is None:
+        return MoveCheck(None, IssueType.ILLEGAL, "not a move")
+    castle, piece_name, file_hint, rank_hint, capture, dest_str, promotion, check_marker = match.groups()
+    player = board.current_player
+
+    if castle is not None:
+        dest = Pos.index("c1" if castle == "O-O-O" else "g1", player=player)
+        piece = board.get("e1", player=player)
+        candidates = [piece] if isinstance(piece, King) and piece.player is player else []
+    else:
+        dest = Pos.index(dest_str)
+        candidates = [
+            piece for rank in board.pieces for piece in rank
+            if type(piece) is piece_types[piece_name] and piece.player is player and
+               (file_hint is None or piece.pos.file == Pos.index_from_file(file_hint)) and
+               (rank_hint is None or piece.pos.rank == int(rank_hint) - 1)]
+
+    pieces: List[Piece] = [piece for piece in candidates if board.is_legal_move(dest, piece).is_legal()]
+    if not pieces:
+        return MoveCheck(None, IssueType.ILLEGAL, "{} to move has no piece that can play it".format(player.name.lower()))
+    if len(pieces) > 1:
+        origins = ", ".join(Pos.file_from_index(piece.pos.file) + str(piece.pos.rank + 1) for piece in pieces)
+        return MoveCheck(None, IssueType.AMBIGUOUS, "it can be played from {}".format(origins))
+
+    origin = pieces[0].pos
+    if board.move_requires_promotion(origin, dest) != (promotion is not None):
+        message = "the promotion piece is missing" if promotion is None else "the pawn can't promote there"
+        return MoveCheck(None, IssueType.ILLEGAL, message)
+
+    expected = board.move_to_pgn_notation(origin, dest, promotion_piece=promotion)
+    gives_check = expected.endswith("+")
+    if ("x" in expected) != (capture is not None):
+        message = "it is a capture" if capture is None else "it is not a capture"
+        return MoveCheck(None, IssueType.ILLEGAL, "{}, expected {}".format(message, expected))
+
+    # Replaying a wrong check marker as written would leave the wrong king in check
+    replayed = move[:len(move) - (1 if check_marker else 0)] + ("+" if gives_check else "")
+    if gives_check and check_marker is None:
+        return MoveCheck(replayed, IssueType.CHECK_MARKER, "it gives check, expected {}".format(expected))
+    if not gives_check and check_marker is not None:
+        return MoveCheck(replayed, IssueType.CHECK_MARKER, "it does not give check, expected {}".format(expected))
+    return MoveCheck(replayed)
+
+
+class Line():
+    def __init__(self, current: Board, previous: Board = None):
+        """
+        A line being replayed. A board is None once the line can no longer be replayed.
+
+        param current:
+            The board after the last move of the line.
+        param previous:
+            The board before the last move of the line, which variations branch off from.
+        """
+        self.current = current
+        self.previous = previous
+        # Whether the line was broken before it started, it is only reported once
+        self.unreachable = current is None
+
+
+def validate_chapter(filepath: str, start: int, end: int, first_line: int = 1) -> List[Issue]:
+    """
+    Replay every line of a chapter of a pgn, collecting everything that would make it unusable.
+
+    param filepath:
+        The absolute path of the pgn.
+    param start:
+        The offset of the chapter in the file.
+    param end:
+        The offset of the end of the chapter in the file.
+    param first_line:
+        The line number the chapter starts on, to report the location of the issues.
+
+    return:
+        The issues found, in the order they appear in the chapter
+    """
+    with open(filepath, encoding="latin-1", newline="") as f:
+        f.seek(start)
+        pgn = f.read(end - start)
+
+    issues: List[Issue] = []
+    line_starts = [0] + [match.end() for match in re.finditer("\n", pgn)]
+
+    def report(offset: int, issue_type: IssueType, move: str, message: str):
+        line = bisect_right(line_starts, offset) - 1
+        issues.append(Issue(filepath, first_line + line, offset - line_starts[line] + 1, issue_type, move, message))
+
+    try:
+        board = chapter_start(pgn)
+    except ValueError as e:
+        report(0, IssueType.ILLEGAL, "[FEN]", str(e))
+        return issues
+
+    lines = [Line(board)]
+    for match in re.finditer(pattern_move_comment_variation, prune_movetext(pgn)):
+        overall = match.group(0)
+        if overall == "(":
+            # A variation replaces the last move of the line it branches from
+            lines.append(Line(lines[-1].previous))
+            continue
+        elif overall == ")":
+            if len(lines) > 1:
+                lines.pop()
+            continue
+
+        move_number = match.group(2)
+        if move_number == "1." and board.current_player is Player.WHITE:
+            # Started the chapter over, or a variation replacing the first move
+            lines[-1] = Line(board)
+
+        moves = [(match.group(3), match.start(3), Player.BLACK if "..." in move_number else Player.WHITE)]
+        if match.group(5) is not None:
+            moves.append((match.group(5), match.start(5), Player.BLACK))
+
+        line = lines[-1]
+        for move, offset, player in moves:
+            if line.current is None:
+                if line.unreachable:
+                    report(offset, IssueType.UNREACHABLE, move, "it branches off a move that could not be replayed")
+                    line.unreachable = False
+                # Variations can't branch off a move that was skipped
+                line.previous = None
+                continue
+
+            if line.current.current_player is not player:
+                report(offset, IssueType.MOVE_NUMBER, move, "{} is numbered as a {} move".format(
+                    move_number, player.name.lower()))
+
+            try:
+                checked = check_move(line.current, move)
+                updated_board = line.current.update(checked.move) if checked.move is not None else None
+            except Exception as e:
+                checked = MoveCheck(None, IssueType.ILLEGAL, "replaying it failed with {}".format(repr(e)))
+                updated_board = None
+
+            if checked.issue_type is not None:
+                report(offset, checked.issue_type, move, checked.message)
+            line.previous = line.current
+            line.current = updated_board
+
+    return issues
+
+
+def validate_pgns(filepaths: List[str], workers: int = None) -> Iterator[Issue]:
+    """
+    Replay every line of a number of pgns, in parallel across a process pool.
+
+    param filepaths:
+        The paths of the pgns.
+    param workers:
+        The number of processes used to replay chapters, defaults to the number of processors.
+
+    return:
+        The issues found, in the order they appear in the pgns
+    """
+    chapters: List[Tuple[str, int, int, int]] = []
+    for filepath in filepaths:
+        filepath = os.path.abspath(filepath)
+        pgn = read_pgn(filepath)
+        line = 1
+        previous_start = 0
+        for start, end in split_chapters(pgn):
+            line += pgn.count("\n", previous_start, start)
+            previous_start = start
+            chapters.append((filepath, start, end, line))
+
+    if len(chapters) <= 1 or workers == 1:
+        for chapter in chapters:
+            yield from validate_chapter(*chapter)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for issues in executor.map(validate_chapter, *zip(*chapters), chunksize=16):
+                yield from issues
@@ -0,0 +1,181 @@
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, NamedTuple, Set, Tuple
+
+from ..preprocess import StateNode
+from .comments import load_comment
+from .eco import Opening, classify_state_map
+from .incremental import IncrementalRepertoire
+from .sampling import ContinuationSampler
+from .similarity import SimilarityIndex
+
+
+class FileWatcher():
+    def __init__(self, filepaths: List[str]):
+        """
+        Detects changes to files by polling their modification time and size, which works the same
+        on every platform without any dependency.
+
+        param filepaths:
+            The files to watch.
+        """
+        self.filepaths = filepaths
+        self.signatures = self.__signatures()
+
+    def changed(self) -> bool:
+        """
+        return:
+            Whether any of the files changed since the last call
+        """
+        signatures = self.__signatures()
+        changed = signatures != self.signatures
+        self.signatures = signatures
+        return changed
+
+    def __signatures(self) -> List[Tuple[int, int]]:
+        signatures = []
+        for filepath in self.filepaths:
+            try:
+                stat = os.stat(filepath)
+                signatures.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                # The file may briefly disappear while an editor replaces it
+                signatures.append(None)
+        return signatures
+
+
+class ReloadedRepertoire(NamedTuple):
+    state_map: Dict[str, Set[StateNode]]
+    sampler: ContinuationSampler
+    # The positions whose continuations are all known while the repertoire is still being loaded,
+    # None once every position is
+    ready: Set[str] = None
+    # The opening of every position, see classify_state_map, when an opening table was given
+    openings: Dict[str, Opening] = None
+    # The built index of the closest positions of the state map, when one was asked for
+    similar: SimilarityIndex = None
+
+
+class RepertoireReloader():
+    def __init__(self, 
+                repertoire: IncrementalRepertoire, 
+                interval: float = 1.0, 
+                eco_index: Dict[str, Opening] = None,
+                similar_positions: bool = False):
+        """
+        Rebuilds a repertoire on a background thread whenever its pgn changes. The controllers are
+        never handed the state map being rebuilt, every reload publishes a new state map along with
+        its sampler which the main loop swaps in between frames.
+
+        param repertoire:
+            The repertoire to keep up to date.
+        param interval:
+            The number of seconds between two polls of the pgn.
+        param eco_index:
+            The compiled opening table, see load_eco_index. Every reload is classified by it on the
+            background thread.
+        param similar_positions:
+            Whether every reload is indexed by a SimilarityIndex on the background thread, requires
+            numpy.
+        """
+        self.repertoire = repertoire
+        self.interval = interval
+        self.eco_index = eco_index
+        self.similar_positions = similar_positions
+        self.watcher = FileWatcher([repertoire.filepath])
+        self.lock = threading.Lock()
+        self.pending: ReloadedRepertoire = None
+        self.sampler: ContinuationSampler = None
+        self.thread: threading.Thread = None
+        # Whether the last reload failed part way, the repertoire may no longer match the snapshot
+        self.failed = False
+        # Positions which did not change are shared between consecutive state maps
+        self.__snapshot: Dict[str, Set[StateNode]] = {
+            state: set(continuations) for state, continuations in repertoire.state_map.items() if continuations}
+        self.state_map = defaultdict(set, self.__snapshot)
+
+    def start(self, sampler: ContinuationSampler):
+        """
+        Start watching the pgn.
+
+        param sampler:
+            The sampler in use, reloaded samplers are built with its strategies and frequencies.
+        """
+        self.sampler = sampler
+        self.thread = threading.Thread(target=self.__run, name="repertoire-reloader", daemon=True)
+        self.thread.start()
+
+    def poll(self) -> ReloadedRepertoire:
+        """
+        return:
+            The repertoire reloaded since the last poll, if any
+        """
+        with self.lock:
+            reloaded = self.pending
+            self.pending = None
+        return reloaded
+
+    def __run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self.watcher.changed():
+                continue
+            try:
+                reloaded = self.__reload()
+            except Exception as e:
+                # Most likely the pgn was saved half way, the next save triggers a reload from scratch
+                print("Could not reload {}: {}".format(self.repertoire.filepath, e), file=sys.stderr)
+                self.failed = True
+                continue
+            with self.lock:
+                self.pending = reloaded
+
+    def __reload(self) -> ReloadedRepertoire:
+        if self.failed:
+            return self.__reload_from_scratch()
+        changed = self.repertoire.rebuild()
+        # Comments are cached by their location, which an edit keeping their length does not change
+        load_comment.cache_clear()
+        for state in changed:
+            continuations = self.repertoire.state_map.get(state)
+            if continuations:
+                self.__snapshot[state] = set(continuations)
+            else:
+                self.__snapshot.pop(state, None)
+        state_map = defaultdict(set, self.__snapshot)
+
+        # How often a continuation is drawn depends on the lines below it, the positions leading to
+        # one that gained or lost continuations need new tables as well
+        ancestors = set(self.repertoire.restructured)
+        positions_to_visit = list(ancestors)
+        while positions_to_visit:
+            for parent, _ in self.repertoire.parents.get(positions_to_visit.pop(), ()):
+                if parent not in ancestors:
+                    ancestors.add(parent)
+                    positions_to_visit.append(parent)
+
+        # Build the alias tables here rather than on the first draw in the main loop, only those of
+        # the affected positions are built again
+        self.sampler = self.sampler.with_state_map(state_map, changed=changed | ancestors)
+        return self.__published(state_map)
+
+    def __reload_from_scratch(self) -> ReloadedRepertoire:
+        self.repertoire = IncrementalRepertoire(self.repertoire.filepath, workers=self.repertoire.workers)
+        load_comment.cache_clear()
+        self.__snapshot = {
+            state: set(continuations) for state, continuations in self.repertoire.state_map.items() if continuations}
+        self.failed = False
+        state_map = defaultdict(set, self.__snapshot)
+        self.sampler = self.sampler.with_state_map(state_map)
+        return self.__published(state_map)
+
+    def __published(self, state_map: Dict[str, Set[StateNode]]) -> ReloadedRepertoire:
+        openings = classify_state_map(state_map, self.eco_index) if self.eco_index is not None else None
+        similar = None
+        if self.similar_positions:
+            similar = SimilarityIndex(state_map)
+            similar.build()
+        return ReloadedRepertoire(state_map, self.sampler, openings=openings, similar=similar)
@@ -0,0 +1,182 @@
+from typing import Dict, List, Set, TextIO
+
+from ..model.board import Board
+from ..model.player import Player
+from ..preprocess import StateNode
+
+LINE_WIDTH = 79
+
+
+class TokenWriter():
+    def __init__(self, f: TextIO, line_width: int = LINE_WIDTH):
+        """
+        Writes space separated pgn tokens to a file, wrapping lines as they fill up.
+        """
+        self.f = f
+        self.line_width = line_width
+        self.column = 0
+        # Opening parentheses are held back to hug the token that follows, i.e. "(1... c5"
+        self.prefix = ""
+
+    def write(self, token: str):
+        if token == "(":
+            self.prefix += token
+            return
+        token = self.prefix + token
+        self.prefix = ""
+
+        separator = "" if token == ")" else " "
+        if self.column and self.column + len(separator) + len(token) > self.line_width:
+            self.f.write("\n")
+            self.column = 0
+        elif self.column:
+            self.f.write(separator)
+            self.column += len(separator)
+        self.f.write(token)
+        self.column += len(token)
+
+    def write_comment(self, comment: str):
+        # Comments are wrapped word by word like the moves around them
+        words = comment.split()
+        words[0] = "{" + words[0]
+        words[-1] = words[-1] + "}"
+        for word in words:
+            self.write(word)
+
+    def end_line(self):
+        if self.column:
+            self.f.write("\n")
+            self.column = 0
+
+
+class Edge():
+    # Created for every move on the traversal stack only
+    __slots__ = ("node", "ply", "expand")
+
+    def __init__(self, node: StateNode, ply: int):
+        self.node = node
+        self.ply = ply
+        # Whether this move is the first to reach its position and writes the lines following it
+        self.expand = False
+
+
+def ordered_continuations(continuations: Set[StateNode]) -> List[StateNode]:
+    """
+    The continuations of a position in the order they are written, the longest line first.
+    """
+    return sorted(continuations, key=lambda node: (-(node.depth or 0), node.move))
+
+
+def root_states(state_map: Dict[str, Set[StateNode]]) -> List[str]:
+    """
+    The positions of a state map no move leads to, the starting position first.
+    """
+    reached: Set[str] = set()
+    for continuations in state_map.values():
+        reached.update(node.state for node in continuations)
+    start = str(Board())
+    roots = [state for state, continuations in state_map.items() if continuations and state not in reached]
+    return sorted(roots, key=lambda state: state != start)
+
+
+def write_pgn(state_map: Dict[str, Set[StateNode]], filepath: str, event: str = "Repertoire"):
+    """
+    Write a state map as a pgn, one chapter per starting position. The longest continuation of
+    every position is its main line and the others are variations. Lines are streamed to the file
+    as the repertoire is traversed, when a move transposes into a position that was already written
+    the lines following it are not written again.
+
+    param state_map:
+        The repertoire.
+    param filepath:
+        The path of the pgn to write.
+    param event:
+        The event tag of every chapter.
+    """
+    written: Set[str] = set()
+    with open(filepath, "w", encoding="utf-8", newline="\n") as f:
+        for i, root in enumerate(root_states(state_map)):
+            if i:
+                f.write("\n")
+            write_chapter(state_map, root, TokenWriter(f), event, written)
+
+
+def write_chapter(state_map: Dict[str, Set[StateNode]], root: str, writer: TokenWriter, event: str, written: Set[str]):
+    """
+    Write the tag pairs and the lines of a chapter.
+
+    param state_map:
+        The repertoire.
+    param root:
+        The position the chapter starts from.
+    param writer:
+        Where the chapter is written.
+    param event:
+        The event tag of the chapter.
+    param written:
+        The positions whose lines were already written, updated as the chapter is written.
+    """
+    board = Board(board_str=root)
+    tags = [("Event", event), ("Site", "?"), ("Date", "????.??.??"), ("Round", "?"),
+            ("White", "?"), ("Black", "?"), ("Result", "*")]
+    if root != str(Board()):
+        tags += [("SetUp", "1"), ("FEN", board.to_fen())]
+    for name, value in tags:
+        writer.f.write('[{} "{}"]\n'.format(name, value.replace("\\", "\\\\").replace('"', '\\"')))
+    writer.f.write("\n")
+
+    # The ply of a move counts from white's first move so move numbers follow from it
+    first_ply = 0 if board.current_player is Player.WHITE else 1
+    written.add(root)
+    # Every move needs its number after a variation or a comment, not just white's
+    number_next_move = True
+
+    # The stack holds the moves left to write in reverse, along with "(" and ")" around variations
+    # and the positions whose lines are to be expanded, so only the current path is in memory
+    stack: List = [("expand", root, first_ply)]
+    while stack:
+        item = stack.pop()
+        if item == "(" or item == ")":
+            writer.write(item)
+            number_next_move = True
+        elif isinstance(item, Edge):
+            node = item.node
+            move_number = item.ply // 2 + 1
+            if item.ply % 2 == 0:
+                writer.write("{}. {}".format(move_number, node.move))
+            elif number_next_move:
+                writer.write("{}... {}".format(move_number, node.move))
+            else:
+                writer.write(node.move)
+            number_next_move = False
+
+            comment = node.comment
+            if comment:
+                writer.write_comment(comment)
+                number_next_move = True
+
+            if node.state not in written:
+                written.add(node.state)
+                item.expand = True
+        elif item[0] == "expand":
+            _, state, ply = item
+            continuations = ordered_continuations(state_map.get(state, ()))
+            if not continuations:
+                continue
+            main_edge = Edge(continuations[0], ply)
+            # Pushed in reverse: the main move, its variations, then the rest of the main line
+            stack.append(("follow", main_edge))
+            for node in reversed(continuations[1:]):
+                edge = Edge(node, ply)
+                stack.append(")")
+                stack.append(("follow", edge))
+                stack.append(edge)
+                stack.append("(")
+            stack.append(main_edge)
+        else:
+            _, edge = item
+            if edge.expand:
+                stack.append(("expand", edge.node.state, edge.ply + 1))
+
+    writer.write("*")
+    writer.end_line()
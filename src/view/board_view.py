@@ -1,4 +1,4 @@
-from typing import List, Set, Tuple
+from typing import Dict, List, Set, Tuple
 import pygame
 
 from src.view.promotion_view import PromotionView
@@ -34,6 +34,11 @@ class BoardView():
             self.board_model = board_model
 
         self.detail = "Welcome to Repertoire Trainer!"
+        # Shown below the detail until the board changes, i.e. after a wrong move
+        self.note = ""
+        # The legal moves of the position on the board, computed once per position so selecting
+        # and dropping pieces doesn't have to check them again
+        self.legal_moves: Dict[Pos, Set[Pos]] = self.board_model.legal_move_table()
         self.moving_piece_view: PieceView = None
         self.last_move: Tuple[Pos, Pos] = (None, None)
         self.legal_moves_to_display: List[Pos] = []
@@ -94,16 +99,20 @@ class BoardView():
             The origin position of the move that was just made.
         param dest:
             The destination position of the move that was just made.
+        param comment:
+            The already sanitized comment attached to the move.
         """
         self.board_model = board
+        self.legal_moves = board.legal_move_table()
         for piece in self.pieces:
             piece.kill()
         self.convert_model_to_view()
 
         if append_detail:
-            self.detail = self.detail + "\n---------------\n" + (move_str + "\n" + comment.replace("{", "").replace("}", "").strip()).strip()
+            self.detail = self.detail + "\n---------------\n" + (move_str + "\n" + comment).strip()
         else:
-            self.detail = (move_str + "\n" + comment.replace("{", "").replace("}", "").strip()).strip()
+            self.detail = (move_str + "\n" + comment).strip()
+        self.note = ""
         self.last_move = (origin, dest)
         self.legal_captures_to_display = []
         self.legal_moves_to_display = []